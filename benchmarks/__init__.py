@@ -0,0 +1 @@
+"""Benchmarks of the response generation pipeline of dboard."""
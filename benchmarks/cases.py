@@ -0,0 +1,144 @@
+"""
+The benchmark cases. Each case is a function run inside a request
+context which returns the number of bytes it produced, or None when it
+does not produce a body.
+"""
+import pandas as pd
+import numpy as np
+from flask import Flask
+from sqlalchemy import text
+
+from dboard.response_generators import (
+    construct_json_response_from_query, construct_csv_response_from_query,
+    construct_list_of_dicts_from_query, construct_response_from_df,
+    encode_keyset_cursor)
+from dboard.dboard_flask.data_sources import DBStore
+from dboard.utils.dash_utils import convert_timestamp_indexed_df_to_dt
+
+from .datasets import Transaction
+
+
+PAGE_SIZE = 50
+
+app = Flask(__name__)
+
+
+def response_size(response):
+    if response.is_streamed:
+        return sum(
+            len(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+            for chunk in response.response)
+    return len(response.get_data())
+
+
+def orm_query(session):
+    return session.query(Transaction)
+
+
+def tuple_query(session):
+    return session.query(
+        Transaction.id, Transaction.account, Transaction.category,
+        Transaction.amount, Transaction.day)
+
+
+QUERY_KINDS = [("orm", orm_query), ("tuples", tuple_query)]
+
+
+def construct_query_case(query_engine, build_query, render, query_string=""):
+    def _case():
+        session = query_engine.session()
+        try:
+            with app.test_request_context(query_string=query_string):
+                return render(build_query(session))
+        finally:
+            query_engine.session.remove()
+    return _case
+
+
+def construct_query_cases(query_engine, rows):
+    last_page = max((rows + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    deep_cursor = encode_keyset_cursor([max(rows - PAGE_SIZE, 0)])
+
+    def json_render(**kwargs):
+        return lambda q: response_size(
+            construct_json_response_from_query(q, **kwargs))
+
+    def dicts_render(q):
+        construct_list_of_dicts_from_query(q)
+        return None
+
+    cases = []
+    for kind, build_query in QUERY_KINDS:
+        renders = [
+            ("json", json_render(), ""),
+            ("json_core", json_render(use_core=True), ""),
+            ("json_split", json_render(layout="split"), ""),
+            ("csv", lambda q: response_size(
+                construct_csv_response_from_query(q)), ""),
+            ("csv_stream", lambda q: response_size(
+                construct_csv_response_from_query(q, stream=True)), ""),
+            ("dict", dicts_render, ""),
+            ("page_shallow", json_render(),
+             "page=1&per_page={}".format(PAGE_SIZE)),
+            ("page_deep", json_render(),
+             "page={}&per_page={}".format(last_page, PAGE_SIZE)),
+            ("page_deep_window", json_render(count_strategy="window"),
+             "page={}&per_page={}".format(last_page, PAGE_SIZE)),
+            ("keyset_deep", json_render(count_strategy="none"),
+             "pagination=keyset&per_page={}&cursor={}".format(
+                 PAGE_SIZE, deep_cursor)),
+        ]
+        for name, render, query_string in renders:
+            cases.append((
+                "{}_{}".format(kind, name),
+                construct_query_case(
+                    query_engine, build_query, render,
+                    query_string=query_string)))
+    return cases
+
+
+def construct_dataframe_cases(url):
+    db_store = DBStore(url)
+    state = {}
+
+    def fetch():
+        state["df"] = db_store.sqltodf(
+            text("SELECT * FROM \"transaction\""), index_col="id")
+        return None
+
+    def render(orient):
+        def _case():
+            if "df" not in state:
+                fetch()
+            with app.test_request_context():
+                return response_size(
+                    construct_response_from_df(state["df"], orient=orient))
+        return _case
+
+    return [
+        ("dataframe_fetch", fetch),
+        ("dataframe_json", render("records")),
+        ("dataframe_json_split", render("split")),
+    ]
+
+
+def timestamp_indexed_df(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "revenue": rng.uniform(0, 1e6, rows),
+        "margin": rng.uniform(0, 100, rows),
+        "orders": rng.integers(0, 1000, rows),
+    }, index=pd.date_range("2000-01-01", periods=rows, freq="h"))
+
+
+def construct_dash_cases(rows):
+    df = timestamp_indexed_df(rows)
+    types_of_fields = {"currency": ["revenue"], "percentage": ["margin"]}
+
+    def _case():
+        convert_timestamp_indexed_df_to_dt(
+            df, types_of_fields=types_of_fields,
+            timestamp_col_name_format="%d %b %Y %H:00")
+        return None
+
+    return [("dash_datatable", _case)]
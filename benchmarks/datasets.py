@@ -0,0 +1,98 @@
+"""
+Synthetic SQLite datasets for the benchmarks. Each size is built once
+into its own file under the data directory and reused by later runs.
+"""
+import datetime
+import os
+import random
+
+from sqlalchemy import create_engine, Column, Integer, String, Float
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+try:
+    from sqlalchemy.orm import declarative_base
+except ImportError:
+    from sqlalchemy.ext.declarative import declarative_base
+
+
+Base = declarative_base()
+
+ACCOUNTS = ["account_{}".format(i) for i in range(500)]
+CATEGORIES = ["food", "travel", "rent", "utilities", "salary", "misc"]
+
+INSERT_BATCH_SIZE = 50000
+
+
+class Transaction(Base):
+    __tablename__ = "transaction"
+
+    id = Column(Integer, primary_key=True)
+    account = Column(String(20))
+    category = Column(String(20))
+    amount = Column(Float)
+    quantity = Column(Integer)
+    # Kept as an ISO date string so that every response format can
+    # encode it as is.
+    day = Column(String(10))
+
+
+def dataset_path(data_dir, rows):
+    return os.path.join(data_dir, "transactions_{}.sqlite".format(rows))
+
+
+def generate_transaction_rows(rows, seed=0):
+    rng = random.Random(seed)
+    start = datetime.date(2015, 1, 1)
+    for i in range(1, rows + 1):
+        yield {
+            "id": i,
+            "account": rng.choice(ACCOUNTS),
+            "category": rng.choice(CATEGORIES),
+            "amount": round(rng.uniform(-5000, 5000), 2),
+            "quantity": rng.randint(1, 20),
+            "day": (start + datetime.timedelta(
+                days=rng.randint(0, 3650))).isoformat()
+        }
+
+
+def build_dataset(data_dir, rows):
+    """
+    Returns the url of the SQLite file with rows transactions, creating
+    it when it does not exist yet.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = dataset_path(data_dir, rows)
+    url = "sqlite:///" + path
+    if os.path.exists(path):
+        return url
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    engine = create_engine("sqlite:///" + tmp_path)
+    Base.metadata.create_all(engine)
+    batch = []
+    with engine.begin() as conn:
+        for row in generate_transaction_rows(rows):
+            batch.append(row)
+            if len(batch) == INSERT_BATCH_SIZE:
+                conn.execute(Transaction.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Transaction.__table__.insert(), batch)
+    engine.dispose()
+    os.replace(tmp_path, path)
+    return url
+
+
+class BenchmarkQueryEngine(object):
+    """
+    Stands in for the SqlaQueryBuilder of a data source.
+    """
+
+    def __init__(self, url):
+        self.engine = create_engine(url)
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+
+    def dispose(self):
+        self.session.remove()
+        self.engine.dispose()
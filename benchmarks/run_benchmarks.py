@@ -0,0 +1,229 @@
+"""
+Runs the benchmarks, and saves the results as a json baseline or
+compares them with one.
+
+    python -m benchmarks.run_benchmarks \\
+        --save benchmarks/baselines/baseline.json
+
+    python -m benchmarks.run_benchmarks \\
+        --compare benchmarks/baselines/baseline.json
+
+A comparison runs the dataset sizes of the baseline unless --sizes is
+given. The 1M row dataset has a baseline of its own, since its run
+takes about half an hour:
+
+    python -m benchmarks.run_benchmarks \\
+        --compare benchmarks/baselines/baseline_1m.json
+
+For every case and dataset size, the latency (the minimum and the
+median of --repeat runs), the peak memory allocated by Python during a
+separate traced run, and the size of the output are recorded. A
+comparison exits with status 1 when a case got slower, or used more
+memory, than the baseline by more than the tolerances.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+import sqlalchemy
+
+from .cases import (
+    construct_query_cases, construct_dataframe_cases, construct_dash_cases)
+from .datasets import build_dataset, BenchmarkQueryEngine
+
+
+# The sizes of the saved baseline. baseline_1m.json holds 1000000.
+DEFAULT_SIZES = [10000, 100000]
+
+DEFAULT_DATA_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".data")
+
+
+def measure(case, repeat=3, trace_memory=True):
+    latencies = []
+    output_bytes = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        output_bytes = case()
+        latencies.append(time.perf_counter() - started_at)
+    result = {
+        "latency_min": min(latencies),
+        "latency_median": statistics.median(latencies),
+        "output_bytes": output_bytes,
+    }
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            case()
+            result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def construct_cases(size, data_dir):
+    url = build_dataset(data_dir, size)
+    query_engine = BenchmarkQueryEngine(url)
+    return (
+        construct_query_cases(query_engine, size) +
+        construct_dataframe_cases(url) +
+        construct_dash_cases(size)), query_engine
+
+
+def run_benchmarks(
+        sizes, data_dir=DEFAULT_DATA_DIR, repeat=3, trace_memory=True,
+        case_filter=None, log=print):
+    results = {}
+    for size in sizes:
+        cases, query_engine = construct_cases(size, data_dir)
+        try:
+            for name, case in cases:
+                if case_filter and case_filter not in name:
+                    continue
+                key = "{}[{}]".format(name, size)
+                try:
+                    results[key] = measure(
+                        case, repeat=repeat, trace_memory=trace_memory)
+                except Exception as e:
+                    results[key] = {"error": repr(e)}
+                log(format_result(key, results[key]))
+        finally:
+            query_engine.dispose()
+    return {
+        "meta": {
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "pandas": pd.__version__,
+            "repeat": repeat,
+            "sizes": list(sizes),
+        },
+        "results": results
+    }
+
+
+def format_result(key, result):
+    if "error" in result:
+        return "{:<40} ERROR {}".format(key, result["error"])
+    return "{:<40} {:>10.4f}s {:>12} {:>14}".format(
+        key, result["latency_median"],
+        "-" if result.get("peak_memory_bytes") is None
+        else "{:.1f}MB".format(result["peak_memory_bytes"] / 2 ** 20),
+        "-" if result["output_bytes"] is None
+        else "{}B".format(result["output_bytes"]))
+
+
+# Latencies this close to the baseline are not reported whatever the
+# ratio, since the fastest cases take a few milliseconds.
+DEFAULT_LATENCY_FLOOR = 0.005
+
+# Likewise for the memory of the cases which barely allocate any
+DEFAULT_MEMORY_FLOOR = 2 ** 20
+
+
+def get_baseline_sizes(baseline):
+    """
+    The dataset sizes the baseline was run with, going by the case keys
+    of the baselines saved before the sizes were recorded.
+    """
+    if "sizes" in baseline["meta"]:
+        return baseline["meta"]["sizes"]
+    return sorted({
+        int(key.rsplit("[", 1)[1].rstrip("]"))
+        for key in baseline["results"]})
+
+
+def compare_with_baseline(
+        results, baseline, latency_tolerance=0.25, memory_tolerance=0.25,
+        latency_floor=DEFAULT_LATENCY_FLOOR,
+        memory_floor=DEFAULT_MEMORY_FLOOR):
+    """
+    Returns a list of (case, metric, baseline value, value) for every
+    regression beyond the tolerances, which are fractions of the
+    baseline values, and beyond the floors, which are absolute.
+    """
+    regressions = []
+    checks = [
+        ("latency_median", latency_tolerance, latency_floor),
+        ("peak_memory_bytes", memory_tolerance, memory_floor)]
+    for key, result in results["results"].items():
+        baseline_result = baseline["results"].get(key)
+        if baseline_result is None or "error" in baseline_result:
+            continue
+        if "error" in result:
+            regressions.append((key, "error", None, result["error"]))
+            continue
+        for metric, tolerance, floor in checks:
+            expected = baseline_result.get(metric)
+            actual = result.get(metric)
+            if expected is None or actual is None:
+                continue
+            if actual > expected * (1 + tolerance) and \
+                    actual - expected > floor:
+                regressions.append((key, metric, expected, actual))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=None,
+        help="The dataset sizes, by default the ones of the --compare "
+             "baseline, or {}".format(DEFAULT_SIZES))
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--no-memory", action="store_true",
+        help="Skip the traced run that measures the peak memory")
+    parser.add_argument(
+        "--cases", default=None,
+        help="Only run the cases whose names contain this")
+    parser.add_argument("--save", help="Write the results to this file")
+    parser.add_argument(
+        "--compare", help="Compare the results with this baseline file")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25)
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    sizes = args.sizes
+    if sizes is None:
+        sizes = DEFAULT_SIZES if baseline is None else \
+            get_baseline_sizes(baseline)
+
+    results = run_benchmarks(
+        sizes, data_dir=args.data_dir, repeat=args.repeat,
+        trace_memory=not args.no_memory, case_filter=args.cases)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)),
+                    exist_ok=True)
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare_with_baseline(
+            results, baseline,
+            latency_tolerance=args.latency_tolerance,
+            memory_tolerance=args.memory_tolerance)
+        for key, metric, expected, actual in regressions:
+            print("REGRESSION {} {}: {} -> {}".format(
+                key, metric, expected, actual))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
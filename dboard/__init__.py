@@ -4,12 +4,59 @@ __author__ = """Surya Sankar"""
 __email__ = 'suryashankar.m@gmail.com'
 __version__ = '0.1.0'
 
-from .dboard import *
-from .response_generators import *
-from .utils import *
-from .sqlalchemy_wrappers import *
-from .dboard_flask import (
-    DboardFlask, render_table_layout,
-    prepare_data_sources, construct_sqla_db_uri,
-    sqla_db_info, sqla_query_builder, sqla_base, get_db_store,
-    QueryResponseController, DfResponseController)
+import importlib
+
+
+# The submodules whose public names the package re-exports. They are
+# only imported when one of their names is first looked up, so that
+# importing dboard (say for its CLI) does not load flask, sqlalchemy or
+# the dataframe libraries. The later ones take precedence, as they did
+# when they were star imported in this order.
+REEXPORTED_MODULES = (".response_generators", ".utils")
+
+DBOARD_FLASK_NAMES = (
+    "DboardFlask", "render_table_layout",
+    "prepare_data_sources", "construct_sqla_db_uri",
+    "sqla_db_info", "sqla_query_builder", "sqla_base", "get_db_store",
+    "async_sqla_query_builder", "get_executor_service",
+    "get_slow_query_log", "QueryResponseController",
+    "DfResponseController", "AsyncQueryResponseController",
+    "AsyncDfResponseController")
+
+
+def get_public_names(module):
+    """
+    The names a star import of the module brings in.
+    """
+    if hasattr(module, "__all__"):
+        return list(module.__all__)
+    return [name for name in vars(module) if not name.startswith("_")]
+
+
+def get_reexported_names():
+    names = []
+    for module_name in REEXPORTED_MODULES:
+        names.extend(get_public_names(
+            importlib.import_module(module_name, __name__)))
+    names.extend(DBOARD_FLASK_NAMES)
+    return list(dict.fromkeys(names))
+
+
+def __getattr__(name):
+    if name == "__all__":
+        # Computed on demand, since it takes importing the submodules
+        return get_reexported_names()
+    if name in DBOARD_FLASK_NAMES:
+        return getattr(
+            importlib.import_module(".dboard_flask", __name__), name)
+    if not name.startswith("_"):
+        for module_name in reversed(REEXPORTED_MODULES):
+            module = importlib.import_module(module_name, __name__)
+            if hasattr(module, name):
+                return getattr(module, name)
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(get_reexported_names()))
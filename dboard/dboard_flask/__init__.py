@@ -1,12 +1,25 @@
-from flask import Blueprint, request, url_for, render_template
+from flask import (
+    Blueprint, Response, request, url_for, render_template, current_app)
+import atexit
 import json
+import click
 from toolspy import set_query_params
 from .template_filters import register_template_filters
+from ..response_generators import (
+    refresh_registered_rollups, REGISTERED_RESULT_CACHES)
+from ..utils import (
+    ExecutorService, DEFAULT_METRICS_REGISTRY, SlowQueryLog,
+    DEFAULT_SLOW_QUERY_LOG_SIZE)
 from .data_sources import (
     prepare_data_sources, construct_sqla_db_uri,
-    sqla_db_info, sqla_query_builder, sqla_base, get_db_store)
+    construct_async_sqla_db_uri,
+    sqla_db_info, sqla_query_builder, async_sqla_query_builder,
+    sqla_base, get_db_store, get_engine_registry, get_pool_stats,
+    get_replica_status)
 from .query_response_controller import QueryResponseController
 from .df_response_controller import DfResponseController
+from .async_query_response_controller import AsyncQueryResponseController
+from .async_df_response_controller import AsyncDfResponseController
 
 
 def create_blueprint(
@@ -17,9 +30,78 @@ def create_blueprint(
         blueprint_name, __name__,
         url_prefix=blueprint_url_prefix,
         template_folder="templates")
+
+    @bp.route("/_metrics")
+    def metrics():
+        return Response(
+            DEFAULT_METRICS_REGISTRY.render_prometheus_text(
+                result_caches=REGISTERED_RESULT_CACHES),
+            content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @bp.route("/_slow_queries")
+    def slow_queries():
+        slow_query_log = current_app.extensions.get(
+            "dboard", {}).get("slow_query_log")
+        limit = request.args.get("limit", type=int)
+        entries = [] if slow_query_log is None else \
+            slow_query_log.get_entries(
+                endpoint=request.args.get("endpoint"),
+                db_name=request.args.get("db"), limit=limit)
+        if request.args.get("format") == "json":
+            return Response(
+                json.dumps({
+                    "enabled": slow_query_log is not None,
+                    "entries": entries}),
+                content_type="application/json")
+        return render_template(
+            "dboard/default_theme/slow_queries.html",
+            slow_query_log=slow_query_log, entries=entries)
+
     return bp
 
 
+def get_executor_service():
+    return current_app.extensions["dboard"]["executor_service"]
+
+
+def get_slow_query_log():
+    return current_app.extensions["dboard"].get("slow_query_log")
+
+
+def attach_slow_query_log(app, data_sources):
+    """
+    Attaches a SlowQueryLog to the engines of the data sources, their
+    replicas included, when DBOARD_SLOW_QUERY_THRESHOLD is configured,
+    or a data source has a slow_query_threshold of its own. Returns the
+    log, or None.
+    """
+    threshold = app.config.get("DBOARD_SLOW_QUERY_THRESHOLD")
+    thresholds = {
+        db_name: db_dict.get("slow_query_threshold", threshold)
+        for db_name, db_dict in data_sources.items()}
+    if all(t is None for t in thresholds.values()):
+        return None
+    slow_query_log = SlowQueryLog(
+        max_entries=app.config.get(
+            "DBOARD_SLOW_QUERY_LOG_SIZE", DEFAULT_SLOW_QUERY_LOG_SIZE),
+        explain=app.config.get("DBOARD_SLOW_QUERY_EXPLAIN", True))
+    for db_name, db_dict in data_sources.items():
+        if thresholds[db_name] is None:
+            continue
+        engines = [db_dict["engine"]]
+        if db_dict.get("replica_router") is not None:
+            engines.extend(
+                replica.engine
+                for replica in db_dict["replica_router"].replicas)
+        if db_dict.get("async_engine") is not None:
+            engines.append(db_dict["async_engine"].sync_engine)
+        for engine in engines:
+            slow_query_log.attach(
+                engine, db_name=db_name, threshold=thresholds[db_name])
+    app.extensions["dboard"]["slow_query_log"] = slow_query_log
+    return slow_query_log
+
+
 def render_table_layout(
         api_url,
         table_heading,
@@ -51,21 +133,27 @@ class DboardFlask(object):
     def __init__(
             self, app, blueprint_name="dboard",
             blueprint_url_prefix="/dboard",
-            nav_menu_items=None, engine_kwargs=None):
+            nav_menu_items=None, engine_kwargs=None,
+            prewarm_connections=None):
         self.pages_bp = None
         if app is not None:
             self.init_app(
                 app, blueprint_name=blueprint_name,
                 blueprint_url_prefix=blueprint_url_prefix,
                 nav_menu_items=nav_menu_items,
-                engine_kwargs=engine_kwargs)
+                engine_kwargs=engine_kwargs,
+                prewarm_connections=prewarm_connections)
 
     def init_app(
             self, app, blueprint_name="dboard",
             blueprint_url_prefix="/dboard",
-            nav_menu_items=None, engine_kwargs=None):
+            nav_menu_items=None, engine_kwargs=None,
+            prewarm_connections=None):
         '''Initalizes the application with the extension.
         :param app: The Flask application object.
+        :param prewarm_connections: True to open as many connections as
+            each pool keeps, or the number of connections to open per
+            data source before the first request.
         '''
         self.pages_bp = create_blueprint(
             app, blueprint_name=blueprint_name,
@@ -73,7 +161,33 @@ class DboardFlask(object):
         app.register_blueprint(self.pages_bp)
         register_template_filters(app)
         prepare_data_sources(
-            app.config["DATA_SOURCES"], app, engine_kwargs=engine_kwargs)
+            app.config["DATA_SOURCES"], app, engine_kwargs=engine_kwargs,
+            metadata_cache_dir=app.config.get("DBOARD_METADATA_CACHE_DIR"),
+            metadata_cache_ttl=app.config.get("DBOARD_METADATA_CACHE_TTL"))
+        executor_service = ExecutorService(
+            max_threads=app.config.get("DBOARD_EXECUTOR_MAX_THREADS"),
+            max_processes=app.config.get("DBOARD_EXECUTOR_MAX_PROCESSES"),
+            default_timeout=app.config.get("DBOARD_EXECUTOR_TIMEOUT"))
+        app.extensions["dboard"]["executor_service"] = executor_service
+        atexit.register(executor_service.shutdown, wait=False)
+        attach_slow_query_log(app, app.config["DATA_SOURCES"])
+        if prewarm_connections is None:
+            prewarm_connections = app.config.get(
+                "DBOARD_PREWARM_CONNECTIONS")
+        if prewarm_connections:
+            app.extensions["dboard"]["engine_registry"].prewarm(
+                connections=None if prewarm_connections is True
+                else prewarm_connections)
+
+        @app.cli.command("dboard-refresh-rollups")
+        @click.option(
+            "--full", is_flag=True,
+            help="Rebuild the rollups instead of refreshing the changes")
+        def refresh_rollups(full):
+            """Refreshes the rollups of the registered endpoints."""
+            for name, months in refresh_registered_rollups(
+                    full=full).items():
+                click.echo("{}: {} months refreshed".format(name, months))
 
         @app.context_processor
         def inject_nav_menu_items():
@@ -0,0 +1,65 @@
+from .df_response_controller import DfResponseController
+from ..response_generators import (
+    construct_response_from_df, construct_request_cache_key,
+    async_construct_cached_response, async_construct_conditional_response,
+    compress_response, instrument_response,
+    register_controller_result_cache)
+from ..utils import timed_stage, record_stage_count, collect_stage_timings
+
+
+class AsyncDfResponseController(DfResponseController):
+    """
+    A DfResponseController whose get_df is a coroutine function, to be
+    used from async views. DBStore.async_sqltodf fetches the frames
+    without blocking the worker.
+    """
+
+    async def get_df(self, start=None):
+        raise NotImplementedError
+
+    async def get_data_version(self):
+        return None
+
+    async def get_cached_df(self):
+        return await self.timeseries_cache.async_get_df(
+            self.get_timeseries_cache_key_parts(),
+            lambda start: self.get_df(start=start),
+            version=self.get_timeseries_version())
+
+    async def construct_response(self):
+        with timed_stage("get_df"):
+            if self.timeseries_cache is None:
+                df = await self.get_df()
+            else:
+                df = await self.get_cached_df()
+        record_stage_count("rows", len(df))
+        with timed_stage("encode"):
+            return construct_response_from_df(
+                df, response_format=self.response_format,
+                orient=self.get_json_orient())
+
+    async def render_response(self):
+        with collect_stage_timings() as timings:
+            response = await self.render_timed_response()
+        return instrument_response(response, timings)
+
+    async def render_timed_response(self):
+        if not self.conditional:
+            response = await self.render_cached_response()
+        else:
+            with timed_stage("data_version"):
+                data_version = await self.get_data_version()
+            response = await async_construct_conditional_response(
+                self.render_cached_response, data_version=data_version)
+        return compress_response(response, self.compression)
+
+    async def render_cached_response(self):
+        if self.result_cache is None:
+            return await self.construct_response()
+        return await async_construct_cached_response(
+            register_controller_result_cache(self),
+            construct_request_cache_key(
+                type(self).__module__, type(self).__qualname__,
+                self.params, self.response_format),
+            self.construct_response, ttl=self.result_cache_ttl,
+            compression=self.compression)
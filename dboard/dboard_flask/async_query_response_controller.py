@@ -0,0 +1,70 @@
+import asyncio
+import inspect
+from werkzeug.exceptions import GatewayTimeout
+from .data_sources import async_sqla_query_builder
+from .query_response_controller import QueryResponseController
+from ..response_generators import (
+    buffer_streamed_response, instrument_response,
+    raise_for_statement_timeout)
+from ..utils import (
+    StatementTimeout, DEFAULT_WATCHDOG_GRACE, timed_stage,
+    collect_stage_timings, query_source)
+
+
+class AsyncQueryResponseController(QueryResponseController):
+    """
+    Runs the query on the async engine of the data source, to be used
+    from async views. query can be a coroutine function. It builds the
+    query with self.session, an AsyncQuerySession, and can await other
+    statements on it. self.db_store.async_sqltodf is available too.
+    """
+
+    def __init__(
+            self, datasource_name=None, response_format=None,
+            params=None):
+        super().__init__(
+            datasource_name=datasource_name,
+            response_format=response_format, params=params)
+        self.query_engine = async_sqla_query_builder(self.datasource_name)
+        self.session = None
+
+    async def render_response(self):
+        with query_source(filter_params=self.params), \
+                collect_stage_timings() as timings:
+            response = await self.render_timed_response()
+        return instrument_response(response, timings)
+
+    async def render_timed_response(self):
+        async with self.query_engine.session() as session:
+            self.session = session
+            try:
+                with timed_stage("query_constructor"):
+                    q = self.query()
+                    if inspect.isawaitable(q):
+                        q = await q
+                if not self.statement_timeout:
+                    return await session.run_sync(self.render_sync_query, q)
+                try:
+                    return await asyncio.wait_for(
+                        session.run_sync(self.render_sync_query, q),
+                        self.statement_timeout + DEFAULT_WATCHDOG_GRACE)
+                except asyncio.TimeoutError as e:
+                    raise GatewayTimeout(
+                        "The query took longer than {} seconds".format(
+                            self.statement_timeout)) from e
+            finally:
+                self.session = None
+
+    def render_sync_query(self, sync_session, q):
+        if not self.statement_timeout:
+            return buffer_streamed_response(self.render_query(q))
+        statement_guard = StatementTimeout(
+            sync_session, self.statement_timeout).start(watchdog=False)
+        try:
+            return buffer_streamed_response(self.render_query(q))
+        except Exception as e:
+            # A cancelled statement is a timeout, like on the sync path
+            raise_for_statement_timeout(statement_guard, e)
+            raise
+        finally:
+            statement_guard.stop()
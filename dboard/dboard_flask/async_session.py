@@ -0,0 +1,12 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class AsyncQuerySession(AsyncSession):
+    """
+    An AsyncSession that also builds ORM queries like a Session does.
+    The queries are bound to the sync session underneath and have to be
+    executed through run_sync.
+    """
+
+    def query(self, *entities, **kwargs):
+        return self.sync_session.query(*entities, **kwargs)
@@ -1,52 +1,368 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, inspect, text, MetaData
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import scoped_session, sessionmaker
 from flask import current_app
 from toolspy import merge, fetch_nested_key_from_dict
-import pandas as pd
+
+from .engine_registry import EngineRegistry
+from ..utils.replica_utils import (
+    ReplicaRouter, RoutingSession, current_replication_lag_limit,
+    DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL)
+
+
+# Queries whose results change whenever the schema does, covering the
+# columns, constraints (with the columns they key and refer to) and
+# indexes that reflection looks up. They are cheap next to a full
+# reflection, which does so table by table.
+SCHEMA_FINGERPRINT_QUERIES = {
+    "mysql": [
+        "SELECT table_name, column_name, column_type, is_nullable, "
+        "column_key FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() "
+        "ORDER BY table_name, ordinal_position",
+        "SELECT table_name, constraint_name, constraint_type "
+        "FROM information_schema.table_constraints "
+        "WHERE table_schema = DATABASE() "
+        "ORDER BY table_name, constraint_name",
+        "SELECT table_name, constraint_name, column_name, "
+        "ordinal_position, referenced_table_name, referenced_column_name "
+        "FROM information_schema.key_column_usage "
+        "WHERE table_schema = DATABASE() "
+        "ORDER BY table_name, constraint_name, ordinal_position",
+        "SELECT table_name, index_name, non_unique, seq_in_index, "
+        "column_name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() "
+        "ORDER BY table_name, index_name, seq_in_index",
+    ],
+    "postgresql": [
+        "SELECT table_name, column_name, data_type, is_nullable "
+        "FROM information_schema.columns "
+        "WHERE table_schema = current_schema() "
+        "ORDER BY table_name, ordinal_position",
+        "SELECT table_name, constraint_name, constraint_type "
+        "FROM information_schema.table_constraints "
+        "WHERE table_schema = current_schema() "
+        "ORDER BY table_name, constraint_name",
+        "SELECT table_name, constraint_name, column_name, ordinal_position "
+        "FROM information_schema.key_column_usage "
+        "WHERE table_schema = current_schema() "
+        "ORDER BY table_name, constraint_name, ordinal_position",
+        "SELECT table_name, constraint_name, column_name "
+        "FROM information_schema.constraint_column_usage "
+        "WHERE constraint_schema = current_schema() "
+        "ORDER BY table_name, constraint_name, column_name",
+        "SELECT tablename, indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() "
+        "ORDER BY tablename, indexname",
+    ],
+    # The DDL of the tables, with their constraints, and of the indexes
+    "sqlite": ["SELECT type, name, tbl_name, sql FROM sqlite_master "
+               "ORDER BY name"],
+}
+
 
 def construct_sqla_db_uri(db_dict):
     return "{db_type}://{db_user}:{db_password}@{db_server}/{db_name}".format(
         **db_dict)
 
-def setup_db(conn_string):
-    db_engine = create_engine(conn_string)
-    db_metadata = MetaData()
-    db_metadata.reflect(bind=db_engine)
-    return db_engine, db_metadata
+
+def construct_replica_db_dicts(db_dict):
+    """
+    The replicas of a data source are given either as the db_server of
+    each, or as dicts overriding the keys of the data source that differ
+    for them, like {"db_server": "replica-1", "db_user": "reader"}.
+    """
+    for replica in db_dict.get("replicas") or []:
+        if isinstance(replica, str):
+            replica = {"db_server": replica}
+        yield merge(db_dict, replica)
+
+
+def construct_async_sqla_db_uri(db_dict):
+    return construct_sqla_db_uri(
+        merge(db_dict, {"db_type": db_dict["async_db_type"]}))
+
+
+def setup_db(conn_string, metadata=None, engine=None):
+    db_engine = engine if engine is not None else create_engine(conn_string)
+    if metadata is None:
+        metadata = MetaData()
+        metadata.reflect(bind=db_engine)
+    return db_engine, metadata
+
 
 class DBStore:
-    def __init__(self, conn_string):
+    def __init__(
+            self, conn_string, metadata=None, engine=None,
+            async_engine=None, replica_router=None):
         self.conn_string = conn_string
-        self.engine, self.metadata = setup_db(conn_string)
+        self.engine, self.metadata = setup_db(
+            conn_string, metadata=metadata, engine=engine)
+        self.async_engine = async_engine
+        self.replica_router = replica_router
         self.tables = self.metadata.tables
-    
-    def sqltodf(self, stmt, index_col=None):
-        return pd.read_sql(stmt, self.engine, index_col=index_col)
 
+    def sqltodf(self, stmt, index_col=None, max_replication_lag=None):
+        """
+        Reads from a replica when the data source has some, lagging at
+        most max_replication_lag seconds behind (by default the limit of
+        the enclosing replication_lag_limit). The read is retried on the
+        primary when the connection to the replica turns out broken.
+        """
+        import pandas as pd
+        if self.replica_router is None:
+            return pd.read_sql(stmt, self.engine, index_col=index_col)
+        if max_replication_lag is None:
+            max_replication_lag = current_replication_lag_limit()
+        engine = self.replica_router.choose_engine(
+            max_lag=max_replication_lag)
+        try:
+            return pd.read_sql(stmt, engine, index_col=index_col)
+        except DBAPIError as e:
+            if engine is self.engine or not e.connection_invalidated:
+                raise
+            return pd.read_sql(stmt, self.engine, index_col=index_col)
+
+    async def async_sqltodf(self, stmt, index_col=None):
+        import pandas as pd
+        if self.async_engine is None:
+            raise ValueError(
+                "The data source has no async engine. Set its async_db_type")
+        async with self.async_engine.connect() as conn:
+            return await conn.run_sync(
+                lambda sync_conn: pd.read_sql(
+                    stmt, sync_conn, index_col=index_col))
+
+
+def compute_schema_fingerprint(engine, fingerprint_query=None):
+    """
+    A digest of the results of fingerprint_query, a query or a list of
+    them, by default the SCHEMA_FINGERPRINT_QUERIES of the dialect.
+    Dialects without any get their table names hashed.
+    """
+    if fingerprint_query is None:
+        fingerprint_query = SCHEMA_FINGERPRINT_QUERIES.get(
+            engine.dialect.name)
+    if isinstance(fingerprint_query, str):
+        fingerprint_query = [fingerprint_query]
+    with engine.connect() as conn:
+        if fingerprint_query is None:
+            schema_description = sorted(inspect(conn).get_table_names())
+        else:
+            schema_description = [
+                [tuple(row) for row in conn.execute(text(query))]
+                for query in fingerprint_query]
+    return hashlib.sha1(
+        repr(schema_description).encode('utf-8')).hexdigest()
+
+
+def metadata_cache_path(cache_dir, db_name):
+    return os.path.join(cache_dir, "{}.metadata.pickle".format(db_name))
+
+
+def load_cached_metadata(
+        cache_path, fingerprint=None, ttl=None):
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cached = pickle.load(cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+        return None
+    if ttl is not None and cached["created_at"] + ttl < time.time():
+        return None
+    if fingerprint is not None and cached["fingerprint"] != fingerprint:
+        return None
+    return cached["metadata"]
+
+
+def save_metadata_to_cache(cache_path, metadata, fingerprint=None):
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, 'wb') as tmp_file:
+        pickle.dump({
+            "fingerprint": fingerprint,
+            "created_at": time.time(),
+            "metadata": metadata
+        }, tmp_file)
+    os.replace(tmp_path, cache_path)
+
+
+def reflect_metadata(
+        engine, db_name=None, cache_dir=None, cache_ttl=None,
+        fingerprint_query=None):
+    """
+    Reflects the database once. When a cache_dir is given, the reflected
+    metadata is pickled there and reused by the next workers as long as
+    the schema fingerprint matches and the cache is younger than
+    cache_ttl seconds. The fingerprint check can be turned off by
+    passing fingerprint_query=False, leaving the ttl as the only
+    invalidation.
+    """
+    if cache_dir is None:
+        metadata = MetaData()
+        metadata.reflect(bind=engine)
+        return metadata
+    fingerprint = None
+    if fingerprint_query is not False:
+        fingerprint = compute_schema_fingerprint(
+            engine, fingerprint_query=fingerprint_query)
+    cache_path = metadata_cache_path(cache_dir, db_name)
+    metadata = load_cached_metadata(
+        cache_path, fingerprint=fingerprint, ttl=cache_ttl)
+    if metadata is None:
+        metadata = MetaData()
+        metadata.reflect(bind=engine)
+        save_metadata_to_cache(cache_path, metadata, fingerprint=fingerprint)
+    return metadata
 
-def prepare_data_sources(data_sources, app, engine_kwargs=None):
+
+class SqlaQueryBuilder(object):
+    """
+    The query_engine handed to query constructors. Its session is a
+    scoped session bound to the engine of the data source, or, when the
+    data source has replicas, a RoutingSession reading from the replica
+    the replica_router picks.
+    """
+
+    def __init__(self, engine, replica_router=None):
+        self.engine = engine
+        self.replica_router = replica_router
+        if replica_router is None:
+            self.session = scoped_session(sessionmaker(bind=engine))
+        else:
+            self.session = scoped_session(sessionmaker(
+                bind=engine, class_=RoutingSession, router=replica_router))
+
+
+class AsyncSqlaQueryBuilder(object):
+    """
+    The query_engine of the async endpoints. Its session makes a new
+    AsyncQuerySession bound to the async engine of the data source on
+    every call.
+    """
+
+    is_async = True
+
+    def __init__(self, engine):
+        from .async_session import AsyncQuerySession
+        self.engine = engine
+        self.session = sessionmaker(
+            bind=engine, class_=AsyncQuerySession, expire_on_commit=False)
+
+
+def construct_replica_router(
+        db_name, db_dict, engine_registry, engine_kwargs=None):
+    """
+    Creates an engine for each of the replicas of the data source, named
+    like "<db_name>:replica<n>" in the engine registry, and the router
+    balancing the reads among them (replica_balancing "round_robin" or
+    "least_connections").
+    """
+    replica_engines = []
+    for index, replica_dict in enumerate(construct_replica_db_dicts(db_dict)):
+        replica_name = "{}:replica{}".format(db_name, index + 1)
+        replica_engines.append((
+            replica_name, engine_registry.create_engine(
+                replica_name, construct_sqla_db_uri(replica_dict),
+                **(engine_kwargs or {}))))
+    return ReplicaRouter(
+        db_dict["engine"], replica_engines,
+        balancing=db_dict.get("replica_balancing", "round_robin"),
+        health_check_interval=db_dict.get(
+            "replica_health_check_interval",
+            DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL),
+        lag_query=db_dict.get("replica_lag_query"))
+
+
+def prepare_data_sources(
+        data_sources, app, engine_kwargs=None, metadata_cache_dir=None,
+        metadata_cache_ttl=None, engine_registry=None):
+    if engine_registry is None:
+        engine_registry = EngineRegistry()
+    if app is not None:
+        app.extensions.setdefault("dboard", {})[
+            "engine_registry"] = engine_registry
     for db_name, db_dict in data_sources.items():
         engine_kwargs_for_db = merge(
             fetch_nested_key_from_dict(engine_kwargs, '*') or {},
             fetch_nested_key_from_dict(engine_kwargs, db_name) or {}
         )
         db_dict["sqla_db_uri"] = construct_sqla_db_uri(db_dict)
-        db_dict["db_store"] = DBStore(db_dict["sqla_db_uri"])
-        db_dict["engine"] = create_engine(
-            db_dict["sqla_db_uri"], **engine_kwargs_for_db)
+        db_dict["engine"] = engine_registry.create_engine(
+            db_name, db_dict["sqla_db_uri"], **engine_kwargs_for_db)
+        db_dict["replica_router"] = None
+        if db_dict.get("replicas"):
+            db_dict["replica_router"] = construct_replica_router(
+                db_name, db_dict, engine_registry,
+                engine_kwargs=engine_kwargs_for_db)
+        if db_dict.get("async_db_type"):
+            # The sync pool classes cannot be used with an async engine,
+            # so its pool is set up by async_engine_kwargs alone (see
+            # EngineRegistry.create_async_engine).
+            db_dict["async_sqla_db_uri"] = construct_async_sqla_db_uri(
+                db_dict)
+            db_dict["async_engine"] = engine_registry.create_async_engine(
+                db_name, db_dict["async_sqla_db_uri"],
+                **merge(
+                    {k: v for k, v in engine_kwargs_for_db.items()
+                     if not k.startswith("pool")},
+                    db_dict.get("async_engine_kwargs") or {}))
+            db_dict["async_query_builder"] = AsyncSqlaQueryBuilder(
+                db_dict["async_engine"])
+        metadata = reflect_metadata(
+            db_dict["engine"], db_name=db_name,
+            cache_dir=db_dict.get("metadata_cache_dir", metadata_cache_dir),
+            cache_ttl=db_dict.get("metadata_cache_ttl", metadata_cache_ttl),
+            fingerprint_query=db_dict.get("schema_fingerprint_query"))
+        db_dict["db_store"] = DBStore(
+            db_dict["sqla_db_uri"], metadata=metadata,
+            engine=db_dict["engine"],
+            async_engine=db_dict.get("async_engine"),
+            replica_router=db_dict["replica_router"])
+        db_dict["query_builder"] = SqlaQueryBuilder(
+            db_dict["engine"], replica_router=db_dict["replica_router"])
         if db_dict.get("automap_tables"):
-            db_dict["metadata"] = MetaData()
-            db_dict["metadata"].reflect(db_dict["engine"])
+            db_dict["metadata"] = metadata
         elif db_dict.get("automap_orm"):
-            db_dict["base"] = automap_base()
-            db_dict["base"].prepare(db_dict["engine"], reflect=True)
+            db_dict["base"] = automap_base(metadata=metadata)
+            db_dict["base"].prepare()
 
 
 def sqla_db_info(db_name):
     return current_app.config["DATA_SOURCES"][db_name]
 
+
 def sqla_base(db_name):
     return sqla_db_info(db_name)["base"]
 
+
+def sqla_query_builder(db_name):
+    return sqla_db_info(db_name)["query_builder"]
+
+
+def async_sqla_query_builder(db_name):
+    return sqla_db_info(db_name)["async_query_builder"]
+
+
+def get_engine_registry():
+    return current_app.extensions["dboard"]["engine_registry"]
+
+
+def get_pool_stats(db_name=None):
+    return get_engine_registry().pool_stats(db_name)
+
+
 def get_db_store(db_name):
     return sqla_db_info(db_name)["db_store"]
+
+
+def get_replica_status(db_name):
+    replica_router = sqla_db_info(db_name).get("replica_router")
+    return [] if replica_router is None else replica_router.status()
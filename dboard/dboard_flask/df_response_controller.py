@@ -1,5 +1,10 @@
 from flask import request
-from ..response_generators import fetch_filter_params, construct_response_from_df
+from ..response_generators import (
+    fetch_filter_params, construct_response_from_df,
+    construct_request_cache_key, construct_cached_response,
+    construct_instrumented_response, construct_conditional_response,
+    compress_response, register_controller_result_cache, DF_JSON_ORIENTS)
+from ..utils import timed_stage, record_stage_count, replication_lag_limit
 
 
 class DfResponseController(object):
@@ -7,6 +12,31 @@ class DfResponseController(object):
     class ParamSchema:
         pass
 
+    # The orient of the json payload when the request does not ask for
+    # one with the orient arg. One of DF_JSON_ORIENTS
+    json_orient = 'records'
+
+    # A ResultCache shared by all the requests served by the controller
+    result_cache = None
+    result_cache_ttl = None
+
+    # A TimeSeriesCache keeping the closed periods of the frames, per
+    # filter params. get_df is then called with the start of the rows
+    # it has to fetch, None meaning all of them.
+    timeseries_cache = None
+
+    # Answer the requests which already have the response with a 304,
+    # going by get_data_version, or by a hash of the payload when it
+    # returns None
+    conditional = False
+
+    # The config of compress_response, like {"level": 6, "min_size": 1024}
+    compression = None
+
+    # Seconds the replicas read from by DBStore.sqltodf in get_df may lag
+    # behind the primary. 0 reads from the primary
+    max_replication_lag = None
+
     def __init__(
             self, response_format=None, params=None):
         self.response_format = response_format or self.get_response_format()
@@ -16,8 +46,70 @@ class DfResponseController(object):
     def get_response_format(self):
         return request.args.get('format') or 'json'
 
-    def get_df(self):
+    def get_json_orient(self):
+        orient = request.args.get('orient')
+        return orient if orient in DF_JSON_ORIENTS else self.json_orient
+
+    def get_df(self, start=None):
         raise NotImplementedError
 
+    def get_data_version(self):
+        """
+        A cheap signal of the data changing, like the max updated_at of
+        the tables get_df reads, checked before get_df is called.
+        """
+        return None
+
+    def get_timeseries_version(self):
+        """
+        A value that changes when the cached history is corrected, like
+        its max updated_at, to discard the cached closed periods.
+        """
+        return None
+
+    def get_timeseries_cache_key_parts(self):
+        return (type(self).__module__, type(self).__qualname__, self.params)
+
+    def get_cached_df(self):
+        return self.timeseries_cache.get_df(
+            self.get_timeseries_cache_key_parts(),
+            lambda start: self.get_df(start=start),
+            version=self.get_timeseries_version())
+
+    def construct_response(self):
+        with timed_stage("get_df"):
+            if self.timeseries_cache is None:
+                df = self.get_df()
+            else:
+                df = self.get_cached_df()
+        record_stage_count("rows", len(df))
+        with timed_stage("encode"):
+            return construct_response_from_df(
+                df, response_format=self.response_format,
+                orient=self.get_json_orient())
+
     def render_response(self):
-        return construct_response_from_df(self.get_df())
\ No newline at end of file
+        with replication_lag_limit(self.max_replication_lag):
+            return construct_instrumented_response(
+                self.render_timed_response)
+
+    def render_timed_response(self):
+        if not self.conditional:
+            response = self.render_cached_response()
+        else:
+            with timed_stage("data_version"):
+                data_version = self.get_data_version()
+            response = construct_conditional_response(
+                self.render_cached_response, data_version=data_version)
+        return compress_response(response, self.compression)
+
+    def render_cached_response(self):
+        if self.result_cache is None:
+            return self.construct_response()
+        return construct_cached_response(
+            register_controller_result_cache(self),
+            construct_request_cache_key(
+                type(self).__module__, type(self).__qualname__,
+                self.params, self.response_format),
+            self.construct_response, ttl=self.result_cache_ttl,
+            compression=self.compression)
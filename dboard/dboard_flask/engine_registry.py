@@ -0,0 +1,146 @@
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+
+class CheckoutTimingPoolMixin(object):
+    """
+    Records how long callers had to wait for a connection to be checked
+    out of the pool, which includes the time spent opening new
+    connections and waiting on an exhausted pool.
+    """
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            self.record_checkout_wait(time.perf_counter() - started_at)
+
+    def record_checkout_wait(self, wait_time):
+        lock = self.__dict__.setdefault(
+            "_checkout_stats_lock", threading.Lock())
+        with lock:
+            self.checkouts = getattr(self, "checkouts", 0) + 1
+            self.total_checkout_wait = getattr(
+                self, "total_checkout_wait", 0.0) + wait_time
+            self.max_checkout_wait = max(
+                getattr(self, "max_checkout_wait", 0.0), wait_time)
+
+
+_instrumented_pool_classes = {}
+
+
+def instrumented_pool_class(pool_class):
+    if pool_class not in _instrumented_pool_classes:
+        _instrumented_pool_classes[pool_class] = type(
+            "CheckoutTiming" + pool_class.__name__,
+            (CheckoutTimingPoolMixin, pool_class), {})
+    return _instrumented_pool_classes[pool_class]
+
+
+def default_pool_class(db_uri):
+    url = make_url(db_uri)
+    return url.get_dialect().get_pool_class(url)
+
+
+def pool_stats(pool):
+    stats = {"pool_class": type(pool).__name__}
+    for name in ["size", "checkedin", "checkedout", "overflow"]:
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    checkouts = getattr(pool, "checkouts", 0)
+    stats["checkouts"] = checkouts
+    stats["total_checkout_wait"] = getattr(pool, "total_checkout_wait", 0.0)
+    stats["max_checkout_wait"] = getattr(pool, "max_checkout_wait", 0.0)
+    stats["avg_checkout_wait"] = (
+        stats["total_checkout_wait"] / checkouts if checkouts else 0.0)
+    return stats
+
+
+class EngineRegistry(object):
+    """
+    Holds the one engine, and so the one connection pool, of each data
+    source. Everything that talks to a data source - the query builder
+    sessions, the DBStore and the automapped base - goes through it.
+    """
+
+    def __init__(self):
+        self.engines = {}
+        self.async_engines = {}
+
+    def create_engine(self, db_name, db_uri, **engine_kwargs):
+        engine_kwargs["poolclass"] = instrumented_pool_class(
+            engine_kwargs.get("poolclass") or default_pool_class(db_uri))
+        engine = create_engine(db_uri, **engine_kwargs)
+        if db_name in self.engines:
+            self.engines[db_name].dispose()
+        self.engines[db_name] = engine
+        return engine
+
+    def get_engine(self, db_name):
+        return self.engines[db_name]
+
+    def create_async_engine(self, db_name, db_uri, **engine_kwargs):
+        """
+        Creates the engine used by the async endpoints of a data source.
+        db_uri has to name an asyncio driver, like postgresql+asyncpg or
+        sqlite+aiosqlite.
+
+        Flask runs each async view on an event loop of its own, and the
+        connections of an asyncio driver cannot be used from a loop other
+        than the one they were opened on. So unless a poolclass is given,
+        the connections are not pooled (NullPool), and each session opens
+        its own. Under an ASGI server, where the views share one loop, a
+        pool like AsyncAdaptedQueuePool can be passed as the poolclass.
+        """
+        from sqlalchemy.ext.asyncio import create_async_engine
+        engine_kwargs["poolclass"] = instrumented_pool_class(
+            engine_kwargs.get("poolclass") or NullPool)
+        engine = create_async_engine(db_uri, **engine_kwargs)
+        if db_name in self.async_engines:
+            self.async_engines[db_name].sync_engine.dispose()
+        self.async_engines[db_name] = engine
+        return engine
+
+    def get_async_engine(self, db_name):
+        return self.async_engines[db_name]
+
+    def pool_stats(self, db_name=None):
+        if db_name is not None:
+            return pool_stats(self.engines[db_name].pool)
+        return {
+            name: pool_stats(engine.pool)
+            for name, engine in self.engines.items()}
+
+    def prewarm(self, db_name=None, connections=None):
+        """
+        Opens connections up front so that the first requests do not pay
+        for setting them up. By default as many as the pool keeps open
+        are opened.
+        """
+        db_names = [db_name] if db_name is not None else list(self.engines)
+        for name in db_names:
+            engine = self.engines[name]
+            count = connections
+            if count is None:
+                count = engine.pool.size() if hasattr(
+                    engine.pool, "size") else 1
+            opened = []
+            try:
+                for _ in range(count):
+                    opened.append(engine.connect())
+            finally:
+                for conn in opened:
+                    conn.close()
+
+    def dispose(self):
+        for engine in self.engines.values():
+            engine.dispose()
+
+    async def dispose_async_engines(self):
+        for engine in self.async_engines.values():
+            await engine.dispose()
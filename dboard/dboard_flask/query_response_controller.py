@@ -1,7 +1,13 @@
 from flask import request
 from .data_sources import sqla_base, sqla_query_builder, get_db_store
 from ..response_generators import (
-    fetch_filter_params, construct_response_from_query)
+    fetch_filter_params, construct_response_from_query,
+    construct_result_cache_key, construct_cached_response,
+    raise_for_statement_timeout, construct_instrumented_response,
+    register_controller_result_cache)
+from ..utils import (
+    StatementTimeout, timed_stage, query_source, replication_lag_limit,
+    begin_routed_transaction)
 
 
 class QueryResponseController(object):
@@ -9,6 +15,24 @@ class QueryResponseController(object):
     class ParamSchema:
         pass
 
+    count_strategy = None
+    count_cache_ttl = None
+    use_core = False
+    # One of QUERY_RESULT_LAYOUTS, overridden by the layout request arg
+    layout = None
+
+    # Seconds the statements run on the scoped session of the query
+    # engine may take while the response is rendered
+    statement_timeout = None
+
+    # A ResultCache shared by all the requests served by the controller
+    result_cache = None
+    result_cache_ttl = None
+
+    # Seconds the replica read from may lag behind the primary, when the
+    # data source has replicas. 0 reads from the primary
+    max_replication_lag = None
+
     def __init__(
             self, datasource_name=None, response_format=None,
             params=None):
@@ -31,9 +55,61 @@ class QueryResponseController(object):
 
     def construct_response(self, q):
         return construct_response_from_query(
-            q, response_format=self.response_format)
+            q, response_format=self.response_format,
+            count_strategy=self.count_strategy,
+            count_cache_ttl=self.count_cache_ttl, use_core=self.use_core,
+            layout=self.layout)
 
     def render_response(self):
-        return self.construct_response(self.query())
+        with query_source(filter_params=self.params), \
+                replication_lag_limit(self.max_replication_lag):
+            return construct_instrumented_response(
+                self.render_timed_response)
+
+    def timed_query(self):
+        with timed_stage("query_constructor"):
+            return self.query()
+
+    def render_timed_response(self):
+        session = self.query_engine.session()
+        statement_guard = None
+        try:
+            # Streamed bodies read the rows after the replication lag
+            # limit of render_response is exited
+            begin_routed_transaction(session)
+            if self.statement_timeout:
+                statement_guard = StatementTimeout(
+                    session, self.statement_timeout).start()
+            response = self.render_query(self.timed_query())
+        except Exception as e:
+            if statement_guard is not None:
+                statement_guard.stop()
+            # A cancelled statement leaves the transaction aborted on
+            # postgres, which would fail the next request of the thread
+            session.rollback()
+            session.close()
+            raise_for_statement_timeout(statement_guard, e)
+            raise
+
+        def release_session():
+            if statement_guard is not None:
+                statement_guard.stop()
+            session.close()
 
+        if getattr(response, "is_streamed", False):
+            # The rows are fetched while the body is being sent
+            response.call_on_close(release_session)
+        else:
+            release_session()
+        return response
 
+    def render_query(self, q):
+        if self.result_cache is None:
+            return self.construct_response(q)
+        return construct_cached_response(
+            register_controller_result_cache(self),
+            construct_result_cache_key(
+                q, type(self).__module__, type(self).__qualname__,
+                self.params, self.response_format, self.count_strategy,
+                self.use_core, self.layout),
+            lambda: self.construct_response(q), ttl=self.result_cache_ttl)
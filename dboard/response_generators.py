@@ -1,21 +1,93 @@
+import asyncio
+import atexit
+import base64
+import binascii
+import csv
+import inspect
 import math
 
 import json
 
-from flask import request, Response
+from concurrent.futures import as_completed
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask import (
+    request, Response, stream_with_context, copy_current_request_context,
+    current_app)
 from flask.json import _json
+from werkzeug.exceptions import (
+    HTTPException, InternalServerError, NotFound, GatewayTimeout,
+    BadRequest)
+from werkzeug.http import is_resource_modified
 
 from io import StringIO
 
+from sqlalchemy import and_, or_, func
+
 from toolspy import merge, null_safe_type_cast, subdict, write_csv_file
 
 from .utils import (
-    convert_sqla_collection_items_to_dicts,
-    get_queried_field_labels, sqla_sort)
+    fetch_query_results_as_dicts, fetch_query_results_as_lists,
+    compile_row_conversion_plan,
+    get_queried_field_labels, sqla_sort, iterate_sqla_query_in_batches,
+    get_query_primary_key_columns, get_queried_field_expression,
+    is_single_entity_query, get_query_cache_key, estimate_query_count,
+    fetch_planner_count_estimate,
+    is_nullable_expression, is_distinct_query,
+    InProcessCacheBackend, construct_result_cache, get_cache_key,
+    execute_sqla_query_statement, get_sqla_statement_columns,
+    construct_core_statement,
+    ensure_pyarrow, generate_record_batches_from_result,
+    generate_arrow_stream_chunks, generate_parquet_chunks,
+    convert_df_to_arrow_stream_bytes, convert_df_to_parquet_bytes,
+    ARROW_STREAM_MIMETYPE, PARQUET_MIMETYPE, StatementTimeout,
+    DEFAULT_WATCHDOG_GRACE, timed_stage, record_stage_count,
+    add_to_stage_count, use_stage_timings, collect_stage_timings,
+    current_stage_timings, DEFAULT_METRICS_REGISTRY, ExecutorService,
+    query_source, construct_compression_config,
+    get_available_content_encodings, compress_bytes,
+    generate_compressed_chunks, COMPRESSIBLE_MIMETYPES, replication_lag_limit,
+    begin_routed_transaction)
 
 
 QUERY_MODIFIERS = [
-    'page', 'per_page', 'limit', 'offset', 'order_by', 'sort']
+    'page', 'per_page', 'limit', 'offset', 'order_by', 'sort',
+    'pagination', 'cursor']
+
+DEFAULT_STREAM_BATCH_SIZE = 1000
+
+DEFAULT_ARROW_BATCH_SIZE = 10000
+
+DF_JSON_ORIENTS = ['records', 'split', 'columns']
+
+# records sends each row as a dict. split sends each row as an array
+# of values and columnar sends an array of values per column, both in
+# the order of the column labels in the meta.
+QUERY_RESULT_LAYOUTS = ['records', 'split', 'columnar']
+
+COUNT_STRATEGIES = ['query', 'window', 'cached', 'estimate', 'none']
+
+WINDOW_COUNT_LABEL = '_dboard_total_items'
+
+QUERY_COUNT_CACHE = InProcessCacheBackend(ttl=300, max_size=10000)
+
+# The per endpoint options that register_query_endpoints passes on from
+# the registration dict to render_query_response
+ENDPOINT_OPTIONS = [
+    'json_query_modifiers', 'csv_query_modifiers', 'filter_params_schema',
+    'count_strategy', 'count_cache_ttl', 'result_cache', 'result_cache_ttl',
+    'use_core', 'layout', 'statement_timeout', 'conditional', 'data_version',
+    'compression', 'max_replication_lag']
+
+# Endpoint name, or the qualified name of a response controller class, to
+# the ResultCache configured for it, for reporting
+REGISTERED_RESULT_CACHES = {}
+
+# Endpoint name to the Rollup answering its queries
+REGISTERED_ROLLUPS = {}
+
+DEFAULT_BATCH_MAX_WORKERS = 4
 
 
 def fetch_query_modifiers_from_request():
@@ -25,6 +97,10 @@ def fetch_query_modifiers_from_request():
     )
 
 
+def fetch_stream_flag_from_request():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
 def structured(struct, meta=None, struct_key=None):
     if struct_key is None:
         struct_key = "result"
@@ -41,12 +117,154 @@ def jsoned(struct, meta=None, struct_key=None):
             struct, meta=meta, struct_key=struct_key))
 
 def as_json(
-        struct, status=200, meta=None, struct_key=None):
-    return Response(
-        jsoned(
-            struct, meta=meta,
-            struct_key=struct_key),
-        status, mimetype='application/json')
+        struct, status=200, meta=None, struct_key=None, conditional=False):
+    """
+    With conditional, the response gets an ETag hashed from its payload
+    and becomes a 304 when the request already has it (see
+    make_response_conditional).
+    """
+    with timed_stage("encode"):
+        response = Response(
+            jsoned(
+                struct, meta=meta,
+                struct_key=struct_key),
+            status, mimetype='application/json')
+    if conditional:
+        return make_response_conditional(response)
+    return response
+
+
+def construct_data_version_etag(data_version, *parts):
+    """
+    A strong ETag for the data_version of the response to the request,
+    which is specific to its path and args.
+    """
+    return get_cache_key(
+        data_version, request.path, sorted(request.args.items(multi=True)),
+        *parts)
+
+
+def convert_data_version_to_last_modified(data_version):
+    if isinstance(data_version, datetime):
+        if data_version.tzinfo is None:
+            # Naive timestamps from the database are taken to be in UTC
+            return data_version.replace(tzinfo=timezone.utc)
+        return data_version
+    if isinstance(data_version, date):
+        return datetime(
+            data_version.year, data_version.month, data_version.day,
+            tzinfo=timezone.utc)
+    return None
+
+
+def is_request_not_modified(etag=None, last_modified=None):
+    """
+    Whether the If-None-Match (or, without one, the If-Modified-Since)
+    header of the request still matches the response.
+    """
+    if etag is None and last_modified is None:
+        return False
+    return not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified)
+
+
+def construct_not_modified_response(etag=None, last_modified=None):
+    response = Response(status=304)
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def make_response_conditional(response, etag=None, last_modified=None):
+    """
+    Sets the ETag and Last-Modified of a successful response, and turns
+    it into a 304 when the request is conditional and matches them.
+    Without an etag, one is hashed from the payload, which streamed
+    responses do not have in hand and so are left as they are.
+    """
+    if not isinstance(response, Response) or response.status_code != 200:
+        return response
+    if etag is not None:
+        response.set_etag(etag)
+    elif response.is_streamed:
+        return response
+    else:
+        with timed_stage("etag"):
+            response.add_etag()
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response.make_conditional(request)
+
+
+def construct_conditional_response(response_constructor, data_version=None):
+    """
+    When data_version is given, a request whose ETag or modification
+    time matches it gets a 304 without response_constructor being run.
+    Otherwise the response gets an ETag from the payload.
+    """
+    etag = last_modified = None
+    if data_version is not None:
+        etag = construct_data_version_etag(data_version)
+        last_modified = convert_data_version_to_last_modified(data_version)
+        if is_request_not_modified(etag, last_modified):
+            return construct_not_modified_response(etag, last_modified)
+    return make_response_conditional(
+        response_constructor(), etag=etag, last_modified=last_modified)
+
+
+async def async_construct_conditional_response(
+        response_constructor, data_version=None):
+    """
+    Same as construct_conditional_response, for a response_constructor
+    that is a coroutine function.
+    """
+    etag = last_modified = None
+    if data_version is not None:
+        etag = construct_data_version_etag(data_version)
+        last_modified = convert_data_version_to_last_modified(data_version)
+        if is_request_not_modified(etag, last_modified):
+            return construct_not_modified_response(etag, last_modified)
+    return make_response_conditional(
+        await response_constructor(), etag=etag, last_modified=last_modified)
+
+
+def fetch_data_version(
+        data_version, session, query_engine, db_base, filter_params=None):
+    """
+    data_version is either a function taking the same arguments as the
+    query constructors, or a statement selecting one value, like the
+    max updated_at of the tables the query reads.
+    """
+    if callable(data_version):
+        return data_version(
+            session, query_engine, db_base, filter_params=filter_params)
+    return session.execute(data_version).scalar()
+
+
+async def async_fetch_data_version(
+        data_version, session, query_engine, db_base, filter_params=None):
+    if callable(data_version):
+        version = data_version(
+            session, query_engine, db_base, filter_params=filter_params)
+        if inspect.isawaitable(version):
+            version = await version
+        return version
+    return (await session.execute(data_version)).scalar()
+
+
+def split_jsoned_envelope(meta=None, struct_key=None):
+    """
+    Returns the json text that goes before and after the struct in the
+    output of jsoned, so that the struct can be written in between
+    without building it in memory.
+    """
+    placeholder = "__dboard_struct_placeholder__"
+    prefix, suffix = jsoned(
+        placeholder, meta=meta, struct_key=struct_key).split(
+            _json.dumps(placeholder), 1)
+    return prefix, suffix
 
 
 def construct_query_modifiers(
@@ -58,6 +276,8 @@ def construct_query_modifiers(
         "offset": None,
         "order_by": None,
         "sort": "asc",
+        "pagination": "offset",
+        "cursor": None,
     }
     if query_modifiers is None:
         query_modifiers = {}
@@ -74,9 +294,139 @@ def construct_query_modifiers(
     return query_modifiers
 
 
+def encode_keyset_value(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    return value
+
+
+def decode_keyset_value(value):
+    if isinstance(value, dict):
+        if "$datetime" in value:
+            return datetime.fromisoformat(value["$datetime"])
+        if "$date" in value:
+            return date.fromisoformat(value["$date"])
+        if "$decimal" in value:
+            return Decimal(value["$decimal"])
+    return value
+
+
+def encode_keyset_cursor(values):
+    return base64.urlsafe_b64encode(
+        json.dumps([encode_keyset_value(v) for v in values]).encode(
+            'utf-8')).decode('ascii')
+
+
+def decode_keyset_cursor(cursor, length=None):
+    """
+    A cursor that was not made by encode_keyset_cursor, or that has a
+    number of values other than length, is a bad request.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or (
+                length is not None and len(values) != length):
+            raise ValueError("Wrong number of values")
+        return [decode_keyset_value(v) for v in values]
+    except (binascii.Error, ValueError, TypeError, AttributeError) as e:
+        raise BadRequest("Invalid cursor") from e
+
+
+def get_keyset_columns(q, order_by=None):
+    """
+    Returns (key, column) pairs for the columns the keyset is made of -
+    the order_by column if any, followed by the primary key of the
+    queried entity as a tie-breaker.
+
+    Rows whose order_by is NULL cannot be placed by comparing with the
+    cursor and would be skipped, so nullable order_by columns are
+    rejected. Other expressions, like the labelled results of
+    functions, are expected not to be NULL.
+    """
+    keyset_columns = []
+    if order_by is not None:
+        if isinstance(order_by, str):
+            keyset_columns.append(
+                (order_by, get_queried_field_expression(q, order_by)))
+        else:
+            keyset_columns.append((order_by.key, order_by))
+        if is_nullable_expression(keyset_columns[0][1]):
+            raise BadRequest(
+                "Cannot paginate by cursor on {}, which can be "
+                "null".format(keyset_columns[0][0]))
+    return keyset_columns + get_query_primary_key_columns(q)
+
+
+def validate_keyset_columns(q, keyset_columns):
+    """
+    The keyset columns have to be among the queried fields for the cursor
+    of the next page to be built from the last row. Checked before any
+    query runs, like the count.
+    """
+    labels = get_queried_field_labels(q)
+    missing_keys = [key for key, _ in keyset_columns if key not in labels]
+    if missing_keys:
+        raise ValueError(
+            "Keyset pagination needs {} among the queried fields".format(
+                ", ".join(missing_keys)))
+
+
+def construct_keyset_condition(columns, values, sort='asc'):
+    conditions = []
+    for i, col in enumerate(columns):
+        bound = col > values[i] if sort == 'asc' else col < values[i]
+        conditions.append(and_(
+            *[columns[j] == values[j] for j in range(i)] + [bound]))
+    return or_(*conditions)
+
+
+def validate_query_modifiers(q, query_modifiers):
+    if query_modifiers.get("pagination") == "keyset":
+        validate_keyset_columns(q, get_keyset_columns(
+            q, order_by=query_modifiers.get("order_by")))
+
+
+def apply_keyset_pagination_on_sqla_query(
+        q, per_page=20, order_by=None, sort='asc', cursor=None):
+    keyset_columns = get_keyset_columns(q, order_by=order_by)
+    validate_keyset_columns(q, keyset_columns)
+    columns = [col for _, col in keyset_columns]
+    if cursor:
+        q = q.filter(construct_keyset_condition(
+            columns, decode_keyset_cursor(cursor, length=len(columns)),
+            sort=sort))
+    return q.order_by(*[sqla_sort(sort)(col) for col in columns]).limit(
+        int(per_page))
+
+
+def construct_next_keyset_cursor(q, rows, query_modifiers):
+    """
+    q is the query before the modifiers were applied and rows are the
+    dicts, or the lists of values, of the current page.
+    """
+    if len(rows) < int(query_modifiers.get("per_page")):
+        return None
+    last_row = rows[-1]
+    if not isinstance(last_row, dict):
+        last_row = dict(zip(get_queried_field_labels(q), last_row))
+    keys = [
+        key for key, _ in get_keyset_columns(
+            q, order_by=query_modifiers.get("order_by"))]
+    return encode_keyset_cursor([last_row[key] for key in keys])
+
+
 def apply_modifiers_on_sqla_query(
         q, page=None, per_page=20, limit=None, offset=None,
-        order_by=None, sort='asc'):
+        order_by=None, sort='asc', pagination='offset', cursor=None):
+    if pagination == 'keyset':
+        return apply_keyset_pagination_on_sqla_query(
+            q, per_page=per_page, order_by=order_by, sort=sort,
+            cursor=cursor)
     if order_by is not None:
         q = q.order_by(sqla_sort(sort)(order_by))
     if page:
@@ -87,65 +437,380 @@ def apply_modifiers_on_sqla_query(
     return q
 
 
-def construct_meta_dict_from_query(q, query_modifiers):
-    meta = {
-        "total_items": q.count(),
-        "columns": get_queried_field_labels(q)
-    }
-    if query_modifiers.get("page"):
+def count_query(q, count_strategy="query", count_cache_ttl=None):
+    with timed_stage("count"):
+        return _count_query(
+            q, count_strategy=count_strategy, count_cache_ttl=count_cache_ttl)
+
+
+def _count_query(q, count_strategy="query", count_cache_ttl=None):
+    if count_strategy == "cached":
+        key = get_query_cache_key(q)
+        total_items = QUERY_COUNT_CACHE.get(key)
+        if total_items is None:
+            total_items = q.count()
+            QUERY_COUNT_CACHE.set(key, total_items, ttl=count_cache_ttl)
+        return total_items
+    if count_strategy == "estimate":
+        return estimate_query_count(q)
+    return q.count()
+
+
+def construct_meta_dict_from_query(
+        q, query_modifiers, count_strategy="query", count_cache_ttl=None,
+        total_items=None):
+    meta = {}
+    if count_strategy != "none":
+        if total_items is None and count_strategy == "estimate":
+            with timed_stage("count"):
+                total_items = fetch_planner_count_estimate(q)
+            # Only the estimates of the planner are flagged, not the
+            # exact counts of the dialects without one
+            if total_items is not None:
+                meta["total_items_is_estimate"] = True
+            else:
+                count_strategy = "query"
+        if total_items is None:
+            total_items = count_query(
+                q, count_strategy=count_strategy,
+                count_cache_ttl=count_cache_ttl)
+        meta["total_items"] = total_items
+    meta["columns"] = get_queried_field_labels(q)
+    if query_modifiers.get("pagination") == "keyset":
+        # The pages are walked through with next_cursor, not numbered
+        meta["per_page"] = query_modifiers.get("per_page")
+    elif query_modifiers.get("page"):
         meta["page"] = query_modifiers["page"]
         meta["per_page"] = query_modifiers.get("per_page")
-        meta["total_pages"] = math.ceil(
-            meta["total_items"] / meta["per_page"])
+        if "total_items" in meta:
+            meta["total_pages"] = math.ceil(
+                meta["total_items"] / meta["per_page"])
     return meta
 
 
+def is_paginated(query_modifiers):
+    return bool(
+        query_modifiers.get("page") or
+        query_modifiers.get("pagination") == "keyset")
+
+
+def fetch_query_results_with_window_count(q, query_modifiers):
+    """
+    Fetches the page along with count(*) over() as an extra column, so
+    that the total is computed in the same round trip as the rows.
+    Returns the rows as dicts without the extra column and the total,
+    which is None when the page turns out to be empty.
+    """
+    single_entity = is_single_entity_query(q)
+    convert = compile_row_conversion_plan(q).convert
+    counted_q = apply_modifiers_on_sqla_query(
+        q.add_columns(
+            func.count().over().label(WINDOW_COUNT_LABEL)),
+        **query_modifiers)
+    rows = []
+    total_items = None
+    with timed_stage("fetch"):
+        items = counted_q.all()
+    with timed_stage("convert"):
+        for item in items:
+            total_items = item[-1]
+            if single_entity:
+                rows.append(convert(item[0]))
+            else:
+                row = item._asdict()
+                row.pop(WINDOW_COUNT_LABEL)
+                rows.append(row)
+    return rows, total_items
+
+
+def fetch_query_results(q, use_core=False, as_lists=False):
+    if as_lists:
+        return fetch_query_results_as_lists(q, use_core=use_core)
+    return fetch_query_results_as_dicts(q, use_core=use_core)
+
+
+def fetch_query_results_with_has_more(
+        q, query_modifiers, use_core=False, as_lists=False):
+    """
+    Fetches one row more than the page size to find out if there are
+    more rows after the page, without counting them.
+    """
+    modified_q = apply_modifiers_on_sqla_query(q, **query_modifiers)
+    if not is_paginated(query_modifiers):
+        return fetch_query_results(
+            modified_q, use_core=use_core, as_lists=as_lists), False
+    per_page = int(query_modifiers.get("per_page"))
+    rows = fetch_query_results(
+        modified_q.limit(per_page + 1), use_core=use_core, as_lists=as_lists)
+    return rows[:per_page], len(rows) > per_page
+
+
+def is_list_layout(layout):
+    return layout in ('split', 'columnar')
+
+
+def arrange_rows_in_layout(rows, labels, layout=None):
+    """
+    rows are lists of values in the order of labels for the split and
+    columnar layouts, and dicts otherwise.
+    """
+    if layout == 'columnar':
+        if not rows:
+            return [[] for _ in labels]
+        return [list(values) for values in zip(*rows)]
+    return rows
+
+
 def construct_list_of_dicts_from_query(
-        q, query_modifiers=None, allow_modification_via_requests=True):
+        q, query_modifiers=None, allow_modification_via_requests=True,
+        use_core=False, layout=None):
+    """
+    With the split or columnar layout, returns a dict with the column
+    labels and the rows arranged in that layout instead.
+    """
     query_modifiers = construct_query_modifiers(
         query_modifiers,
         allow_modification_via_requests=allow_modification_via_requests)
+    labels = get_queried_field_labels(q)
     q = apply_modifiers_on_sqla_query(q, **query_modifiers)
-    return convert_sqla_collection_items_to_dicts(q.all())
+    if not is_list_layout(layout):
+        return fetch_query_results_as_dicts(q, use_core=use_core)
+    return {
+        "columns": labels,
+        "layout": layout,
+        "data": arrange_rows_in_layout(
+            fetch_query_results_as_lists(q, use_core=use_core),
+            labels, layout=layout)
+    }
 
 
 def construct_json_response_from_query(
-        q, query_modifiers=None, allow_modification_via_requests=True):
+        q, query_modifiers=None, allow_modification_via_requests=True,
+        count_strategy=None, count_cache_ttl=None, use_core=False,
+        layout=None):
 
     query_modifiers = construct_query_modifiers(
         query_modifiers,
         allow_modification_via_requests=allow_modification_via_requests)
-    meta = construct_meta_dict_from_query(q, query_modifiers)
+    validate_query_modifiers(q, query_modifiers)
+    if count_strategy is None or (
+            count_strategy == "window" and (
+                is_distinct_query(q) or
+                query_modifiers.get("pagination") == "keyset")):
+        # The window count is taken before the rows are made distinct,
+        # and after the keyset cursor leaves out the earlier pages
+        count_strategy = "query"
+    as_lists = is_list_layout(layout)
 
-    q = apply_modifiers_on_sqla_query(q, **query_modifiers)
+    if count_strategy == "window":
+        rows, total_items = fetch_query_results_with_window_count(
+            q, query_modifiers)
+        if total_items is None:
+            total_items = q.count() if is_paginated(query_modifiers) else 0
+        meta = construct_meta_dict_from_query(
+            q, query_modifiers, total_items=total_items)
+        if as_lists:
+            rows = [[row[label] for label in meta["columns"]] for row in rows]
+    elif count_strategy == "none":
+        rows, has_more = fetch_query_results_with_has_more(
+            q, query_modifiers, use_core=use_core, as_lists=as_lists)
+        meta = construct_meta_dict_from_query(
+            q, query_modifiers, count_strategy="none")
+        meta["has_more"] = has_more
+    else:
+        meta = construct_meta_dict_from_query(
+            q, query_modifiers, count_strategy=count_strategy,
+            count_cache_ttl=count_cache_ttl)
+        rows = fetch_query_results(
+            apply_modifiers_on_sqla_query(q, **query_modifiers),
+            use_core=use_core, as_lists=as_lists)
+        # q.session.remove()
 
-    result = q.all()
-    # q.session.remove()
+    if query_modifiers.get("pagination") == "keyset":
+        meta["next_cursor"] = construct_next_keyset_cursor(
+            q, rows, query_modifiers)
+    if as_lists:
+        meta["layout"] = layout
+    record_stage_count("rows", len(rows))
 
     return as_json(
-        convert_sqla_collection_items_to_dicts(
-            result
-        ),
+        arrange_rows_in_layout(rows, meta["columns"], layout=layout),
         meta=meta,
         struct_key="data"
     )
 
 
-def convert_csv_text_to_csv_response(csvtext):
-    return Response(csvtext, mimetype="text/csv")
+def generate_json_chunks_from_query(
+        q, meta=None, struct_key="data",
+        batch_size=DEFAULT_STREAM_BATCH_SIZE, use_core=False, as_lists=False):
+    prefix, suffix = split_jsoned_envelope(meta=meta, struct_key=struct_key)
+    yield prefix + "["
+    separator = ""
+    for rows in iterate_sqla_query_in_batches(
+            q, batch_size=batch_size, use_core=use_core, as_lists=as_lists):
+        yield separator + ", ".join(_json.dumps(row) for row in rows)
+        separator = ", "
+    yield "]" + suffix
+
+
+def generate_ndjson_chunks_from_query(
+        q, meta=None, batch_size=DEFAULT_STREAM_BATCH_SIZE, use_core=False,
+        as_lists=False):
+    """
+    The first line holds the status and meta. Every following line is
+    one row of the result.
+    """
+    yield _json.dumps(merge({'status': 'success'}, meta or {})) + "\n"
+    for rows in iterate_sqla_query_in_batches(
+            q, batch_size=batch_size, use_core=use_core, as_lists=as_lists):
+        yield "".join(_json.dumps(row) + "\n" for row in rows)
+
+
+def construct_streaming_json_response_from_query(
+        q, query_modifiers=None, allow_modification_via_requests=True,
+        ndjson=False, batch_size=DEFAULT_STREAM_BATCH_SIZE,
+        count_strategy=None, count_cache_ttl=None, use_core=False,
+        layout=None):
+    """
+    The split layout is supported as is. Since the columns cannot be
+    completed before the last row is read, the columnar layout is sent
+    as split. Keyset pagination is a bad request, since the meta holding
+    next_cursor is sent before the last row is read.
+    """
+    query_modifiers = construct_query_modifiers(
+        query_modifiers,
+        allow_modification_via_requests=allow_modification_via_requests)
+    if query_modifiers.get("pagination") == "keyset":
+        # The meta goes out ahead of the rows, so the cursor of the next
+        # page, which comes from the last row, could not be sent
+        raise BadRequest(
+            "Keyset pagination cannot be used with streamed responses")
+    as_lists = is_list_layout(layout)
+    if count_strategy in (None, "window"):
+        # The meta is sent ahead of the rows, so the count cannot ride
+        # along with them here.
+        count_strategy = "query"
+    meta = construct_meta_dict_from_query(
+        q, query_modifiers, count_strategy=count_strategy,
+        count_cache_ttl=count_cache_ttl)
+    if as_lists:
+        meta["layout"] = "split"
+    q = apply_modifiers_on_sqla_query(q, **query_modifiers)
+    if ndjson:
+        return Response(
+            stream_with_context(
+                generate_ndjson_chunks_from_query(
+                    q, meta=meta, batch_size=batch_size,
+                    use_core=use_core, as_lists=as_lists)),
+            mimetype="application/x-ndjson")
+    return Response(
+        stream_with_context(
+            generate_json_chunks_from_query(
+                q, meta=meta, struct_key="data", batch_size=batch_size,
+                use_core=use_core, as_lists=as_lists)),
+        mimetype="application/json")
+
+
+def convert_csv_text_to_csv_response(csvtext, conditional=False):
+    response = Response(csvtext, mimetype="text/csv")
+    if conditional:
+        return make_response_conditional(response)
+    return response
+
+
+def generate_csv_chunks_from_query(
+        q, cols, batch_size=DEFAULT_STREAM_BATCH_SIZE, use_core=False):
+    """
+    Yields the csv text of the query one batch of rows at a time. The
+    output is identical to the non streaming csv response, which does
+    not end with a line terminator.
+    """
+    strfile = StringIO()
+    writer = csv.DictWriter(strfile, fieldnames=cols)
+    lineterminator = writer.writer.dialect.lineterminator
+    writer.writeheader()
+    yield strfile.getvalue()[:-len(lineterminator)]
+    for rows in iterate_sqla_query_in_batches(
+            q, batch_size=batch_size, use_core=use_core):
+        strfile.seek(0)
+        strfile.truncate(0)
+        writer.writerows(rows)
+        yield lineterminator + strfile.getvalue()[:-len(lineterminator)]
+    strfile.close()
+
+
+def construct_streaming_csv_response_from_query(
+        q, query_modifiers=None, allow_modification_via_requests=True,
+        batch_size=DEFAULT_STREAM_BATCH_SIZE, use_core=False):
+    cols = get_queried_field_labels(q)
+    query_modifiers = construct_query_modifiers(
+        query_modifiers,
+        allow_modification_via_requests=allow_modification_via_requests)
+    q = apply_modifiers_on_sqla_query(q, **query_modifiers)
+    return Response(
+        stream_with_context(
+            generate_csv_chunks_from_query(
+                q, cols, batch_size=batch_size, use_core=use_core)),
+        mimetype="text/csv")
 
 
 def construct_csv_response_from_query(
-        q, query_modifiers=None, allow_modification_via_requests=True):
+        q, query_modifiers=None, allow_modification_via_requests=True,
+        stream=False, batch_size=DEFAULT_STREAM_BATCH_SIZE, use_core=False,
+        conditional=False):
+    if stream:
+        return construct_streaming_csv_response_from_query(
+            q, query_modifiers=query_modifiers,
+            allow_modification_via_requests=allow_modification_via_requests,
+            batch_size=batch_size, use_core=use_core)
     cols = get_queried_field_labels(q)
     rows = construct_list_of_dicts_from_query(
         q, query_modifiers=query_modifiers,
+        allow_modification_via_requests=allow_modification_via_requests,
+        use_core=use_core)
+    record_stage_count("rows", len(rows))
+    with timed_stage("encode"):
+        strfile = StringIO()
+        write_csv_file(strfile, rows=rows, cols=cols)
+        csv_content = strfile.getvalue().strip("\r\n")
+        strfile.close()
+    return convert_csv_text_to_csv_response(
+        csv_content, conditional=conditional)
+
+
+def construct_arrow_response_from_query(
+        q, query_modifiers=None, allow_modification_via_requests=True,
+        response_format='arrow', batch_size=DEFAULT_ARROW_BATCH_SIZE):
+    """
+    Streams the result as an arrow IPC stream, or as a parquet file when
+    response_format is parquet. The rows are read as tuples off the
+    Core statement and go into record batches column by column.
+    """
+    ensure_pyarrow()
+    query_modifiers = construct_query_modifiers(
+        query_modifiers,
         allow_modification_via_requests=allow_modification_via_requests)
-    strfile = StringIO()
-    write_csv_file(strfile, rows=rows, cols=cols)
-    csv_content = strfile.getvalue().strip("\r\n")
-    strfile.close()
-    return convert_csv_text_to_csv_response(csv_content)
+    q = apply_modifiers_on_sqla_query(q, **query_modifiers)
+    if response_format == 'parquet':
+        chunks_generator, mimetype = generate_parquet_chunks, PARQUET_MIMETYPE
+    else:
+        chunks_generator, mimetype = (
+            generate_arrow_stream_chunks, ARROW_STREAM_MIMETYPE)
+
+    def generate_chunks():
+        result = execute_sqla_query_statement(q)
+        try:
+            for chunk in chunks_generator(
+                    generate_record_batches_from_result(
+                        result, columns=get_sqla_statement_columns(
+                            construct_core_statement(q)),
+                        batch_size=batch_size)):
+                yield chunk
+        finally:
+            result.close()
+
+    return Response(
+        stream_with_context(generate_chunks()), mimetype=mimetype)
 
 
 def fetch_filter_params(
@@ -164,28 +829,363 @@ def fetch_filter_params(
 
 def construct_response_from_query(
         q, json_query_modifiers=None, csv_query_modifiers=None,
-        response_format=None):
+        response_format=None, stream=None, count_strategy=None,
+        count_cache_ttl=None, use_core=False, layout=None):
     if response_format is None:
         response_format = request.args.get('format')
+    if stream is None:
+        stream = fetch_stream_flag_from_request()
+    layout = request.args.get('layout') or layout
     if response_format == 'csv':
         return construct_csv_response_from_query(
-            q, query_modifiers=csv_query_modifiers)
+            q, query_modifiers=csv_query_modifiers, stream=stream,
+            use_core=use_core)
     elif response_format == 'dict':
         return construct_list_of_dicts_from_query(
-            q, query_modifiers=json_query_modifiers)
+            q, query_modifiers=json_query_modifiers, use_core=use_core,
+            layout=layout)
+    elif response_format in ('arrow', 'parquet'):
+        # Like csv, these are meant for extracts and take the csv modifiers
+        return construct_arrow_response_from_query(
+            q, query_modifiers=csv_query_modifiers,
+            response_format=response_format)
+    elif response_format == 'ndjson':
+        return construct_streaming_json_response_from_query(
+            q, query_modifiers=json_query_modifiers, ndjson=True,
+            count_strategy=count_strategy, count_cache_ttl=count_cache_ttl,
+            use_core=use_core, layout=layout)
+    if stream:
+        return construct_streaming_json_response_from_query(
+            q, query_modifiers=json_query_modifiers,
+            count_strategy=count_strategy, count_cache_ttl=count_cache_ttl,
+            use_core=use_core, layout=layout)
     return construct_json_response_from_query(
-        q, query_modifiers=json_query_modifiers)
+        q, query_modifiers=json_query_modifiers,
+        count_strategy=count_strategy, count_cache_ttl=count_cache_ttl,
+        use_core=use_core, layout=layout)
 
-def construct_json_response_from_df(df):
-    records = json.loads(df.to_json(orient='records', date_format='iso'))
-    return as_json(
-        records,
-        struct_key="data"
-    )
+def construct_json_response_from_df(df, orient='records', meta=None):
+    """
+    Writes the json pandas produces for the DataFrame straight into the
+    envelope of as_json, instead of parsing it back into python objects
+    to dump them again.
+    """
+    prefix, suffix = split_jsoned_envelope(meta=meta, struct_key="data")
+    return Response(
+        prefix + df.to_json(orient=orient, date_format='iso') + suffix,
+        200, mimetype='application/json')
+
+
+def construct_arrow_response_from_df(df, response_format='arrow'):
+    if response_format == 'parquet':
+        return Response(
+            convert_df_to_parquet_bytes(df), mimetype=PARQUET_MIMETYPE)
+    return Response(
+        convert_df_to_arrow_stream_bytes(df), mimetype=ARROW_STREAM_MIMETYPE)
+
+
+def construct_response_from_df(df, response_format=None, orient=None):
+    if response_format in ('arrow', 'parquet'):
+        return construct_arrow_response_from_df(
+            df, response_format=response_format)
+    if orient not in DF_JSON_ORIENTS:
+        orient = 'records'
+    return construct_json_response_from_df(df, orient=orient)
+
+
+def construct_result_cache_key(q, *extra_parts):
+    """
+    The key covers the compiled sql with its bound parameters, and the
+    request args, which carry the query modifiers and the response
+    format.
+    """
+    return get_query_cache_key(
+        q, sorted(request.args.items(multi=True)), *extra_parts)
 
 
-def construct_response_from_df(df):
-    return construct_json_response_from_df(df)
+def get_controller_name(controller):
+    return "{}.{}".format(
+        type(controller).__module__, type(controller).__qualname__)
+
+
+def register_controller_result_cache(controller):
+    REGISTERED_RESULT_CACHES.setdefault(
+        get_controller_name(controller), controller.result_cache)
+    return controller.result_cache
+
+
+def construct_request_cache_key(*parts):
+    return get_cache_key(sorted(request.args.items(multi=True)), *parts)
+
+
+# Headers of a response that are worked out again from the body sent
+# for a cache hit
+UNCACHED_RESPONSE_HEADERS = ["Content-Length"]
+
+
+def serialize_response_for_cache(response):
+    return {
+        "status": response.status_code,
+        "mimetype": response.mimetype,
+        "headers": [
+            (name, value) for name, value in response.headers.items()
+            if name not in UNCACHED_RESPONSE_HEADERS],
+        "data": response.get_data()
+    }
+
+
+def construct_response_from_body_and_cached_result(body, cached_result):
+    if "headers" not in cached_result:
+        # Cached before the headers were kept
+        return Response(
+            body, cached_result["status"],
+            mimetype=cached_result["mimetype"])
+    return Response(
+        body, cached_result["status"], headers=cached_result["headers"])
+
+
+def construct_response_from_cached_result(cached_result, encoding=None):
+    encoded = cached_result.get("encoded") or {}
+    if encoding is None or encoding not in encoded:
+        return construct_response_from_body_and_cached_result(
+            cached_result["data"], cached_result)
+    response = construct_response_from_body_and_cached_result(
+        encoded[encoding], cached_result)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def negotiate_content_encoding(compression):
+    """
+    The content encoding of the compression config (see
+    construct_compression_config) that the request accepts best.
+    """
+    if compression is None:
+        return None
+    return request.accept_encodings.best_match(
+        get_available_content_encodings(compression["encodings"]))
+
+
+def is_compressible_response(response, compression):
+    return (
+        compression is not None and isinstance(response, Response) and
+        response.status_code == 200 and
+        "Content-Encoding" not in response.headers and
+        response.mimetype in COMPRESSIBLE_MIMETYPES)
+
+
+def serialize_response_for_cache_with_encoding(
+        response, compression=None, encoding=None):
+    """
+    Keeps the body compressed with encoding along with the plain one, so
+    that the cache hits of the clients accepting it are sent as they are.
+    """
+    cached_result = serialize_response_for_cache(response)
+    if encoding is not None and is_compressible_response(
+            response, compression) and \
+            len(cached_result["data"]) >= compression["min_size"]:
+        with timed_stage("compress"):
+            cached_result["encoded"] = {encoding: compress_bytes(
+                cached_result["data"], encoding,
+                level=compression["level"])}
+    return cached_result
+
+
+def compress_response(response, compression=None):
+    """
+    Compresses the body with the best content encoding the request
+    accepts. A streamed body is compressed chunk by chunk as it is sent.
+    Other bodies smaller than the min_size of the compression config are
+    left as they are. The ETag of a compressed response is made weak,
+    so that the conditional requests made with it still match.
+    """
+    compression = construct_compression_config(compression)
+    if not is_compressible_response(response, compression):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_content_encoding(compression)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = generate_compressed_chunks(
+            response.response, encoding, level=compression["level"])
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < compression["min_size"]:
+            return response
+        with timed_stage("compress"):
+            response.set_data(
+                compress_bytes(data, encoding, level=compression["level"]))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def is_cacheable_response(response):
+    return isinstance(response, Response) and not response.is_streamed \
+        and response.status_code == 200
+
+
+def construct_cached_response(
+        result_cache, cache_key, response_constructor, ttl=None,
+        compression=None):
+    """
+    With a compression config, the cached body is kept compressed too,
+    and the hits of the clients accepting its encoding get it as it is.
+    """
+    compression = construct_compression_config(compression)
+    encoding = negotiate_content_encoding(compression)
+    with timed_stage("cache"):
+        cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        return construct_response_from_cached_result(
+            cached_result, encoding=encoding)
+    response = response_constructor()
+    if is_cacheable_response(response):
+        cached_result = serialize_response_for_cache_with_encoding(
+            response, compression=compression, encoding=encoding)
+        result_cache.set(cache_key, cached_result, ttl=ttl)
+        if "encoded" in cached_result:
+            return construct_response_from_cached_result(
+                cached_result, encoding=encoding)
+    return response
+
+
+async def async_construct_cached_response(
+        result_cache, cache_key, response_constructor, ttl=None,
+        compression=None):
+    """
+    Same as construct_cached_response, for a response_constructor that
+    is a coroutine function.
+    """
+    compression = construct_compression_config(compression)
+    encoding = negotiate_content_encoding(compression)
+    cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        return construct_response_from_cached_result(
+            cached_result, encoding=encoding)
+    response = await response_constructor()
+    if is_cacheable_response(response):
+        cached_result = serialize_response_for_cache_with_encoding(
+            response, compression=compression, encoding=encoding)
+        result_cache.set(cache_key, cached_result, ttl=ttl)
+        if "encoded" in cached_result:
+            return construct_response_from_cached_result(
+                cached_result, encoding=encoding)
+    return response
+
+
+def construct_query_response(
+        q, filter_params=None, json_query_modifiers=None,
+        csv_query_modifiers=None, response_format=None, stream=None,
+        count_strategy=None, count_cache_ttl=None, result_cache=None,
+        result_cache_ttl=None, use_core=False, layout=None,
+        compression=None):
+    def response_constructor():
+        return construct_response_from_query(
+            q, json_query_modifiers=json_query_modifiers,
+            csv_query_modifiers=csv_query_modifiers,
+            response_format=response_format, stream=stream,
+            count_strategy=count_strategy,
+            count_cache_ttl=count_cache_ttl, use_core=use_core,
+            layout=layout)
+
+    if result_cache is None:
+        return response_constructor()
+    return construct_cached_response(
+        result_cache,
+        construct_result_cache_key(
+            q, filter_params, json_query_modifiers,
+            csv_query_modifiers, response_format, stream,
+            count_strategy, use_core, layout),
+        response_constructor, ttl=result_cache_ttl, compression=compression)
+
+
+def generate_instrumented_chunks(chunks, timings):
+    """
+    Yields the encoded chunks of a streamed body, adding up their bytes
+    in timings. The chunks are generated with timings as the current
+    StageTimings, so the rows read for them are counted too.
+    """
+    chunks = iter(chunks)
+    while True:
+        with use_stage_timings(timings):
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            add_to_stage_count("bytes", len(chunk))
+        yield chunk
+
+
+def instrument_response(
+        response, timings, endpoint=None,
+        metrics_registry=DEFAULT_METRICS_REGISTRY):
+    """
+    Sends the stage timings of the response in its Server-Timing header
+    and adds them to the metrics of the endpoint. A streamed response
+    only has the stages before its body in the header, and is added to
+    the metrics with its full duration once it is closed.
+    """
+    if endpoint is None:
+        endpoint = request.endpoint or request.path
+    if not isinstance(response, Response):
+        return response
+    if response.is_streamed:
+        response.headers["Server-Timing"] = timings.server_timing_header()
+        # The rows are read and counted as the body is sent
+        response.response = generate_instrumented_chunks(
+            response.iter_encoded(), timings)
+
+        def observe_streamed_response():
+            timings.add_duration("total", timings.elapsed())
+            metrics_registry.observe(endpoint, timings)
+
+        response.call_on_close(observe_streamed_response)
+        return response
+    timings.set_count("bytes", response.calculate_content_length() or 0)
+    timings.add_duration("total", timings.elapsed())
+    response.headers["Server-Timing"] = timings.server_timing_header()
+    metrics_registry.observe(endpoint, timings)
+    return response
+
+
+def construct_instrumented_response(
+        response_constructor, endpoint=None,
+        metrics_registry=DEFAULT_METRICS_REGISTRY):
+    """
+    Collects the timed stages of response_constructor and instruments its
+    response. When stages are already being collected, the response is
+    left to be instrumented by the outer call.
+    """
+    if current_stage_timings() is not None:
+        return response_constructor()
+    with collect_stage_timings() as timings:
+        response = response_constructor()
+    return instrument_response(
+        response, timings, endpoint=endpoint,
+        metrics_registry=metrics_registry)
+
+
+def raise_for_statement_timeout(statement_guard, error):
+    if statement_guard is not None and statement_guard.is_timeout_error(
+            error):
+        raise GatewayTimeout(
+            "The query took longer than {} seconds".format(
+                statement_guard.timeout)) from error
+
+
+def buffer_streamed_response(response):
+    """
+    Reads the whole body of a streamed response. Needed when the rows
+    have to be fetched before the session that runs the query is closed.
+    """
+    if getattr(response, "is_streamed", False):
+        response.make_sequence()
+    return response
 
 
 def render_query_response(
@@ -193,26 +1193,307 @@ def render_query_response(
         json_query_modifiers=None,
         csv_query_modifiers=None, filter_params_schema=None,
         filter_params=None,
-        response_format=None):
+        response_format=None, stream=None, count_strategy=None,
+        count_cache_ttl=None, result_cache=None, result_cache_ttl=None,
+        use_core=False, layout=None, statement_timeout=None,
+        conditional=False, data_version=None, compression=None,
+        max_replication_lag=None, metrics_endpoint=None):
+    """
+    statement_timeout is the number of seconds the statements run for
+    the response may take (see StatementTimeout). A response which runs
+    out of it gets a 504. A streamed response keeps the limit until it
+    is closed, which the server does when the client goes away, and
+    which then releases the session and its connection.
+
+    The time spent in each stage is sent in the Server-Timing header and
+    added to the metrics of metrics_endpoint, by default the endpoint of
+    the request (see instrument_response).
+
+    compression is the config of compress_response. A result_cache keeps
+    the compressed bodies too.
+
+    conditional answers the requests which already have the response
+    with a 304, going by an ETag hashed from the payload. A data_version
+    (see fetch_data_version) makes it conditional too, with the ETag and
+    Last-Modified derived from the version, which is checked before the
+    query is constructed, so that a 304 skips the query altogether.
+
+    When the data source of the query_engine has replicas, the response
+    is read from one lagging at most max_replication_lag seconds behind
+    the primary, or from the primary when none does. 0 always reads from
+    the primary.
+    """
+    with replication_lag_limit(max_replication_lag):
+        return construct_instrumented_response(
+            lambda: _render_query_response(
+                query_constructor, query_engine, db_base,
+                json_query_modifiers=json_query_modifiers,
+                csv_query_modifiers=csv_query_modifiers,
+                filter_params_schema=filter_params_schema,
+                filter_params=filter_params,
+                response_format=response_format, stream=stream,
+                count_strategy=count_strategy,
+                count_cache_ttl=count_cache_ttl, result_cache=result_cache,
+                result_cache_ttl=result_cache_ttl, use_core=use_core,
+                layout=layout, statement_timeout=statement_timeout,
+                conditional=conditional, data_version=data_version,
+                compression=compression, endpoint=metrics_endpoint),
+            endpoint=metrics_endpoint)
+
+
+def _render_query_response(
+        query_constructor, query_engine, db_base,
+        json_query_modifiers=None,
+        csv_query_modifiers=None, filter_params_schema=None,
+        filter_params=None,
+        response_format=None, stream=None, count_strategy=None,
+        count_cache_ttl=None, result_cache=None, result_cache_ttl=None,
+        use_core=False, layout=None, statement_timeout=None,
+        conditional=False, data_version=None, compression=None,
+        endpoint=None):
     if filter_params is None:
-        filter_params = fetch_filter_params(
-            filter_params_schema=filter_params_schema)
+        with timed_stage("filter_params"):
+            filter_params = fetch_filter_params(
+                filter_params_schema=filter_params_schema)
     session = query_engine.session()
+    statement_guard = None
     try:
-        q = query_constructor(
-            session, query_engine, db_base, filter_params=filter_params)
-        response = construct_response_from_query(
-            q, json_query_modifiers=json_query_modifiers,
-            csv_query_modifiers=csv_query_modifiers,
-            response_format=response_format)
+        # Streamed bodies read the rows after the replication lag limit
+        # of render_query_response is exited
+        begin_routed_transaction(session)
+        if statement_timeout:
+            statement_guard = StatementTimeout(
+                session, statement_timeout).start()
+        with query_source(endpoint, filter_params):
+            version = None
+            if data_version is not None:
+                with timed_stage("data_version"):
+                    version = fetch_data_version(
+                        data_version, session, query_engine, db_base,
+                        filter_params=filter_params)
+
+            def response_constructor():
+                with timed_stage("query_constructor"):
+                    q = query_constructor(
+                        session, query_engine, db_base,
+                        filter_params=filter_params)
+                return construct_query_response(
+                    q, filter_params=filter_params,
+                    json_query_modifiers=json_query_modifiers,
+                    csv_query_modifiers=csv_query_modifiers,
+                    response_format=response_format, stream=stream,
+                    count_strategy=count_strategy,
+                    count_cache_ttl=count_cache_ttl,
+                    result_cache=result_cache,
+                    result_cache_ttl=result_cache_ttl, use_core=use_core,
+                    layout=layout, compression=compression)
+
+            if conditional or data_version is not None:
+                response = construct_conditional_response(
+                    response_constructor, data_version=version)
+            else:
+                response = response_constructor()
+            response = compress_response(response, compression)
     except Exception as e:
+        if statement_guard is not None:
+            statement_guard.stop()
         session.rollback()
+        session.close()
+        raise_for_statement_timeout(statement_guard, e)
         raise e
-    finally:
+
+    def release_session():
+        if statement_guard is not None:
+            statement_guard.stop()
         session.close()
+
+    if getattr(response, "is_streamed", False):
+        # The rows are fetched while the body is being sent, so the
+        # session can only be released once the response is closed.
+        response.call_on_close(release_session)
+    else:
+        release_session()
     return response
 
 
+async def async_render_query_response(
+        query_constructor, query_engine, db_base,
+        json_query_modifiers=None,
+        csv_query_modifiers=None, filter_params_schema=None,
+        filter_params=None,
+        response_format=None, stream=None, count_strategy=None,
+        count_cache_ttl=None, result_cache=None, result_cache_ttl=None,
+        use_core=False, layout=None, statement_timeout=None,
+        conditional=False, data_version=None, compression=None,
+        max_replication_lag=None, metrics_endpoint=None):
+    """
+    The async counterpart of render_query_response, for a query_engine
+    bound to an async engine (see AsyncSqlaQueryBuilder). The
+    query_constructor can be a coroutine function. It gets an
+    AsyncQuerySession, whose query method builds the same ORM queries
+    as a Session, so sync query constructors can be reused as they are.
+
+    The response is built in run_sync, where the database calls of the
+    sync code are awaited on the event loop instead of blocking the
+    worker. Streamed bodies are read before the session is closed. The
+    greenlet of run_sync gets the context of the caller, so the stages
+    timed in there are sent in the Server-Timing header too.
+
+    With a statement_timeout, building the response is given up on once
+    the limit (plus the watchdog grace) has passed, and the database is
+    asked to enforce the limit where it can.
+
+    Async engines have no replicas, so max_replication_lag is only
+    accepted for the endpoint options to be shared with the sync ones.
+    """
+    kwargs = dict(
+        json_query_modifiers=json_query_modifiers,
+        csv_query_modifiers=csv_query_modifiers,
+        filter_params_schema=filter_params_schema,
+        filter_params=filter_params, response_format=response_format,
+        stream=stream, count_strategy=count_strategy,
+        count_cache_ttl=count_cache_ttl, result_cache=result_cache,
+        result_cache_ttl=result_cache_ttl, use_core=use_core,
+        layout=layout, statement_timeout=statement_timeout,
+        conditional=conditional, data_version=data_version,
+        compression=compression, endpoint=metrics_endpoint)
+    if current_stage_timings() is not None:
+        return await _async_render_query_response(
+            query_constructor, query_engine, db_base, **kwargs)
+    with collect_stage_timings() as timings:
+        response = await _async_render_query_response(
+            query_constructor, query_engine, db_base, **kwargs)
+    return instrument_response(response, timings, endpoint=metrics_endpoint)
+
+
+async def _async_render_query_response(
+        query_constructor, query_engine, db_base,
+        json_query_modifiers=None,
+        csv_query_modifiers=None, filter_params_schema=None,
+        filter_params=None,
+        response_format=None, stream=None, count_strategy=None,
+        count_cache_ttl=None, result_cache=None, result_cache_ttl=None,
+        use_core=False, layout=None, statement_timeout=None,
+        conditional=False, data_version=None, compression=None,
+        endpoint=None):
+    if filter_params is None:
+        with timed_stage("filter_params"):
+            filter_params = fetch_filter_params(
+                filter_params_schema=filter_params_schema)
+    with query_source(endpoint, filter_params):
+        return await _async_render_query_response_for_filter_params(
+            query_constructor, query_engine, db_base, filter_params,
+            json_query_modifiers=json_query_modifiers,
+            csv_query_modifiers=csv_query_modifiers,
+            response_format=response_format, stream=stream,
+            count_strategy=count_strategy, count_cache_ttl=count_cache_ttl,
+            result_cache=result_cache, result_cache_ttl=result_cache_ttl,
+            use_core=use_core, layout=layout,
+            statement_timeout=statement_timeout, conditional=conditional,
+            data_version=data_version, compression=compression)
+
+
+async def _async_render_query_response_for_filter_params(
+        query_constructor, query_engine, db_base, filter_params,
+        json_query_modifiers=None, csv_query_modifiers=None,
+        response_format=None, stream=None, count_strategy=None,
+        count_cache_ttl=None, result_cache=None, result_cache_ttl=None,
+        use_core=False, layout=None, statement_timeout=None,
+        conditional=False, data_version=None, compression=None):
+    async with query_engine.session() as session:
+        etag = last_modified = None
+        if data_version is not None:
+            with timed_stage("data_version"):
+                version = await async_fetch_data_version(
+                    data_version, session, query_engine, db_base,
+                    filter_params=filter_params)
+            if version is not None:
+                etag = construct_data_version_etag(version)
+                last_modified = convert_data_version_to_last_modified(
+                    version)
+                if is_request_not_modified(etag, last_modified):
+                    return construct_not_modified_response(
+                        etag, last_modified)
+
+        with timed_stage("query_constructor"):
+            q = query_constructor(
+                session, query_engine, db_base, filter_params=filter_params)
+            if inspect.isawaitable(q):
+                q = await q
+
+        statement_guard = None
+
+        def response_constructor(sync_session):
+            nonlocal statement_guard
+            if statement_timeout:
+                statement_guard = StatementTimeout(
+                    sync_session, statement_timeout).start(watchdog=False)
+            try:
+                return buffer_streamed_response(construct_query_response(
+                    q, filter_params=filter_params,
+                    json_query_modifiers=json_query_modifiers,
+                    csv_query_modifiers=csv_query_modifiers,
+                    response_format=response_format, stream=stream,
+                    count_strategy=count_strategy,
+                    count_cache_ttl=count_cache_ttl,
+                    result_cache=result_cache,
+                    result_cache_ttl=result_cache_ttl,
+                    use_core=use_core, layout=layout,
+                    compression=compression))
+            finally:
+                if statement_guard is not None:
+                    statement_guard.stop()
+
+        if not statement_timeout:
+            response = await session.run_sync(response_constructor)
+        else:
+            try:
+                response = await asyncio.wait_for(
+                    session.run_sync(response_constructor),
+                    statement_timeout + DEFAULT_WATCHDOG_GRACE)
+            except asyncio.TimeoutError as e:
+                raise GatewayTimeout(
+                    "The query took longer than {} seconds".format(
+                        statement_timeout)) from e
+            except Exception as e:
+                raise_for_statement_timeout(statement_guard, e)
+                raise
+    if conditional or data_version is not None:
+        response = make_response_conditional(
+            response, etag=etag, last_modified=last_modified)
+    return compress_response(response, compression)
+
+
+def construct_rollup_query_constructor(rollup, query_constructor):
+    """
+    Answers the queries of query_constructor from the rollup when it has
+    been built and holds the answer for the filter params, refreshing it
+    first when it is older than its max_staleness.
+    """
+    def _rollup_query_constructor(
+            session, query_engine, db_base, filter_params=None):
+        if rollup.can_answer(filter_params):
+            with timed_stage("rollup_refresh"):
+                rollup.refresh_if_stale()
+            if rollup.is_built():
+                return rollup.query(session, filter_params=filter_params)
+        return query_constructor(
+            session, query_engine, db_base, filter_params=filter_params)
+    return _rollup_query_constructor
+
+
+def refresh_registered_rollups(full=False):
+    """
+    Refreshes the rollups of the registered endpoints, each once. Meant to
+    be run on a schedule, like with the dboard-refresh-rollups command.
+    """
+    refreshed = {}
+    for endpoint, rollup in REGISTERED_ROLLUPS.items():
+        if rollup.name not in refreshed:
+            refreshed[rollup.name] = rollup.refresh(full=full)
+    return refreshed
+
+
 def convert_error_to_json_response(e):
     response = e.get_response()
     response.data = json.dumps({
@@ -227,37 +1508,236 @@ def convert_error_to_json_response(e):
     return response
 
 
-def register_query_endpoints(app_or_bp, registration_dict):
+def construct_endpoint_name(url):
+    return url.strip("/").replace("-", "_").replace("/", "_")
+
+
+def fetch_batch_endpoint_names_from_request(endpoints_arg='endpoints'):
+    """
+    The names can be given comma separated, or by repeating the arg.
+    """
+    names = []
+    for value in request.args.getlist(endpoints_arg):
+        names.extend(name.strip() for name in value.split(",") if name.strip())
+    return names
+
+
+def render_widget_payload(widget_func):
+    """
+    Returns the json body of a widget of a batch. An error is returned as
+    the json of the error so that it does not fail the other widgets.
+    """
+    try:
+        response = widget_func()
+    except HTTPException as e:
+        response = convert_error_to_json_response(e)
+    except Exception:
+        current_app.logger.exception("Batch widget failed")
+        response = convert_error_to_json_response(InternalServerError())
+    return response.get_data(as_text=True)
+
+
+def _raise_unknown_widget(name):
+    def _widget_func():
+        raise NotFound("No batchable endpoint named {}".format(name))
+    return _widget_func
+
+
+def submit_batch_widgets(executor_service, widget_funcs, names):
+    """
+    Starts rendering the named widgets on the threads of the
+    ExecutorService, each with a copy of the current request context,
+    and returns the futures mapped to the names.
+    """
+    futures = {}
+    for name in names:
+        widget_func = widget_funcs.get(name)
+        if widget_func is None:
+            widget_func = _raise_unknown_widget(name)
+        futures[executor_service.submit(
+            copy_current_request_context(render_widget_payload),
+            args=[widget_func])] = name
+    return futures
+
+
+def generate_batch_json_chunks(futures):
+    """
+    Sends each widget as soon as it is rendered, so the results are in
+    the order of completion.
+    """
+    yield '{"status": "success", "results": {'
+    separator = ""
+    for future in as_completed(futures):
+        yield separator + _json.dumps(futures[future]) + ": " + \
+            future.result()
+        separator = ", "
+    yield "}}"
+
+
+def construct_batch_response(
+        executor_service, widget_funcs, names=None, stream=None):
+    if names is None:
+        names = fetch_batch_endpoint_names_from_request()
+    if stream is None:
+        stream = fetch_stream_flag_from_request()
+    names = list(dict.fromkeys(names))
+    futures = submit_batch_widgets(executor_service, widget_funcs, names)
+    if stream:
+        return Response(
+            stream_with_context(generate_batch_json_chunks(futures)),
+            mimetype="application/json")
+    payloads = {
+        futures[future]: future.result() for future in as_completed(futures)}
+    return Response(
+        '{"status": "success", "results": {' + ", ".join(
+            _json.dumps(name) + ": " + payloads[name] for name in names) +
+        "}}",
+        mimetype="application/json")
+
+
+def register_query_endpoints(
+        app_or_bp, registration_dict, batch_url=None,
+        batch_max_workers=DEFAULT_BATCH_MAX_WORKERS):
     """
     registration_dict = {
         "/daily-transactions": {
             "query_constructor": some_query_func,
+            "query_engine": some_query_engine,
+            "db_base": some_db_base,
             "filter_params_schema": SomeSchemaClass,
-            "json_query_modifiers": {}
+            "json_query_modifiers": {},
+            "count_strategy": "window",
+            "result_cache": {"ttl": 60, "max_size": 256},
+            "use_core": False,
+            "layout": "split",
+            "statement_timeout": 30,
+            "rollup": some_rollup,
+            "conditional": True,
+            "data_version": select(func.max(SomeModel.updated_at)),
+            "compression": {"level": 6, "min_size": 1024}
         }
     }
+
+    count_strategy is one of the COUNT_STRATEGIES. "cached" keeps the
+    count for count_cache_ttl seconds. "window" counts distinct queries
+    and keyset pages with a separate query, since the window is taken
+    over the rows before they are made distinct, and after the cursor
+    leaves out the earlier pages. "estimate" flags the total with
+    total_items_is_estimate when the planner of the dialect gives one.
+
+    result_cache is either a ResultCache or the config of one as taken
+    by construct_result_cache.
+
+    use_core executes the Core statement of the query and builds the rows
+    from its tuples, skipping the ORM (see fetch_query_results_as_dicts).
+
+    layout is the default QUERY_RESULT_LAYOUTS entry of the json responses,
+    which the layout request arg overrides.
+
+    statement_timeout is the number of seconds the queries of a request
+    may take before they are cancelled and a 504 is returned.
+
+    conditional and data_version make the responses conditional (see
+    render_query_response).
+
+    compression compresses the responses with the content encoding the
+    request accepts best (see construct_compression_config and
+    compress_response).
+
+    rollup is a Rollup of the table the query aggregates. Requests whose
+    filter params the rollup can answer are served from its bucket table
+    instead, as long as it has been refreshed once. The query_constructor
+    should label its columns like Rollup.query does.
+
+    When the query_engine is an AsyncSqlaQueryBuilder, the endpoint is
+    registered as an async view served by async_render_query_response.
+
+    When batch_url is given, a batch endpoint is registered there too,
+    which renders the json of the endpoints named in its endpoints arg
+    (by their endpoint names) in one response, like
+
+    /batch?endpoints=daily_transactions,top_users&filter_params={..}
+
+    The filter params and query modifiers in the args are shared by all
+    the endpoints. They run concurrently on at most batch_max_workers
+    threads of an ExecutorService of its own, shut down when the
+    interpreter exits, each with its own session and so its own pooled
+    connection. The results are keyed by the endpoint names, and an
+    endpoint that fails has its error as its result. With stream=1,
+    each result is sent as soon as it is ready. Async endpoints are not
+    part of the batch.
     """
-    def construct_get_func(
-            query_constructor, json_query_modifiers=None,
-            csv_query_modifiers=None,
-            filter_params_schema=None):
+    def construct_get_func(query_constructor, options):
+        if getattr(options.get("query_engine"), "is_async", False):
+            async def _async_get_func():
+                return await async_render_query_response(
+                    query_constructor, options.get("query_engine"),
+                    options.get("db_base"),
+                    **subdict(options, ENDPOINT_OPTIONS))
+            return _async_get_func
+
         def _get_func():
             return render_query_response(
-                query_constructor, json_query_modifiers=json_query_modifiers,
-                csv_query_modifiers=csv_query_modifiers,
-                filter_params_schema=filter_params_schema)
+                query_constructor, options.get("query_engine"),
+                options.get("db_base"),
+                **subdict(options, ENDPOINT_OPTIONS))
         return _get_func
 
+    def construct_batch_widget_func(query_constructor, options):
+        # The conditional headers of the batch request are not meant for
+        # its widgets, whose payloads go into the batch one uncompressed
+        widget_options = subdict(options, [
+            option for option in ENDPOINT_OPTIONS
+            if option not in ('conditional', 'data_version', 'compression')])
+
+        def _widget_func():
+            return render_query_response(
+                query_constructor, options.get("query_engine"),
+                options.get("db_base"), response_format="json",
+                stream=False, metrics_endpoint=options["endpoint"],
+                **widget_options)
+        return _widget_func
+
+    widget_funcs = {}
     for url, data in registration_dict.items():
-        get_func = construct_get_func(
-            data["query_constructor"],
-            json_query_modifiers=data.get("json_query_modifiers"),
-            csv_query_modifiers=data.get("csv_query_modifiers"),
-            filter_params_schema=data.get("filter_params_schema")
-        )
+        endpoint = construct_endpoint_name(url)
+        options = dict(data)
+        options["endpoint"] = endpoint
+        options["result_cache"] = construct_result_cache(
+            data.get("result_cache"))
+        if options["result_cache"] is not None:
+            REGISTERED_RESULT_CACHES[endpoint] = options["result_cache"]
+        query_constructor = data["query_constructor"]
+        if data.get("rollup") is not None:
+            rollup = data["rollup"]
+            if getattr(options.get("query_engine"), "is_async", False):
+                raise ValueError(
+                    "Rollups cannot be used by async endpoints")
+            if rollup.engine is None:
+                rollup.engine = options["query_engine"].engine
+            REGISTERED_ROLLUPS[endpoint] = rollup
+            query_constructor = construct_rollup_query_constructor(
+                rollup, query_constructor)
+        get_func = construct_get_func(query_constructor, options)
         app_or_bp.route(
-            url, methods=['GET'], endpoint=url.strip("/").replace(
-                "-", "_").replace("/", "_")
+            url, methods=['GET'], endpoint=endpoint
         )(get_func)
+        if not getattr(options.get("query_engine"), "is_async", False):
+            widget_funcs[endpoint] = construct_batch_widget_func(
+                query_constructor, options)
+
+    if batch_url is not None:
+        executor_service = ExecutorService(
+            max_threads=batch_max_workers, thread_name_prefix="dboard-batch")
+        # Its threads are started on the first batch request
+        atexit.register(executor_service.shutdown, wait=False)
+
+        def _batch_func():
+            return construct_batch_response(executor_service, widget_funcs)
+
+        app_or_bp.route(
+            batch_url, methods=['GET'],
+            endpoint=construct_endpoint_name(batch_url)
+        )(_batch_func)
 
     return app_or_bp
@@ -1,20 +1,195 @@
-import pandas as pd
+import json
+from collections import namedtuple
+from operator import attrgetter
 
 from .datetime_utils import *
 from .formatters import *
 from .function_utils import *
+from .cache_utils import *
+from .arrow_utils import *
+from .statement_timeout_utils import *
+from .timing_utils import *
+from .slow_query_utils import *
+from .rollup_utils import *
+from .timeseries_cache_utils import *
+from .compression_utils import *
+from .replica_utils import *
 from sqlalchemy import asc, desc, func
 import sqlalchemy
-from sqlalchemy.orm import class_mapper, query
+from sqlalchemy.orm import class_mapper
+
+
+# labels are the keys of the dicts that convert produces from a row, and
+# the order of the values in the lists that convert_to_list produces
+RowConversionPlan = namedtuple(
+    'RowConversionPlan', ['labels', 'convert', 'convert_to_list'])
+
+# Query shape to the RowConversionPlan compiled for it
+ROW_CONVERSION_PLANS = {}
 
 
 def get_queried_field_labels(q):
-    if len(q._entities) == 0 and isinstance(
-            q._entities[0], query._MapperEntity):
+    return compile_row_conversion_plan(q).labels
+
+
+def get_query_shape(q):
+    if is_single_entity_query(q):
         # If the query is like query(ModelName)
-        return q._entities[0].mapper.columns.keys()
+        return (q.column_descriptions[0]['entity'], )
     # If the query is like query(Model1.col1, Model1.col2)
-    return [e._label_name for e in q._entities]
+    return tuple(column_desc['name'] for column_desc in q.column_descriptions)
+
+
+def construct_row_conversion_plan(q):
+    if is_single_entity_query(q):
+        labels = class_mapper(
+            q.column_descriptions[0]['entity']).columns.keys()
+        getter = attrgetter(*labels)
+        if len(labels) == 1:
+            return RowConversionPlan(
+                labels, lambda item: {labels[0]: getter(item)},
+                lambda item: [getter(item)])
+        return RowConversionPlan(
+            labels, lambda item: dict(zip(labels, getter(item))),
+            lambda item: list(getter(item)))
+    labels = [column_desc['name'] for column_desc in q.column_descriptions]
+    return RowConversionPlan(
+        labels, lambda row: dict(zip(labels, row)), list)
+
+
+def compile_row_conversion_plan(q):
+    """
+    Returns the RowConversionPlan for the shape of the query - the mapped
+    class it queries, or the labels of the columns it queries. The plan
+    is built once per shape and reused by every later query of the same
+    shape.
+    """
+    shape = get_query_shape(q)
+    plan = ROW_CONVERSION_PLANS.get(shape)
+    if plan is None:
+        plan = ROW_CONVERSION_PLANS.setdefault(
+            shape, construct_row_conversion_plan(q))
+    return plan
+
+
+def get_query_primary_key_columns(q):
+    """
+    Returns the primary key columns of the first entity in the query,
+    along with the keys under which they appear in the queried rows.
+    """
+    entity = q.column_descriptions[0]['entity']
+    if entity is None:
+        raise ValueError(
+            "Cannot determine the primary key of a query without entities")
+    mapper = class_mapper(entity)
+    return [
+        (mapper.get_property_by_column(col).key, col)
+        for col in mapper.primary_key]
+
+
+def get_queried_field_expression(q, field_name):
+    for column_desc in q.column_descriptions:
+        if column_desc['name'] == field_name and \
+                column_desc['expr'] is not column_desc['entity']:
+            return column_desc['expr']
+    for column_desc in q.column_descriptions:
+        if column_desc['entity'] is not None:
+            col = class_mapper(column_desc['entity']).columns.get(field_name)
+            if col is not None:
+                return col
+    return sqlalchemy.literal_column(field_name)
+
+
+def is_nullable_expression(expr):
+    """
+    Whether the expression is a column that can be NULL. Other
+    expressions are taken not to be.
+    """
+    expr = getattr(expr, "expression", expr)
+    while isinstance(expr, sqlalchemy.sql.elements.Label):
+        expr = expr.element
+    return isinstance(expr, sqlalchemy.Column) and bool(expr.nullable)
+
+
+def is_distinct_query(q):
+    return bool(getattr(q, "_distinct", False) or
+                getattr(q, "_distinct_on", None))
+
+
+def is_single_entity_query(q):
+    descs = q.column_descriptions
+    return len(descs) == 1 and descs[0]['expr'] is descs[0]['entity']
+
+
+def get_query_cache_key(q, *extra_parts):
+    """
+    Returns a digest of the compiled sql of the query and its bound
+    parameters, which is what identifies the result of the query.
+    """
+    # Compiled for the database the query runs on, whose constructs the
+    # default dialect may not know or may render the same
+    bind = q.session.get_bind() if q.session is not None else None
+    compiled = q.statement.compile(
+        dialect=bind.dialect if bind is not None else None)
+    return get_cache_key(
+        str(compiled), sorted(compiled.params.items()), *extra_parts)
+
+
+def explain_sqla_statement(connection, statement, explain_prefix="EXPLAIN"):
+    """
+    Runs the statement prefixed with explain_prefix on the raw DBAPI
+    connection, so that the driver's own param style is used for the
+    bound parameters.
+    """
+    compiled = statement.compile(dialect=connection.dialect)
+    params = compiled.params
+    if connection.dialect.positional:
+        params = tuple(params[k] for k in compiled.positiontup)
+    return explain_raw_statement(
+        connection, str(compiled), params, explain_prefix)
+
+
+def estimate_query_count(q):
+    """
+    Returns the number of rows the query planner expects the query to
+    return. Dialects without a usable estimate fall back to an exact
+    count.
+    """
+    estimate = fetch_planner_count_estimate(q)
+    return q.count() if estimate is None else estimate
+
+
+def fetch_planner_count_estimate(q):
+    """
+    The number of rows the query planner expects the query to return, or
+    None when the dialect or the shape of the plan gives no usable
+    estimate.
+    """
+    connection = q.session.connection()
+    dialect_name = connection.dialect.name
+    if dialect_name == 'postgresql':
+        plan = explain_sqla_statement(
+            connection, q.statement, "EXPLAIN (FORMAT JSON)")[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    if dialect_name == 'mysql':
+        cursor_rows = explain_sqla_statement(
+            connection, q.statement, "EXPLAIN FORMAT=TRADITIONAL")
+        # The id and select_type columns come first in the traditional
+        # format. The estimates of subqueries, derived tables and unions
+        # do not combine simply, so those are counted.
+        if any(row[0] != 1 or row[1] != "SIMPLE" for row in cursor_rows):
+            return None
+        # Each joined table multiplies the rows of the ones before it by
+        # its rows (the 10th column) times the percentage of them left
+        # after the conditions (the 11th)
+        estimate = 1.0
+        for row in cursor_rows:
+            estimate *= int(row[9] or 0) * float(
+                100 if row[10] is None else row[10]) / 100
+        return int(round(estimate))
+    return None
 
 
 def sqla_sort(sort_order):
@@ -28,14 +203,136 @@ def convert_sqla_collection_item_to_dict(item):
         type(item)).columns.keys()}
 
 
-def convert_sqla_collection_items_to_dicts(collection):
-    return [convert_sqla_collection_item_to_dict(item) for item in collection]
+def convert_sqla_collection_items_to_dicts(collection, convert=None):
+    if convert is None:
+        convert = convert_sqla_collection_item_to_dict
+    return [convert(item) for item in collection]
+
+
+def fetch_query_results_as_dicts(q, use_core=False):
+    """
+    With use_core, the Core statement behind the query is executed and
+    its tuple rows are zipped with the column labels of the result,
+    skipping the ORM identity map. The keys are the same either way, as
+    the statement is labeled with get_queried_field_labels (see
+    construct_core_statement).
+    """
+    if use_core:
+        with timed_stage("fetch"):
+            result = execute_sqla_query_statement(q)
+            labels = list(result.keys())
+            rows = result.fetchall()
+        with timed_stage("convert"):
+            return [dict(zip(labels, row)) for row in rows]
+    with timed_stage("fetch"):
+        items = q.all()
+    with timed_stage("convert"):
+        return convert_sqla_collection_items_to_dicts(
+            items, convert=compile_row_conversion_plan(q).convert)
+
+
+def fetch_query_results_as_lists(q, use_core=False):
+    """
+    Like fetch_query_results_as_dicts, but each row is a list of values
+    in the order of get_queried_field_labels.
+    """
+    if use_core:
+        with timed_stage("fetch"):
+            rows = execute_sqla_query_statement(q).fetchall()
+        with timed_stage("convert"):
+            return [list(row) for row in rows]
+    with timed_stage("fetch"):
+        items = q.all()
+    with timed_stage("convert"):
+        convert_to_list = compile_row_conversion_plan(q).convert_to_list
+        return [convert_to_list(item) for item in items]
+
+
+def iterate_sqla_query_in_batches(
+        q, batch_size=1000, use_core=False, as_lists=False):
+    """
+    Yields the results of the query as lists of dicts (or of lists of
+    values with as_lists) of at most batch_size rows each. The driver is
+    asked for a server side cursor where it supports one, so only a
+    single batch is held in memory at a time.
+    """
+    if use_core:
+        result = q.session.connection().execution_options(
+            stream_results=True).execute(construct_core_statement(q))
+        labels = list(result.keys())
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                add_to_stage_count("rows", len(rows))
+                if as_lists:
+                    yield [list(row) for row in rows]
+                else:
+                    yield [dict(zip(labels, row)) for row in rows]
+        finally:
+            result.close()
+        return
+    plan = compile_row_conversion_plan(q)
+    convert = plan.convert_to_list if as_lists else plan.convert
+    batch = []
+    for item in q.yield_per(batch_size):
+        batch.append(item)
+        if len(batch) == batch_size:
+            add_to_stage_count("rows", len(batch))
+            yield convert_sqla_collection_items_to_dicts(
+                batch, convert=convert)
+            batch = []
+    if batch:
+        add_to_stage_count("rows", len(batch))
+        yield convert_sqla_collection_items_to_dicts(batch, convert=convert)
+
+
+def construct_core_statement(q):
+    """
+    The Core statement behind the query, selecting the columns labeled
+    with get_queried_field_labels in that order. The plain statement of
+    a query uses the column names, which differ from the attribute
+    names of the mapped classes when a column is given another name.
+    """
+    labels = get_queried_field_labels(q)
+    if is_single_entity_query(q):
+        mapper = class_mapper(q.column_descriptions[0]['entity'])
+        columns = [mapper.columns[label] for label in labels]
+    else:
+        columns = get_sqla_statement_columns(q.statement)
+    return q.statement.with_only_columns(*[
+        col.label(label) for col, label in zip(columns, labels)])
+
+
+def execute_sqla_query_statement(q):
+    """
+    Executes the Core statement behind the query on the session's
+    connection. The result holds plain tuple rows keyed by the labels
+    of get_queried_field_labels, skipping the ORM entity loading.
+    """
+    return q.session.connection().execute(construct_core_statement(q))
+
+
+def get_sqla_statement_columns(statement):
+    if hasattr(statement, 'selected_columns'):
+        return list(statement.selected_columns)
+    return list(statement.columns)
 
 
 def groupby_result_to_pd_series(result):
+    import pandas as pd
     return pd.Series({k: v for k, v in result})
 
 
 def null_safe_sum(col):
     return func.sum(func.ifnull(col, 0))
 
+
+def __getattr__(name):
+    # pandas is imported on first use, but stays reachable as utils.pd
+    if name == "pd":
+        import pandas
+        return pandas
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,236 @@
+import datetime
+import decimal
+import json
+from io import BytesIO
+
+from .timing_utils import add_to_stage_count
+
+# Bound by import_pyarrow on first use, since pyarrow pulls in numpy
+pa = None
+pq = None
+
+
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MIMETYPE = "application/vnd.apache.parquet"
+
+# The precision and scale of the decimals of numeric columns declared
+# without them
+DEFAULT_ARROW_DECIMAL_PRECISION = 38
+DEFAULT_ARROW_DECIMAL_SCALE = 10
+
+
+def import_pyarrow():
+    """
+    Imports pyarrow into pa and pq, and returns whether it is installed.
+    """
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+def ensure_pyarrow():
+    if not import_pyarrow():
+        raise ImportError(
+            "pyarrow is required for the arrow and parquet formats. "
+            "Install it with pip install pyarrow")
+
+
+def arrow_type_for_sqla_type(sqla_type):
+    """
+    Returns the arrow type for the python type of a SQLAlchemy column
+    type, or None when the values have to be sent as strings. Timestamps
+    with a time zone are sent in UTC, tagged with it. Numerics declared
+    without a precision get DEFAULT_ARROW_DECIMAL_PRECISION digits,
+    DEFAULT_ARROW_DECIMAL_SCALE of them after the point.
+    """
+    try:
+        python_type = sqla_type.python_type
+    except NotImplementedError:
+        return None
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is str:
+        return pa.string()
+    if python_type is bytes:
+        return pa.binary()
+    if python_type is datetime.datetime:
+        return pa.timestamp(
+            'us', tz='UTC' if getattr(sqla_type, 'timezone', False)
+            else None)
+    if python_type is datetime.date:
+        return pa.date32()
+    if python_type is datetime.time:
+        return pa.time64('us')
+    if python_type is decimal.Decimal:
+        if getattr(sqla_type, 'precision', None):
+            return pa.decimal128(sqla_type.precision, sqla_type.scale or 0)
+        return pa.decimal128(
+            DEFAULT_ARROW_DECIMAL_PRECISION, DEFAULT_ARROW_DECIMAL_SCALE)
+    return None
+
+
+def convert_value_to_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def construct_arrow_values_converter(arrow_type):
+    """
+    Returns the function turning the values of a column in a batch into
+    the values arrow takes for arrow_type, or None when they go in as
+    they are.
+    """
+    if arrow_type == pa.string():
+        return lambda values: [convert_value_to_string(v) for v in values]
+    if pa.types.is_decimal(arrow_type):
+        # Rounded to the scale, which arrow refuses to do itself
+        exponent = decimal.Decimal(1).scaleb(-arrow_type.scale)
+        return lambda values: [
+            v.quantize(exponent) if isinstance(v, decimal.Decimal) else v
+            for v in values]
+    return None
+
+
+def generate_record_batches_from_result(
+        result, columns=None, batch_size=10000):
+    """
+    Builds record batches straight from the column values of batch_size
+    tuple rows fetched off the cursor at a time. columns are the
+    SQLAlchemy columns of the statement, whose types fix the arrow
+    schema up front (see arrow_type_for_sqla_type), so that every batch
+    has the schema of the first whatever its values. The columns without
+    a known type, or all of them when columns are not given, are sent as
+    strings.
+    """
+    ensure_pyarrow()
+    labels = list(result.keys())
+    types = [
+        arrow_type_for_sqla_type(col.type) for col in columns
+    ] if columns else [None] * len(labels)
+    types = [pa.string() if t is None else t for t in types]
+    converters = [construct_arrow_values_converter(t) for t in types]
+    schema = pa.schema(list(zip(labels, types)))
+    batches_yielded = False
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        batches_yielded = True
+        add_to_stage_count("rows", len(rows))
+        arrays = []
+        for values, arrow_type, convert in zip(
+                zip(*rows), types, converters):
+            if convert is not None:
+                values = convert(values)
+            arrays.append(pa.array(values, type=arrow_type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+    if not batches_yielded:
+        # An empty batch still carries the schema to the client
+        yield pa.RecordBatch.from_arrays(
+            [pa.array([], type=t) for t in types], schema=schema)
+
+
+class ChunkedSink(object):
+    """
+    A write only file object that hands out the bytes written since the
+    last drain, while tell() keeps counting from the start of the file
+    as the parquet writer expects.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        content = b"".join(self.chunks)
+        self.chunks = []
+        return content
+
+
+def generate_arrow_stream_chunks(record_batches):
+    """
+    Yields the bytes of an arrow IPC stream as each batch is written.
+    """
+    sink = ChunkedSink()
+    writer = None
+    for batch in record_batches:
+        if writer is None:
+            writer = pa.ipc.new_stream(
+                pa.PythonFile(sink, mode='w'), batch.schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def generate_parquet_chunks(record_batches):
+    """
+    Yields the bytes of a parquet file, one row group per batch. The
+    file is only complete once the footer goes out with the last chunk.
+    """
+    sink = ChunkedSink()
+    writer = None
+    for batch in record_batches:
+        if writer is None:
+            writer = pq.ParquetWriter(
+                pa.PythonFile(sink, mode='w'), batch.schema)
+        writer.write_table(pa.Table.from_batches([batch]))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def convert_df_to_arrow_table(df):
+    ensure_pyarrow()
+    return pa.Table.from_pandas(df)
+
+
+def convert_df_to_arrow_stream_bytes(df):
+    table = convert_df_to_arrow_table(df)
+    sink = BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def convert_df_to_parquet_bytes(df):
+    table = convert_df_to_arrow_table(df)
+    sink = BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+def convert_arrow_stream_bytes_to_df(data):
+    ensure_pyarrow()
+    return pa.ipc.open_stream(data).read_all().to_pandas()
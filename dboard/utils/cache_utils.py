@@ -0,0 +1,200 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def get_cache_key(*parts):
+    return hashlib.sha1(
+        "\n".join(repr(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class InProcessCacheBackend(object):
+    """
+    A thread safe in-process cache whose entries expire ttl seconds after
+    they are set. When max_size is given, the least recently used entry
+    is evicted to make room for a new one.
+    """
+
+    def __init__(self, ttl=300, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while self.max_size and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileSystemCacheBackend(object):
+    """
+    Keeps each entry pickled in its own file under cache_dir, so that the
+    cache can be shared by all the workers on a host. The modification
+    time of a file is bumped whenever it is read, and the least recently
+    used files are removed once there are more than max_size of them.
+    """
+
+    file_suffix = ".dboard-cache"
+
+    def __init__(self, cache_dir, ttl=300, max_size=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(
+            self.cache_dir,
+            hashlib.sha1(str(key).encode('utf-8')).hexdigest() +
+            self.file_suffix)
+
+    def _cache_files(self):
+        return [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.endswith(self.file_suffix)]
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                value, expires_at = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        if expires_at < time.time():
+            self._remove(path)
+            return default
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            pickle.dump((value, time.time() + ttl), tmp_file)
+        os.replace(tmp_path, self._path(key))
+        if self.max_size:
+            self._evict()
+
+    def _evict(self):
+        paths = self._cache_files()
+        if len(paths) <= self.max_size:
+            return
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+        for path in sorted(mtimes, key=mtimes.get)[
+                :len(mtimes) - self.max_size]:
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def clear(self):
+        for path in self._cache_files():
+            self._remove(path)
+
+    def __len__(self):
+        return len(self._cache_files())
+
+
+class ResultCache(object):
+    """
+    Wraps a cache backend and counts the hits and misses on it. Any
+    object with the get/set/delete/clear methods of the backends above
+    can be used as the backend.
+    """
+
+    def __init__(self, backend=None, ttl=None):
+        self.backend = backend if backend is not None else \
+            InProcessCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, ttl=ttl if ttl is not None else self.ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None
+        }
+
+
+def construct_result_cache(cache_config):
+    """
+    cache_config is either a ResultCache or a dict like
+    {"ttl": 60, "max_size": 256} or {"backend": FileSystemCacheBackend(..)}
+    """
+    if cache_config is None or isinstance(cache_config, ResultCache):
+        return cache_config
+    backend = cache_config.get("backend")
+    if backend is None:
+        backend = InProcessCacheBackend(
+            ttl=cache_config.get("ttl") or 300,
+            max_size=cache_config.get("max_size", 256))
+    return ResultCache(backend=backend, ttl=cache_config.get("ttl"))
@@ -0,0 +1,102 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The content encodings offered, the preferred first when the client
+# accepts several of them equally
+DEFAULT_CONTENT_ENCODINGS = ("zstd", "gzip", "deflate")
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Bodies smaller than this many bytes are sent as they are
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+
+DEFAULT_COMPRESSION_CONFIG = {
+    "level": DEFAULT_COMPRESSION_LEVEL,
+    "min_size": DEFAULT_COMPRESSION_MIN_SIZE,
+    "encodings": DEFAULT_CONTENT_ENCODINGS,
+}
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "application/x-ndjson", "text/csv", "text/plain",
+    "text/html", "application/vnd.apache.arrow.stream",
+}
+
+
+def construct_compression_config(compression):
+    """
+    compression is either None or False for no compression, True for the
+    DEFAULT_COMPRESSION_CONFIG, a compression level, or a dict overriding
+    some of the DEFAULT_COMPRESSION_CONFIG like {"level": 9}.
+    """
+    if compression is None or compression is False:
+        return None
+    if compression is True:
+        return dict(DEFAULT_COMPRESSION_CONFIG)
+    if isinstance(compression, int):
+        return dict(DEFAULT_COMPRESSION_CONFIG, level=compression)
+    return dict(DEFAULT_COMPRESSION_CONFIG, **compression)
+
+
+def get_available_content_encodings(encodings=DEFAULT_CONTENT_ENCODINGS):
+    return [
+        encoding for encoding in encodings
+        if encoding != "zstd" or zstandard is not None]
+
+
+class ZstdCompressObj(object):
+    """
+    Gives a zstandard compressor the compress/flush interface of the
+    zlib compression objects.
+    """
+
+    def __init__(self, level):
+        self.compressobj = zstandard.ZstdCompressor(
+            level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressobj.compress(data)
+
+    def flush(self):
+        return self.compressobj.flush()
+
+
+def construct_compressobj(encoding, level=DEFAULT_COMPRESSION_LEVEL):
+    if encoding == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        # The zlib format, which is what HTTP calls deflate
+        return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise ImportError(
+                "zstandard is required for the zstd content encoding. "
+                "Install it with pip install zstandard")
+        return ZstdCompressObj(level)
+    raise ValueError("Unknown content encoding {}".format(encoding))
+
+
+def compress_bytes(data, encoding, level=DEFAULT_COMPRESSION_LEVEL):
+    compressobj = construct_compressobj(encoding, level=level)
+    return compressobj.compress(data) + compressobj.flush()
+
+
+def generate_compressed_chunks(
+        chunks, encoding, level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    Compresses the chunks of a streamed body as they come. The
+    compressor holds on to its input until it has enough to emit a
+    block, so only the non empty outputs are yielded.
+    """
+    compressobj = construct_compressobj(encoding, level=level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        compressed = compressobj.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressobj.flush()
@@ -1,17 +1,15 @@
-import dash_table
-import numpy as np
-import pandas as pd
-
 from toolspy import merge
 from flask import Response
 
-from .formatters import format_value
+from .formatters import format_series
 
 
 def convert_timestamp_indexed_df_to_dt(
         df, dt_id=None, types_of_fields=None,
         timestamp_col_name_format="%b %Y"):
-    df = df.replace(np.nan, 0, regex=True)
+    import dash_table
+    import pandas as pd
+    df = df.fillna(0)
     field_types = {
         field: field_type
         for field_type, fields in types_of_fields.items()
@@ -25,32 +23,31 @@ def convert_timestamp_indexed_df_to_dt(
                 "id": col_name
             } for col_name in df.columns
         ]
-        dt_rows = [
-            merge({
-                k: format_value(v, field_types.get(k))
-                for k, v in row.items()
-            }, {
-                "period": idx.strftime(
-                    timestamp_col_name_format),
-            }) for idx, row in zip(
-                df.index, df.to_dict('records'))
-        ]
+        formatted_df = pd.DataFrame({
+            col_name: format_series(df[col_name], field_types.get(col_name))
+            for col_name in df.columns
+        }, index=df.index)
+        formatted_df["period"] = df.index.strftime(timestamp_col_name_format)
+        dt_rows = formatted_df.to_dict('records')
     else:
-        print("in else block")
+        period_names = pd.DatetimeIndex(df.columns).strftime(
+            timestamp_col_name_format).tolist()
         dt_columns = [
             {"name": "Metric", "id": "metric"}] + [
             {
-                "name": i.strftime(timestamp_col_name_format),
-                "id": i.strftime(timestamp_col_name_format)
-            } for i in df.columns
+                "name": period_name,
+                "id": period_name
+            } for period_name in period_names
+        ]
+        formatted_rows = [
+            format_series(
+                df.iloc[i], field_types.get(metric)).tolist()
+            for i, metric in enumerate(df.index)
         ]
-        dt_rows = [merge({
-            k.strftime(
-                timestamp_col_name_format): format_value(
-                v, field_types.get(idx))
-            for k, v in row.items()}, {
-                "metric": idx.replace("_", " ").capitalize()}
-        ) for idx, row in zip(df.index, df.to_dict('records'))]
+        dt_rows = [merge(
+            dict(zip(period_names, row)),
+            {"metric": metric.replace("_", " ").capitalize()}
+        ) for metric, row in zip(df.index, formatted_rows)]
     return dash_table.DataTable(
         id=dt_id or 'table',
         style_data={'whiteSpace': 'normal'},
@@ -83,14 +80,16 @@ def convert_monthly_df_to_dt(
 
 
 def convert_dt_to_df(dt, index_col=None):
-    df = pd.DataFrame(dt.data).replace(np.nan, 0, regex=True)
+    import pandas as pd
+    df = pd.DataFrame(dt.data).fillna(0)
     if index_col:
         df = df.set_index(index_col)
     return df
 
 
 def convert_dt_data_to_df(dt_data, index_col=None):
-    df = pd.DataFrame(dt_data).replace(np.nan, 0, regex=True)
+    import pandas as pd
+    df = pd.DataFrame(dt_data).fillna(0)
     if index_col:
         df = df.set_index(index_col)
     return df
@@ -1,5 +1,5 @@
 from sqlalchemy import func
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 def tz_str(mins):
@@ -17,14 +17,9 @@ def tz_converted_date(datetime_col, timedelta_mins):
 
 
 def next_month_start(dt):
-    month = (dt.month + 1) % 12
-    if month == 0:
-        month = 12
     if dt.month == 12:
-        year = dt.year
-    else:
-        year = dt.year + int((dt.month + 1) / 12)
-    return datetime(year, month, 1, 0, 0)
+        return datetime(dt.year + 1, 1, 1, 0, 0)
+    return datetime(dt.year, dt.month + 1, 1, 0, 0)
 
 
 def this_month_start(dt):
@@ -37,3 +32,51 @@ def month_format(datetime_col):
 def date_format(datetime_col):
     return func.date_format(datetime_col, "%Y-%m-%d")
 
+
+# The labels of the time buckets of each grain, as month_format and
+# date_format render them
+TIME_GRAIN_FORMATS = {
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+POSTGRES_TIME_GRAIN_FORMATS = {
+    "day": "YYYY-MM-DD",
+    "month": "YYYY-MM",
+}
+
+
+def time_bucket_start(dt, grain):
+    if grain == "month":
+        return this_month_start(dt)
+    return datetime(dt.year, dt.month, dt.day, 0, 0)
+
+
+def time_bucket_label(dt, grain):
+    return dt.strftime(TIME_GRAIN_FORMATS[grain])
+
+
+def time_bucket_expression(
+        datetime_col, grain, dialect_name, timedelta_mins=0):
+    """
+    The label of the time bucket of datetime_col, shifted by
+    timedelta_mins, in the format of month_format and date_format, on
+    the dialects other than mysql too.
+    """
+    if dialect_name == "mysql":
+        if timedelta_mins:
+            datetime_col = tz_convert(datetime_col, timedelta_mins)
+        if grain == "month":
+            return month_format(datetime_col)
+        return date_format(datetime_col)
+    if dialect_name == "sqlite":
+        return func.strftime(
+            TIME_GRAIN_FORMATS[grain], datetime_col,
+            "{:+d} minutes".format(timedelta_mins))
+    if dialect_name == "postgresql":
+        if timedelta_mins:
+            datetime_col = datetime_col + timedelta(minutes=timedelta_mins)
+        return func.to_char(
+            datetime_col, POSTGRES_TIME_GRAIN_FORMATS[grain])
+    raise ValueError(
+        "Time buckets are not supported on {}".format(dialect_name))
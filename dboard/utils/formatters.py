@@ -12,3 +12,80 @@ def format_value(value, field_type=None):
     if field_type == 'percentage':
         return format_as_percentage(value)
     return value
+
+
+# Beyond this many hundredths, a float has no digits after the point
+# left to round. Such values, like nan and inf, are formatted one by one
+MAX_VECTORIZED_HUNDREDTHS = 2 ** 52
+
+
+def round_to_hundredths(values):
+    """
+    Rounds the float array times 100 to the nearest integer, half to
+    even, the way format rounds them to two decimals. A float times 100
+    is rarely a float itself, so the product is kept as the sum of a
+    rounded float and its exact error, which Dekker's product splits
+    off.
+    """
+    import numpy as np
+    quadrupled = values * 4
+    split = quadrupled * 134217729.0
+    high = split - (split - quadrupled)
+    low = quadrupled - high
+    product = quadrupled * 25
+    error = (high * 25 - product) + low * 25
+    rounded = np.round(product)
+    # Only a product rounded from halfway can have an error deciding
+    # which way the exact value goes
+    remainder = product - rounded
+    return rounded + ((remainder == 0.5) & (error > 0)) - (
+        (remainder == -0.5) & (error < 0))
+
+
+def format_series_as_fixed_point(series, thousands_separator=False):
+    """
+    Formats the numbers of a Series with two decimals like "{:.2f}", or
+    "{:,.2f}" with the thousands separator, with array and string
+    operations over the whole Series instead of a format call per value.
+    """
+    import numpy as np
+    import pandas as pd
+    values = series.astype(float).to_numpy()
+    hundredths = round_to_hundredths(np.where(np.isfinite(values), values, 0))
+    vectorized = np.isfinite(values) & (
+        np.abs(hundredths) < MAX_VECTORIZED_HUNDREDTHS)
+    hundredths = np.abs(np.where(vectorized, hundredths, 0)).astype("int64")
+    whole = pd.Series(hundredths // 100, index=series.index).astype(str)
+    if thousands_separator:
+        whole = whole.str.replace(r"\B(?=(\d{3})+$)", ",", regex=True)
+    fraction = pd.Series(hundredths % 100, index=series.index).astype(str)
+    formatted = whole + "." + fraction.str.zfill(2)
+    # format keeps the sign of the negative values rounded to 0 too
+    formatted = formatted.where(~np.signbit(values), "-" + formatted)
+    if vectorized.all():
+        return formatted
+    value_format = "{:,.2f}" if thousands_separator else "{:.2f}"
+    formatted[~vectorized] = series[~vectorized].map(
+        lambda value: value_format.format(float(value)))
+    return formatted
+
+
+def format_series_as_currency(series):
+    return "Rs. " + format_series_as_fixed_point(
+        series, thousands_separator=True)
+
+
+def format_series_as_percentage(series):
+    return format_series_as_fixed_point(series) + " %"
+
+
+def format_series(series, field_type=None):
+    """
+    Formats a whole pandas Series the way format_value formats each of
+    its values.
+    """
+    if field_type == 'currency':
+        return format_series_as_currency(series)
+    if field_type == 'percentage':
+        return format_series_as_percentage(series)
+    return series
@@ -1,5 +1,14 @@
+import atexit
 import multiprocessing
-from multiprocessing.dummy import Pool as ThreadPool
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .arrow_utils import (
+    import_pyarrow, convert_df_to_arrow_stream_bytes,
+    convert_arrow_stream_bytes_to_df)
 
 
 def run_function_and_store_return_value(
@@ -35,11 +44,231 @@ def function_runner(function=None, args=None, kwargs=None):
     return function(*args, **kwargs)
 
 
-def run_in_threads(func_args_kwargs_list):
-    pool = ThreadPool()
-    return pool.starmap(function_runner, func_args_kwargs_list)
+# A DataFrame returned from a worker process, left in a shared memory
+# block as an Arrow stream instead of being pickled back.
+SharedArrowFrame = namedtuple("SharedArrowFrame", ["shm_name", "size"])
+
+# multiprocessing.shared_memory is new in python 3.8. Before it the
+# DataFrames are pickled back like any other value.
+SHARED_MEMORY_SUPPORTED = sys.version_info >= (3, 8)
+
+
+def create_untracked_shared_memory(size):
+    """
+    Creates a shared memory block that the resource tracker of the
+    process does not unlink when the process exits, as the block is
+    meant to outlive it.
+    """
+    from multiprocessing import shared_memory
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    if os.name == "posix":
+        # The workaround of bpo-38119. The tracker is given the name of
+        # the block with the leading slash of POSIX shared memory names,
+        # which the name attribute leaves out.
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+    return shm
+
+
+def share_df(df):
+    data = convert_df_to_arrow_stream_bytes(df)
+    # The block is unlinked by the parent once it is loaded, so the
+    # worker must not clean it up when it exits.
+    shm = create_untracked_shared_memory(max(len(data), 1))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return SharedArrowFrame(shm.name, len(data))
+
+
+def load_shared_df(shared_frame):
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shared_frame.shm_name)
+    try:
+        data = bytes(shm.buf[:shared_frame.size])
+    finally:
+        shm.close()
+        shm.unlink()
+    return convert_arrow_stream_bytes_to_df(data)
+
+
+def process_function_runner(function=None, args=None, kwargs=None):
+    return_value = function_runner(function=function, args=args, kwargs=kwargs)
+    # The value can only be a DataFrame when pandas has been imported
+    pd = sys.modules.get("pandas")
+    if SHARED_MEMORY_SUPPORTED and pd is not None and \
+            isinstance(return_value, pd.DataFrame) and import_pyarrow():
+        return share_df(return_value)
+    return return_value
+
+
+def load_process_result(return_value):
+    if isinstance(return_value, SharedArrowFrame):
+        return load_shared_df(return_value)
+    return return_value
+
+
+class ExecutorService(object):
+    """
+    Long lived thread and process pools, started on first use and
+    reused by every call, instead of a new pool per call.
+
+    The tasks are (function, args, kwargs) tuples like the ones taken by
+    function_runner. timeout is the number of seconds the result of
+    each task is waited for. When it runs out, or a task fails, the
+    tasks of the run that have not started are cancelled. Tasks that
+    already started cannot be interrupted; they run to completion and
+    their results are dropped.
+
+    DataFrames returned by tasks run in processes travel back through
+    shared memory as Arrow streams when pyarrow is installed, on python
+    3.8 and later.
+    """
+
+    def __init__(
+            self, max_threads=None, max_processes=None,
+            default_timeout=None, thread_name_prefix="dboard-executor"):
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self.default_timeout = default_timeout
+        self.thread_name_prefix = thread_name_prefix
+        self._thread_pool = None
+        self._process_pool = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def thread_pool(self):
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=self.max_threads,
+                    thread_name_prefix=self.thread_name_prefix)
+            return self._thread_pool
+
+    @property
+    def process_pool(self):
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.max_processes)
+            return self._process_pool
+
+    def submit(self, function, args=None, kwargs=None, use_processes=False):
+        if use_processes:
+            future = self.process_pool.submit(
+                process_function_runner, function=function, args=args,
+                kwargs=kwargs)
+        else:
+            future = self.thread_pool.submit(
+                function_runner, function=function, args=args,
+                kwargs=kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def gather(self, futures, timeout=None, use_processes=False):
+        if timeout is None:
+            timeout = self.default_timeout
+        results = []
+        try:
+            for future in futures:
+                result = future.result(timeout=timeout)
+                results.append(
+                    load_process_result(result) if use_processes else result)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            if use_processes:
+                # The frames shared by the tasks whose results were not
+                # loaded are freed whenever those tasks finish.
+                for future in futures[len(results):]:
+                    future.add_done_callback(_release_shared_result)
+            raise
+        return results
+
+    def run(self, func_args_kwargs_list, use_processes=False, timeout=None):
+        """
+        Returns the results in the order of the tasks. Raises
+        concurrent.futures.TimeoutError when a result is not ready
+        timeout seconds after the previous one.
+        """
+        futures = [
+            self.submit(*task, use_processes=use_processes)
+            for task in func_args_kwargs_list]
+        return self.gather(
+            futures, timeout=timeout, use_processes=use_processes)
+
+    def run_named(self, tasks, use_processes=False, timeout=None):
+        """
+        Returns the results keyed by the task names. tasks is either a
+        dict of names to tasks, or a list of tasks which are then named
+        after their functions, like in run_function_and_store_return_value.
+        """
+        if not isinstance(tasks, dict):
+            tasks = {task[0].__name__: task for task in tasks}
+        names = list(tasks)
+        return dict(zip(names, self.run(
+            [tasks[name] for name in names], use_processes=use_processes,
+            timeout=timeout)))
+
+    def cancel_pending(self):
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+
+    def shutdown(self, wait=True):
+        self.cancel_pending()
+        with self._lock:
+            pools = [self._thread_pool, self._process_pool]
+            self._thread_pool = self._process_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=wait)
+
+
+def _release_shared_result(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if isinstance(result, SharedArrowFrame):
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=result.shm_name)
+        shm.close()
+        shm.unlink()
+
+
+_default_executor_service = None
+_default_executor_service_lock = threading.Lock()
+
+
+def get_default_executor_service():
+    global _default_executor_service
+    with _default_executor_service_lock:
+        if _default_executor_service is None:
+            _default_executor_service = ExecutorService()
+            atexit.register(_default_executor_service.shutdown, wait=False)
+        return _default_executor_service
+
+
+def run_in_threads(func_args_kwargs_list, executor_service=None, timeout=None):
+    if executor_service is None:
+        executor_service = get_default_executor_service()
+    return executor_service.run(func_args_kwargs_list, timeout=timeout)
 
 
-def run_in_processes(func_args_kwargs_list):
-    pool = multiprocessing.Pool()
-    return pool.starmap(function_runner, func_args_kwargs_list)
+def run_in_processes(
+        func_args_kwargs_list, executor_service=None, timeout=None):
+    if executor_service is None:
+        executor_service = get_default_executor_service()
+    return executor_service.run(
+        func_args_kwargs_list, use_processes=True, timeout=timeout)
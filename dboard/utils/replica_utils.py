@@ -0,0 +1,256 @@
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+
+REPLICA_BALANCING_STRATEGIES = ["round_robin", "least_connections"]
+
+DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL = 30
+
+# Queries returning the replication lag of a replica in seconds, and 0
+# on a primary
+REPLICATION_LAG_QUERIES = {
+    "postgresql": (
+        "SELECT CASE WHEN pg_is_in_recovery() THEN COALESCE(EXTRACT(EPOCH "
+        "FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"),
+}
+
+_current_replication_lag_limit = contextvars.ContextVar(
+    "dboard_replication_lag_limit", default=None)
+
+
+@contextmanager
+def replication_lag_limit(max_lag):
+    """
+    The sessions and DBStores first used inside it only read from the
+    replicas known to lag at most max_lag seconds behind. 0 reads from
+    the primary, and None from any healthy replica. A session only used
+    once it is exited, like by the body of a streamed response, has to
+    be handed to begin_routed_transaction inside it.
+    """
+    token = _current_replication_lag_limit.set(max_lag)
+    try:
+        yield
+    finally:
+        _current_replication_lag_limit.reset(token)
+
+
+def current_replication_lag_limit():
+    return _current_replication_lag_limit.get()
+
+
+def fetch_replication_lag(connection, lag_query=None):
+    """
+    The replication lag of the database in seconds, or None when there is
+    no way to tell, like on sqlite.
+    """
+    if lag_query is None:
+        lag_query = REPLICATION_LAG_QUERIES.get(connection.dialect.name)
+    if lag_query is not None:
+        lag = connection.execute(text(lag_query)).scalar()
+        return None if lag is None else float(lag)
+    if connection.dialect.name == "mysql":
+        try:
+            row = connection.execute(
+                text("SHOW REPLICA STATUS")).mappings().first()
+        except Exception:
+            # Before mysql 8.0.22
+            row = connection.execute(
+                text("SHOW SLAVE STATUS")).mappings().first()
+        if row is None:
+            # Not a replica
+            return 0.0
+        lag = row.get("Seconds_Behind_Source", row.get(
+            "Seconds_Behind_Master"))
+        # NULL while the replication threads are not running
+        return float("inf") if lag is None else float(lag)
+    connection.execute(text("SELECT 1"))
+    return None
+
+
+class Replica(object):
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag = None
+        self.checked_at = None
+        self.error = None
+        self.check_lock = threading.Lock()
+
+    def active_connections(self):
+        pool = self.engine.pool
+        return pool.checkedout() if hasattr(pool, "checkedout") else 0
+
+    def status(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "active_connections": self.active_connections(),
+            "error": self.error,
+        }
+
+
+class ReplicaRouter(object):
+    """
+    Picks the engine the reads of a data source go to, among its healthy
+    replicas lagging behind the primary less than the limit asked for,
+    by round robin or by the least checked out connections. When none of
+    them qualify, the primary is used. Replicas of an unknown lag only
+    qualify when no limit is asked for.
+
+    The health and lag of a replica are checked on the first read and
+    again once health_check_interval seconds have passed, by the thread
+    of the read that finds them stale. A replica whose connection is
+    found to be broken is taken out until its next check.
+    """
+
+    def __init__(
+            self, primary_engine, replica_engines, balancing="round_robin",
+            health_check_interval=DEFAULT_REPLICA_HEALTH_CHECK_INTERVAL,
+            lag_query=None):
+        if balancing not in REPLICA_BALANCING_STRATEGIES:
+            raise ValueError(
+                "Unknown replica balancing {}".format(balancing))
+        self.primary_engine = primary_engine
+        self.replicas = [
+            Replica(name, engine) for name, engine in replica_engines]
+        self.balancing = balancing
+        self.health_check_interval = health_check_interval
+        self.lag_query = lag_query
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            event.listen(
+                replica.engine, "handle_error",
+                self.construct_disconnect_handler(replica))
+
+    def construct_disconnect_handler(self, replica):
+        def handle_error(exception_context):
+            if exception_context.is_disconnect:
+                self.mark_unhealthy(
+                    replica, exception_context.original_exception)
+        return handle_error
+
+    def mark_unhealthy(self, replica, error=None):
+        replica.healthy = False
+        replica.error = None if error is None else str(error)
+        replica.checked_at = time.monotonic()
+
+    def check_health(self, replica):
+        try:
+            with replica.engine.connect() as connection:
+                lag = fetch_replication_lag(
+                    connection, lag_query=self.lag_query)
+        except Exception as e:
+            logging.getLogger(__name__).warning(
+                "Replica %s failed its health check: %s", replica.name, e)
+            self.mark_unhealthy(replica, e)
+            replica.lag = None
+            return False
+        replica.healthy = True
+        replica.lag = lag
+        replica.error = None
+        replica.checked_at = time.monotonic()
+        return True
+
+    def is_stale(self, replica):
+        return replica.checked_at is None or \
+            time.monotonic() - replica.checked_at >= \
+            self.health_check_interval
+
+    def refresh_health(self):
+        for replica in self.replicas:
+            if not self.is_stale(replica):
+                continue
+            if replica.checked_at is None:
+                # Nothing is known of it yet, so the read waits for it
+                with replica.check_lock:
+                    if replica.checked_at is None:
+                        self.check_health(replica)
+            elif replica.check_lock.acquire(blocking=False):
+                try:
+                    self.check_health(replica)
+                finally:
+                    replica.check_lock.release()
+
+    def eligible_replicas(self, max_lag=None):
+        """
+        The healthy replicas lagging at most max_lag seconds behind. The
+        ones whose lag cannot be told, like with a dialect without a lag
+        query, are only eligible when there is no limit.
+        """
+        return [
+            replica for replica in self.replicas
+            if replica.healthy and (
+                max_lag is None or (
+                    replica.lag is not None and replica.lag <= max_lag))]
+
+    def choose_engine(self, max_lag=None):
+        if max_lag == 0 or not self.replicas:
+            return self.primary_engine
+        self.refresh_health()
+        replicas = self.eligible_replicas(max_lag=max_lag)
+        if not replicas:
+            return self.primary_engine
+        if self.balancing == "least_connections":
+            return min(
+                replicas, key=lambda replica: replica.active_connections()
+            ).engine
+        with self._lock:
+            position = next(self._counter)
+        return replicas[position % len(replicas)].engine
+
+    def status(self):
+        return [replica.status() for replica in self.replicas]
+
+
+class RoutingSession(Session):
+    """
+    A Session whose reads go to the engine its ReplicaRouter chooses at
+    the start of each transaction, and whose writes (flushes and insert,
+    update or delete statements) go to the primary. The choice is made
+    again once the transaction is committed, rolled back or the session
+    is closed.
+    """
+
+    def __init__(self, router=None, **kwargs):
+        super().__init__(**kwargs)
+        self.router = router
+        self.read_engine = None
+        event.listen(self, "after_transaction_end", self.release_read_engine)
+
+    def release_read_engine(self, session, transaction):
+        if transaction.parent is None:
+            self.read_engine = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.router is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if self._flushing or isinstance(clause, UpdateBase):
+            return self.router.primary_engine
+        if self.read_engine is None:
+            self.read_engine = self.router.choose_engine(
+                max_lag=current_replication_lag_limit())
+        return self.read_engine
+
+
+def begin_routed_transaction(session):
+    """
+    Begins the transaction of a RoutingSession on the engine chosen for
+    the current replication_lag_limit, so that the reads it makes after
+    the limit is exited stay on that engine until the transaction ends.
+    Other sessions are left alone, so that they only check out a
+    connection when they need one.
+    """
+    if isinstance(session, RoutingSession) and session.router is not None:
+        session.connection()
@@ -0,0 +1,318 @@
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import (
+    MetaData, Table, Column, Index, String, DateTime, Date, Integer, select,
+    func, inspect, and_)
+
+from .datetime_utils import (
+    TIME_GRAIN_FORMATS, time_bucket_start, time_bucket_label,
+    time_bucket_expression, next_month_start)
+
+
+ROLLUP_WATERMARKS_TABLE_NAME = "dboard_rollup_watermarks"
+
+# The surrogate key of the rows of the rollup tables. The dimensions can
+# be NULL, so they cannot be part of a primary key
+ROLLUP_ROW_ID_COLUMN_NAME = "dboard_rollup_row_id"
+
+# How the bucket values of each aggregate are combined into coarser
+# buckets and across the rows of the rollup table
+ROLLUP_AGGREGATES = {
+    "sum": (func.sum, func.sum),
+    "count": (func.count, func.sum),
+    "min": (func.min, func.min),
+    "max": (func.max, func.max),
+}
+
+
+def convert_to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(value)
+
+
+class Rollup(object):
+    """
+    Keeps the measures of source_table pre-aggregated into a table with a
+    row per time bucket of the grain ("day" or "month") and combination
+    of the dimensions, so that the dashboards grouping by month_format
+    or date_format read a few bucket rows instead of the whole history.
+
+    measures = {
+        "revenue": ("sum", "amount"),
+        "orders": ("count", "id"),
+        "largest_order": ("max", "amount"),
+    }
+
+    maps the label of each measure to one of the ROLLUP_AGGREGATES and
+    the source column it aggregates. The buckets are labelled like
+    month_format and date_format do, after shifting time_column by
+    timedelta_mins (see tz_converted_date).
+
+    refresh re-aggregates only the months from the one of the watermark
+    onwards. The watermark is the latest time_column seen, or, with an
+    updated_at_column, the latest update seen, in which case the months
+    of the rows updated since are re-aggregated. Rows deleted from the
+    earlier months are only dropped from the rollup by refresh(full=True).
+    """
+
+    def __init__(
+            self, name, source_table, time_column, measures, grain="day",
+            dimensions=None, timedelta_mins=0, updated_at_column=None,
+            bucket_label=None, time_range_params=("start", "end"),
+            max_staleness=None, engine=None, metadata=None):
+        if grain not in TIME_GRAIN_FORMATS:
+            raise ValueError("Unknown grain {}".format(grain))
+        for label, (aggregate, _) in measures.items():
+            if aggregate not in ROLLUP_AGGREGATES:
+                raise ValueError(
+                    "Unknown aggregate {} of {}".format(aggregate, label))
+        self.name = name
+        self.source_table = getattr(source_table, "__table__", source_table)
+        self.time_column = time_column
+        self.measures = measures
+        self.grain = grain
+        self.dimensions = list(dimensions or [])
+        self.timedelta_mins = timedelta_mins
+        self.updated_at_column = updated_at_column
+        self.bucket_label = bucket_label or grain
+        self.time_range_params = time_range_params
+        self.max_staleness = max_staleness
+        self.engine = engine
+        self.metadata = metadata if metadata is not None else MetaData()
+        self.table = self.construct_table()
+        self.watermarks_table = self.construct_watermarks_table()
+        self.watermark = None
+        self.refreshed_at = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def construct_table(self):
+        table_name = "dboard_rollup_{}".format(self.name)
+        columns = [
+            Column(ROLLUP_ROW_ID_COLUMN_NAME, Integer, primary_key=True),
+            Column("bucket", String(10), nullable=False)]
+        for dimension in self.dimensions:
+            columns.append(Column(
+                dimension, self.source_table.c[dimension].type))
+        for label, (aggregate, column_name) in self.measures.items():
+            columns.append(Column(
+                label, Integer if aggregate == "count"
+                else self.source_table.c[column_name].type))
+        return Table(
+            table_name, self.metadata, *columns,
+            Index("ix_{}_bucket".format(table_name), "bucket",
+                  *self.dimensions))
+
+    @property
+    def aggregate_column_names(self):
+        """The columns of the table filled by construct_aggregate_select"""
+        return [c.name for c in self.table.columns
+                if c.name != ROLLUP_ROW_ID_COLUMN_NAME]
+
+    def construct_watermarks_table(self):
+        # Shared by the rollups of a metadata
+        if ROLLUP_WATERMARKS_TABLE_NAME in self.metadata.tables:
+            return self.metadata.tables[ROLLUP_WATERMARKS_TABLE_NAME]
+        return Table(
+            ROLLUP_WATERMARKS_TABLE_NAME, self.metadata,
+            Column("rollup_name", String(255), primary_key=True),
+            Column("watermark", DateTime),
+            Column("refreshed_at", DateTime))
+
+    def to_local_time(self, source_dt):
+        return source_dt + timedelta(minutes=self.timedelta_mins)
+
+    def to_source_bound(self, local_dt):
+        bound = local_dt - timedelta(minutes=self.timedelta_mins)
+        time_type = self.source_table.c[self.time_column].type
+        if isinstance(time_type, Date) and not isinstance(
+                time_type, DateTime):
+            return bound.date()
+        return bound
+
+    def construct_aggregate_select(self, dialect_name, start, end):
+        source = self.source_table
+        time_col = source.c[self.time_column]
+        bucket = time_bucket_expression(
+            time_col, self.grain, dialect_name, self.timedelta_mins)
+        dimension_cols = [source.c[d] for d in self.dimensions]
+        measure_cols = [
+            ROLLUP_AGGREGATES[aggregate][0](source.c[column_name])
+            for aggregate, column_name in self.measures.values()]
+        return select(bucket, *dimension_cols, *measure_cols).where(
+            and_(time_col >= self.to_source_bound(start),
+                 time_col < self.to_source_bound(end))
+        ).group_by(bucket, *dimension_cols)
+
+    def create(self, connection):
+        self.metadata.create_all(
+            connection, tables=[self.table, self.watermarks_table])
+
+    def fetch_watermark(self, connection):
+        return connection.execute(
+            select(self.watermarks_table.c.watermark).where(
+                self.watermarks_table.c.rollup_name == self.name)
+        ).scalar()
+
+    def store_watermark(self, connection, watermark):
+        watermarks = self.watermarks_table
+        connection.execute(watermarks.delete().where(
+            watermarks.c.rollup_name == self.name))
+        connection.execute(watermarks.insert().values(
+            rollup_name=self.name, watermark=watermark,
+            refreshed_at=datetime.utcnow()))
+
+    def find_refresh_start(self, connection, watermark):
+        """
+        The earliest time_column to re-aggregate from, or None when
+        nothing changed since the watermark.
+        """
+        source = self.source_table
+        time_col = source.c[self.time_column]
+        if watermark is None:
+            return connection.execute(select(func.min(time_col))).scalar()
+        if self.updated_at_column is None:
+            return watermark
+        # Rows updated at the watermark itself may not have been seen
+        return connection.execute(select(func.min(time_col)).where(
+            source.c[self.updated_at_column] >= watermark)).scalar()
+
+    def refresh(self, engine=None, full=False):
+        """
+        Re-aggregates the months that changed since the watermark, one
+        month per statement, and returns the number of months refreshed.
+        """
+        engine = engine or self.engine
+        with self._lock, engine.begin() as connection:
+            self.create(connection)
+            source = self.source_table
+            watermark = None if full else self.fetch_watermark(connection)
+            new_watermark = connection.execute(select(func.max(
+                source.c[self.updated_at_column or self.time_column])
+            )).scalar()
+            latest = connection.execute(
+                select(func.max(source.c[self.time_column]))).scalar()
+            start = convert_to_datetime(
+                self.find_refresh_start(connection, watermark))
+            months = 0
+            if full:
+                connection.execute(self.table.delete())
+            if start is not None and latest is not None:
+                month_start = time_bucket_start(
+                    self.to_local_time(start), "month")
+                connection.execute(self.table.delete().where(
+                    self.table.c.bucket >= time_bucket_label(
+                        month_start, self.grain)))
+                last_local = self.to_local_time(convert_to_datetime(latest))
+                while month_start <= last_local:
+                    month_end = next_month_start(month_start)
+                    connection.execute(
+                        self.table.insert().from_select(
+                            self.aggregate_column_names,
+                            self.construct_aggregate_select(
+                                connection.dialect.name, month_start,
+                                month_end)))
+                    month_start = month_end
+                    months += 1
+            if new_watermark is not None:
+                watermark = convert_to_datetime(new_watermark)
+            self.store_watermark(connection, watermark)
+            self.watermark = watermark
+            self.refreshed_at = time.monotonic()
+            self._loaded = True
+        return months
+
+    def is_built(self, engine=None):
+        """
+        Whether the rollup has been refreshed at least once. Checked in
+        the database the first time only.
+        """
+        if self._loaded:
+            return self.watermark is not None
+        engine = engine or self.engine
+        with engine.connect() as connection:
+            if inspect(connection).has_table(self.table.name) and \
+                    inspect(connection).has_table(
+                        self.watermarks_table.name):
+                self.watermark = self.fetch_watermark(connection)
+        self._loaded = True
+        return self.watermark is not None
+
+    def refresh_if_stale(self, engine=None):
+        if self.max_staleness is None:
+            return False
+        if self.refreshed_at is not None and \
+                time.monotonic() - self.refreshed_at < self.max_staleness:
+            return False
+        self.refresh(engine)
+        return True
+
+    def parse_filter_params(self, filter_params):
+        if isinstance(filter_params, str):
+            filter_params = json.loads(filter_params)
+        return {k: v for k, v in (filter_params or {}).items()
+                if v is not None}
+
+    def is_bucket_boundary(self, value, grain):
+        try:
+            dt = convert_to_datetime(value)
+        except (TypeError, ValueError):
+            return False
+        return dt == time_bucket_start(dt, grain)
+
+    def can_answer(self, filter_params, grain=None):
+        """
+        Whether the rollup holds the answer for the filter params. It
+        does when they only filter on the dimensions and on a time range
+        aligned to the buckets, given in the time_range_params.
+        """
+        grain = grain or self.grain
+        for key, value in self.parse_filter_params(filter_params).items():
+            if key in self.time_range_params:
+                if not self.is_bucket_boundary(value, grain):
+                    return False
+            elif key not in self.dimensions:
+                return False
+        return True
+
+    def query(self, session, filter_params=None, grain=None):
+        """
+        Queries the rollup table for the measures per bucket (labelled
+        bucket_label) and dimensions. grain can be coarser than the one
+        of the rollup. The time range in the filter params is taken in
+        the shifted time of the buckets, with an exclusive end.
+        """
+        grain = grain or self.grain
+        if grain == "day" and self.grain == "month":
+            raise ValueError(
+                "A monthly rollup cannot be queried for days")
+        table = self.table
+        bucket = table.c.bucket
+        if grain != self.grain:
+            bucket = func.substr(bucket, 1, len(
+                time_bucket_label(datetime(2000, 1, 1), grain)))
+        dimension_cols = [table.c[d] for d in self.dimensions]
+        q = session.query(
+            bucket.label(self.bucket_label), *dimension_cols, *[
+                ROLLUP_AGGREGATES[aggregate][1](table.c[label]).label(label)
+                for label, (aggregate, _) in self.measures.items()]
+        ).group_by(bucket, *dimension_cols).order_by(bucket)
+        start_param, end_param = self.time_range_params
+        for key, value in self.parse_filter_params(filter_params).items():
+            if key == start_param:
+                q = q.filter(table.c.bucket >= time_bucket_label(
+                    convert_to_datetime(value), self.grain))
+            elif key == end_param:
+                q = q.filter(table.c.bucket < time_bucket_label(
+                    convert_to_datetime(value), self.grain))
+            elif isinstance(value, (list, tuple)):
+                q = q.filter(table.c[key].in_(value))
+            else:
+                q = q.filter(table.c[key] == value)
+        return q
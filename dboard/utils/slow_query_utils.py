@@ -0,0 +1,225 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+
+DEFAULT_SLOW_QUERY_THRESHOLD = 1.0
+DEFAULT_SLOW_QUERY_LOG_SIZE = 100
+
+# The prefix turning a statement into a request for its plan, on the
+# dialects whose plan comes back as rows.
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN",
+    "mysql": "EXPLAIN",
+    "sqlite": "EXPLAIN QUERY PLAN",
+}
+
+# The dialects on which a failed statement aborts the transaction it
+# runs in, so that the EXPLAINs run in the transaction of the caller are
+# wrapped in a savepoint
+EXPLAIN_SAVEPOINT_DIALECTS = ["postgresql"]
+
+EXPLAIN_SAVEPOINT_NAME = "dboard_explain"
+
+_STARTED_AT_KEY = "dboard_statement_started_at"
+
+_current_query_source = contextvars.ContextVar(
+    "dboard_query_source", default=None)
+
+
+@contextmanager
+def query_source(endpoint=None, filter_params=None):
+    """
+    Names the endpoint and filter params the statements run inside it
+    are recorded under by a SlowQueryLog. Without it they are recorded
+    under the endpoint and filter_params arg of the current request.
+    """
+    token = _current_query_source.set((endpoint, filter_params))
+    try:
+        yield
+    finally:
+        _current_query_source.reset(token)
+
+
+def current_query_source():
+    endpoint, filter_params = _current_query_source.get() or (None, None)
+    if has_request_context():
+        if endpoint is None:
+            endpoint = request.endpoint or request.path
+        if filter_params is None:
+            filter_params = request.args.get("filter_params")
+    return endpoint, filter_params
+
+
+def make_json_safe(value):
+    if isinstance(value, dict):
+        return {str(k): make_json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [make_json_safe(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def explain_raw_statement(
+        connection, statement, parameters, explain_prefix, savepoint=None):
+    """
+    Runs an already compiled statement prefixed with explain_prefix on a
+    new cursor of the raw DBAPI connection, so that no engine events are
+    fired for it. With savepoint, by default on the
+    EXPLAIN_SAVEPOINT_DIALECTS, it runs in a savepoint which is rolled
+    back to when it fails, leaving the transaction of the connection
+    usable.
+    """
+    if savepoint is None:
+        savepoint = connection.dialect.name in EXPLAIN_SAVEPOINT_DIALECTS \
+            and connection.in_transaction()
+    cursor = connection.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT {}".format(EXPLAIN_SAVEPOINT_NAME))
+        try:
+            cursor.execute(
+                "{} {}".format(explain_prefix, statement), parameters)
+            plan = cursor.fetchall()
+        except Exception:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT {}".format(
+                    EXPLAIN_SAVEPOINT_NAME))
+            raise
+        if savepoint:
+            cursor.execute(
+                "RELEASE SAVEPOINT {}".format(EXPLAIN_SAVEPOINT_NAME))
+        return plan
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog(object):
+    """
+    Records the statements run on the engines it is attached to which
+    take longer than a threshold, in seconds, along with the endpoint and
+    filter params they were run for (see query_source), their bound
+    parameters and, where the dialect has one, their EXPLAIN plan. The
+    latest max_entries are kept.
+
+    The duration is that of executing the statement, which for a
+    streamed result does not include fetching its rows. Statements that
+    fail after the threshold, like the ones cancelled by a
+    StatementTimeout, are recorded with their error and without a plan.
+    """
+
+    def __init__(
+            self, threshold=DEFAULT_SLOW_QUERY_THRESHOLD,
+            max_entries=DEFAULT_SLOW_QUERY_LOG_SIZE, explain=True):
+        self.threshold = threshold
+        self.explain = explain
+        self.entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def attach(self, engine, db_name=None, threshold=None):
+        """
+        Starts recording the slow statements of a (sync) engine. For an
+        AsyncEngine, attach its sync_engine. threshold overrides the one
+        of the log for this engine.
+        """
+        if threshold is None:
+            threshold = self.threshold
+
+        def before_cursor_execute(
+                conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault(_STARTED_AT_KEY, []).append(
+                time.perf_counter())
+
+        def after_cursor_execute(
+                conn, cursor, statement, parameters, context, executemany):
+            started_at = self._pop_started_at(conn)
+            if started_at is None:
+                return
+            duration = time.perf_counter() - started_at
+            if duration >= threshold:
+                self.record(
+                    conn, db_name, statement, parameters, duration,
+                    explain=self.explain and not executemany and not (
+                        conn.dialect.name == "mysql" and context is not None
+                        and context.execution_options.get("stream_results")))
+
+        def handle_error(exception_context):
+            conn = exception_context.connection
+            if conn is None:
+                return
+            started_at = self._pop_started_at(conn)
+            if started_at is None:
+                return
+            duration = time.perf_counter() - started_at
+            if duration >= threshold:
+                self.record(
+                    conn, db_name, exception_context.statement,
+                    exception_context.parameters, duration, explain=False,
+                    error=str(exception_context.original_exception))
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", handle_error)
+        return engine
+
+    def _pop_started_at(self, conn):
+        started_at = conn.info.get(_STARTED_AT_KEY)
+        if not started_at:
+            return None
+        return started_at.pop()
+
+    def record(
+            self, conn, db_name, statement, parameters, duration,
+            explain=True, error=None):
+        endpoint, filter_params = current_query_source()
+        entry = {
+            "recorded_at": datetime.now().isoformat(),
+            "db_name": db_name,
+            "endpoint": endpoint,
+            "filter_params": make_json_safe(filter_params),
+            "duration": duration,
+            "statement": statement,
+            "parameters": make_json_safe(parameters),
+            "plan": None,
+            "plan_error": None,
+            "error": error,
+        }
+        explain_prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        # A failed statement may not even parse, and is not explained
+        if explain and error is None and explain_prefix is not None:
+            try:
+                entry["plan"] = make_json_safe(explain_raw_statement(
+                    conn, statement, parameters, explain_prefix))
+            except Exception as e:
+                logging.getLogger(__name__).debug(
+                    "Could not explain a slow statement", exc_info=True)
+                entry["plan_error"] = str(e)
+        with self._lock:
+            self.entries.append(entry)
+        return entry
+
+    def get_entries(self, endpoint=None, db_name=None, limit=None):
+        """
+        The recorded entries, the latest first.
+        """
+        with self._lock:
+            entries = list(reversed(self.entries))
+        if endpoint is not None:
+            entries = [e for e in entries if e["endpoint"] == endpoint]
+        if db_name is not None:
+            entries = [e for e in entries if e["db_name"] == db_name]
+        if limit is not None:
+            entries = entries[:limit]
+        return entries
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,171 @@
+import logging
+import threading
+import weakref
+
+from sqlalchemy import text
+
+# Seconds the watchdog waits past the timeout before cancelling a
+# statement, on the databases which enforce the timeout themselves.
+DEFAULT_WATCHDOG_GRACE = 1.0
+
+POSTGRES_QUERY_CANCELED = "57014"
+
+# ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT and mariadb's
+# ER_STATEMENT_TIMEOUT
+MYSQL_QUERY_TIMEOUT_ERRNOS = (1317, 3024, 1969)
+
+# Engine to the pool of the connections killing its statements
+_kill_pools = weakref.WeakKeyDictionary()
+_kill_pools_lock = threading.Lock()
+
+
+def get_dbapi_connection(connection):
+    fairy = connection.connection
+    return getattr(fairy, "dbapi_connection", None) or fairy.connection
+
+
+def get_kill_pool(engine):
+    """
+    A pool of its own for the connections that kill the statements run
+    on the engine, opening them like the pool of the engine does. The
+    statements to kill may well be holding every connection of that
+    pool, and the kill would then wait on them.
+    """
+    with _kill_pools_lock:
+        pool = _kill_pools.get(engine)
+        if pool is None:
+            pool = _kill_pools[engine] = engine.pool.recreate()
+        return pool
+
+
+def cancel_running_statement(connection, mysql_connection_id=None):
+    """
+    Cancels the statement running on the connection from another
+    thread. Returns False when the driver has no way to do it.
+    """
+    dialect = connection.dialect
+    if dialect.name == "sqlite":
+        get_dbapi_connection(connection).interrupt()
+        return True
+    if dialect.name == "mysql":
+        if mysql_connection_id is None:
+            return False
+        killer = get_kill_pool(connection.engine).connect()
+        try:
+            killer.cursor().execute(
+                "KILL QUERY {}".format(int(mysql_connection_id)))
+        finally:
+            killer.close()
+        return True
+    dbapi_connection = get_dbapi_connection(connection)
+    if hasattr(dbapi_connection, "cancel"):
+        # psycopg2 and psycopg
+        dbapi_connection.cancel()
+        return True
+    return False
+
+
+class StatementTimeout(object):
+    """
+    Limits the time the statements run on a session can take. Postgres
+    and mysql are asked to enforce the limit themselves. On top of that a
+    watchdog thread cancels the running statement once the limit has
+    passed - right away on the other databases, and watchdog_grace
+    seconds later on the ones enforcing it.
+
+    start checks out the connection of the session, so it has to be
+    called before the statements to limit. stop lifts the limit and has
+    to be called before the session is closed.
+    """
+
+    def __init__(
+            self, session, timeout, watchdog_grace=DEFAULT_WATCHDOG_GRACE):
+        self.session = session
+        self.timeout = timeout
+        self.watchdog_grace = watchdog_grace
+        self.connection = None
+        self.mysql_connection_id = None
+        self.reset_statement = None
+        self.reset_params = None
+        self.timer = None
+        self.fired = False
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def start(self, watchdog=True):
+        self.connection = self.session.connection()
+        enforced = self.set_database_timeout()
+        if watchdog:
+            self.timer = threading.Timer(
+                self.timeout + (self.watchdog_grace if enforced else 0),
+                self.cancel)
+            self.timer.daemon = True
+            self.timer.start()
+        return self
+
+    def set_database_timeout(self):
+        dialect = self.connection.dialect
+        if dialect.name == "postgresql":
+            self.reset_statement = (
+                "SELECT set_config('statement_timeout', :timeout, true)")
+            self.reset_params = {"timeout": self.connection.execute(text(
+                "SELECT current_setting('statement_timeout')")).scalar()}
+            self.connection.execute(
+                text(self.reset_statement),
+                {"timeout": "{}ms".format(int(self.timeout * 1000))})
+            return True
+        if dialect.name == "mysql":
+            self.mysql_connection_id = self.connection.execute(
+                text("SELECT CONNECTION_ID()")).scalar()
+            if getattr(dialect, "is_mariadb", False):
+                self.connection.execute(text(
+                    "SET SESSION max_statement_time = {}".format(
+                        float(self.timeout))))
+                self.reset_statement = (
+                    "SET SESSION max_statement_time = DEFAULT")
+            else:
+                self.connection.execute(text(
+                    "SET SESSION max_execution_time = {}".format(
+                        int(self.timeout * 1000))))
+                self.reset_statement = (
+                    "SET SESSION max_execution_time = DEFAULT")
+            return True
+        return False
+
+    def cancel(self):
+        with self._lock:
+            if self.stopped:
+                return
+            self.fired = True
+            try:
+                cancel_running_statement(
+                    self.connection,
+                    mysql_connection_id=self.mysql_connection_id)
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Could not cancel the running statement")
+
+    def stop(self):
+        with self._lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.reset_statement is not None:
+            try:
+                self.connection.execute(
+                    text(self.reset_statement), self.reset_params or {})
+            except Exception:
+                # The transaction is rolled back right after a failed
+                # statement, which lifts a postgres limit anyway.
+                pass
+
+    def is_timeout_error(self, error):
+        if self.fired:
+            return True
+        orig = getattr(error, "orig", None)
+        if getattr(orig, "pgcode", None) == POSTGRES_QUERY_CANCELED:
+            return True
+        args = getattr(orig, "args", None) or ()
+        return bool(args) and args[0] in MYSQL_QUERY_TIMEOUT_ERRNOS
@@ -0,0 +1,181 @@
+import time
+
+from .cache_utils import ResultCache, construct_result_cache, get_cache_key
+
+
+def normalize_cache_key_part(part):
+    """
+    Makes filter params that differ only in the order of their keys give
+    the same cache key.
+    """
+    if isinstance(part, dict):
+        return tuple(sorted(
+            (k, normalize_cache_key_part(v)) for k, v in part.items()))
+    if isinstance(part, (list, tuple)):
+        return tuple(normalize_cache_key_part(v) for v in part)
+    return part
+
+
+class TimeSeriesCache(object):
+    """
+    Caches the closed periods of DataFrames indexed by a DatetimeIndex,
+    so that only the recent ones have to be queried again. A period is
+    closed once it is more than lookback periods (of freq, a pandas
+    period alias like "D" or "M") older than the current one.
+
+    get_df is handed fetch_df(start), which has to return the rows from
+    start onwards, or the whole history when start is None. The rows of
+    the open periods are fetched on every call and spliced after the
+    cached closed ones.
+
+    When historical data is corrected, invalidate drops the cached rows
+    from a point in time onwards, for one set of filter params or all of
+    them. The invalidation is kept in the cache backend, so a shared
+    backend like FileSystemCacheBackend passes it on to all the workers.
+    """
+
+    def __init__(
+            self, result_cache=None, freq="D", lookback=1, ttl=None,
+            tz=None, name="timeseries"):
+        self.result_cache = construct_result_cache(result_cache) or \
+            ResultCache()
+        self.freq = freq
+        self.lookback = lookback
+        self.ttl = ttl
+        # The time zone the periods are counted in
+        self.tz = tz
+        self.name = name
+
+    def get_entry_key(self, key_parts):
+        return get_cache_key(
+            self.name, normalize_cache_key_part(tuple(key_parts)))
+
+    def get_invalidations_key(self):
+        return get_cache_key(self.name, "invalidations")
+
+    def get_refresh_start(self, now=None):
+        """
+        The start of the earliest period that is not closed yet.
+        """
+        import pandas as pd
+        now = pd.Timestamp.now(tz=self.tz) if now is None else \
+            pd.Timestamp(now)
+        period = now.tz_localize(None).to_period(self.freq) - self.lookback
+        refresh_start = period.start_time
+        if now.tz is not None:
+            refresh_start = refresh_start.tz_localize(now.tz)
+        return refresh_start
+
+    def fetch_invalidations(self):
+        return self.result_cache.backend.get(
+            self.get_invalidations_key()) or []
+
+    def invalidate(self, key_parts=None, since=None):
+        """
+        Drops the cached rows from since onwards, or all of them when
+        since is None, for the key_parts or for every key.
+        """
+        import pandas as pd
+        since = None if since is None else pd.Timestamp(since)
+        if key_parts is not None:
+            entry_key = self.get_entry_key(key_parts)
+            entry = self.result_cache.backend.get(entry_key)
+            if entry is None:
+                return
+            if since is None:
+                self.result_cache.delete(entry_key)
+                return
+            self.result_cache.set(
+                entry_key, self.truncate_entry(entry, since), ttl=self.ttl)
+            return
+        now = time.time()
+        ttl = self.ttl or getattr(self.result_cache.backend, "ttl", None)
+        # The entries cached before the older invalidations have expired
+        invalidations = [
+            (invalidated_at, invalidated_since)
+            for invalidated_at, invalidated_since
+            in self.fetch_invalidations()
+            if ttl is None or invalidated_at > now - ttl] + [(now, since)]
+        self.result_cache.backend.set(
+            self.get_invalidations_key(), invalidations, ttl=self.ttl)
+
+    def truncate_entry(self, entry, since):
+        closed_df = entry["closed_df"]
+        if since is None:
+            return dict(entry, closed_df=closed_df.iloc[:0],
+                        closed_until=None)
+        since = self.align_timestamp(since, closed_df.index)
+        if entry["closed_until"] is not None and \
+                since >= entry["closed_until"]:
+            return entry
+        return dict(
+            entry, closed_df=closed_df[closed_df.index < since],
+            closed_until=since)
+
+    def align_timestamp(self, ts, index):
+        import pandas as pd
+        ts = pd.Timestamp(ts)
+        tz = getattr(index, "tz", None)
+        if tz is not None and ts.tz is None:
+            return ts.tz_localize(tz)
+        if tz is None and ts.tz is not None:
+            return ts.tz_convert(None)
+        return ts
+
+    def lookup(self, key_parts, version=None):
+        """
+        The cached entry of the key_parts, after applying the
+        invalidations made since it was cached, or None.
+        """
+        entry = self.result_cache.get(self.get_entry_key(key_parts))
+        if entry is None or entry["version"] != version:
+            return None
+        for invalidated_at, since in self.fetch_invalidations():
+            if invalidated_at >= entry["cached_at"]:
+                entry = self.truncate_entry(entry, since)
+        if entry["closed_until"] is None:
+            return None
+        return entry
+
+    def splice(self, key_parts, entry, fresh_df, refresh_start,
+               version=None):
+        import pandas as pd
+        if entry is None or entry["closed_df"].empty:
+            df = fresh_df
+        elif fresh_df.empty:
+            df = entry["closed_df"]
+        else:
+            df = pd.concat([entry["closed_df"], fresh_df])
+        refresh_start = self.align_timestamp(refresh_start, df.index)
+        self.result_cache.set(
+            self.get_entry_key(key_parts), {
+                "closed_df": df[df.index < refresh_start],
+                "closed_until": refresh_start,
+                "cached_at": time.time(),
+                "version": version,
+            }, ttl=self.ttl)
+        return df
+
+    def get_df(self, key_parts, fetch_df, now=None, version=None):
+        """
+        The frame of the key_parts, fetching only the rows after the
+        cached closed periods with fetch_df. A change of version, like
+        the max updated_at of the history, discards the cached rows.
+        """
+        refresh_start = self.get_refresh_start(now)
+        entry = self.lookup(key_parts, version=version)
+        fresh_df = fetch_df(None if entry is None else entry["closed_until"])
+        return self.splice(
+            key_parts, entry, fresh_df, refresh_start, version=version)
+
+    async def async_get_df(
+            self, key_parts, fetch_df, now=None, version=None):
+        """
+        Same as get_df, for a fetch_df that is a coroutine function.
+        """
+        refresh_start = self.get_refresh_start(now)
+        entry = self.lookup(key_parts, version=version)
+        fresh_df = await fetch_df(
+            None if entry is None else entry["closed_until"])
+        return self.splice(
+            key_parts, entry, fresh_df, refresh_start, version=version)
@@ -0,0 +1,211 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Upper bounds, in seconds, of the buckets of the stage histograms
+DEFAULT_DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_stage_timings = contextvars.ContextVar(
+    "dboard_stage_timings", default=None)
+
+
+class StageTimings(object):
+    """
+    The time spent in each stage of rendering a response, along with
+    counts like the number of rows and bytes sent.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.durations = OrderedDict()
+        self.counts = OrderedDict()
+
+    def add_duration(self, stage, duration):
+        self.durations[stage] = self.durations.get(stage, 0.0) + duration
+
+    def set_count(self, name, value):
+        self.counts[name] = value
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def server_timing_header(self):
+        """
+        The value of a Server-Timing header, with the durations in
+        milliseconds and the counts as descriptions.
+        """
+        return ", ".join(
+            ["{};dur={:.3f}".format(stage, duration * 1000)
+             for stage, duration in self.durations.items()] +
+            ['{};desc="{}"'.format(name, value)
+             for name, value in self.counts.items()])
+
+
+def current_stage_timings():
+    return _current_stage_timings.get()
+
+
+@contextmanager
+def collect_stage_timings():
+    """
+    Makes the timed_stage blocks run inside it record into one
+    StageTimings. A nested collect_stage_timings reuses the outer one.
+    """
+    timings = _current_stage_timings.get()
+    if timings is not None:
+        yield timings
+        return
+    timings = StageTimings()
+    token = _current_stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_stage_timings.reset(token)
+
+
+@contextmanager
+def use_stage_timings(timings):
+    """
+    Makes the timed_stage blocks run inside it record into timings, like
+    when the body of a streamed response is generated after the
+    collect_stage_timings of its request has ended.
+    """
+    token = _current_stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_stage_timings.reset(token)
+
+
+@contextmanager
+def timed_stage(stage):
+    timings = _current_stage_timings.get()
+    if timings is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_duration(stage, time.perf_counter() - started_at)
+
+
+def record_stage_count(name, value):
+    timings = _current_stage_timings.get()
+    if timings is not None:
+        timings.set_count(name, value)
+
+
+def add_to_stage_count(name, value):
+    timings = _current_stage_timings.get()
+    if timings is not None:
+        timings.set_count(name, timings.counts.get(name, 0) + value)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+def format_prometheus_labels(labels):
+    return ",".join(
+        '{}="{}"'.format(
+            name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels)
+
+
+class MetricsRegistry(object):
+    """
+    Aggregates the StageTimings of the responses into a histogram per
+    endpoint and stage, and totals of their counts per endpoint.
+    """
+
+    def __init__(self, buckets=DEFAULT_DURATION_BUCKETS):
+        self.buckets = buckets
+        self.histograms = OrderedDict()
+        self.count_totals = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, timings):
+        with self._lock:
+            for stage, duration in timings.durations.items():
+                key = (endpoint, stage)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.buckets)
+                self.histograms[key].observe(duration)
+            for name, value in timings.counts.items():
+                key = (endpoint, name)
+                self.count_totals[key] = self.count_totals.get(key, 0) + value
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.count_totals.clear()
+
+    def render_prometheus_text(self, result_caches=None):
+        """
+        result_caches maps the endpoints to their ResultCaches, whose hits
+        and misses are rendered as counters along with the stage timings.
+        """
+        lines = [
+            "# HELP dboard_stage_duration_seconds Time spent in each stage "
+            "of rendering a response",
+            "# TYPE dboard_stage_duration_seconds histogram"]
+        with self._lock:
+            for (endpoint, stage), histogram in self.histograms.items():
+                labels = [("endpoint", endpoint), ("stage", stage)]
+                for upper_bound, bucket_count in zip(
+                        histogram.buckets, histogram.bucket_counts):
+                    lines.append(
+                        "dboard_stage_duration_seconds_bucket{%s} %d" % (
+                            format_prometheus_labels(
+                                labels + [("le", repr(float(upper_bound)))]),
+                            bucket_count))
+                lines.append(
+                    "dboard_stage_duration_seconds_bucket{%s} %d" % (
+                        format_prometheus_labels(labels + [("le", "+Inf")]),
+                        histogram.count))
+                lines.append("dboard_stage_duration_seconds_sum{%s} %r" % (
+                    format_prometheus_labels(labels), histogram.total))
+                lines.append("dboard_stage_duration_seconds_count{%s} %d" % (
+                    format_prometheus_labels(labels), histogram.count))
+            names = sorted({name for _, name in self.count_totals})
+            for name in names:
+                metric = "dboard_response_{}_total".format(name)
+                lines.append("# TYPE {} counter".format(metric))
+                for (endpoint, count_name), total in \
+                        self.count_totals.items():
+                    if count_name == name:
+                        lines.append("%s{%s} %d" % (
+                            metric,
+                            format_prometheus_labels(
+                                [("endpoint", endpoint)]),
+                            total))
+        for name in ("hits", "misses"):
+            metric = "dboard_result_cache_{}_total".format(name)
+            lines.append("# TYPE {} counter".format(metric))
+            for endpoint, result_cache in sorted(
+                    (result_caches or {}).items()):
+                lines.append("%s{%s} %d" % (
+                    metric, format_prometheus_labels(
+                        [("endpoint", endpoint)]),
+                    result_cache.stats()[name]))
+        return "\n".join(lines) + "\n"
+
+
+DEFAULT_METRICS_REGISTRY = MetricsRegistry()
@@ -14,7 +14,7 @@ requirements = [
     'Click>=7.0',
     "toolspy>=0.3.1",
     "Flask>=1.0.2",
-    "SQLAlchemy>=1.3.1",
+    "SQLAlchemy>=1.4",
     "Flask-SQLAlchemy>=2.3.2",
     "flask_sqlalchemy_session",
     "Schemalite>=0.2.1",
@@ -24,6 +24,12 @@ requirements = [
     "marshmallow"
 ]
 
+extra_requirements = {
+    "arrow": ["pyarrow"],
+    "async": ["SQLAlchemy[asyncio]>=1.4", "Flask[async]>=2.0"],
+    "zstd": ["zstandard"],
+}
+
 setup_requirements = ['pytest-runner', ]
 
 test_requirements = ['pytest>=3', ]
@@ -31,17 +37,18 @@ test_requirements = ['pytest>=3', ]
 setup(
     author="Surya Sankar",
     author_email='suryashankar.m@gmail.com',
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     description="Tools to help create a data dashboard",
     entry_points={
@@ -50,6 +57,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
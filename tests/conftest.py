@@ -0,0 +1,41 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+
+from dboard.dboard_flask.data_sources import SqlaQueryBuilder
+
+from .models import populate_orders
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # A file, so that the connections of all the threads see the rows
+    engine = create_engine("sqlite:///{}".format(tmp_path / "orders.db"))
+    populate_orders(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def query_engine(engine):
+    query_engine = SqlaQueryBuilder(engine)
+    yield query_engine
+    query_engine.session.remove()
+
+
+@pytest.fixture
+def session(query_engine):
+    return query_engine.session()
+
+
+@pytest.fixture
+def db_dict(engine):
+    # construct_sqla_db_uri makes it sqlite://:@//<path of the database>
+    return {
+        "db_type": "sqlite", "db_user": "", "db_password": "",
+        "db_server": "", "db_name": engine.url.database}
@@ -0,0 +1,42 @@
+"""The sqlite backed models the tests query."""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Float, Integer, String
+from sqlalchemy.orm import declarative_base
+
+
+Base = declarative_base()
+
+
+class Order(Base):
+    __tablename__ = "orders"
+
+    id = Column(Integer, primary_key=True)
+    region = Column(String(20))
+    amount = Column(Float, nullable=False)
+    created_at = Column(DateTime)
+    # An attribute named differently from its column
+    customer_name = Column("customer", String(50), nullable=False)
+
+
+REGIONS = ["north", "south", "east", None]
+
+ORDERS_START = datetime(2021, 1, 1)
+
+
+def construct_orders(count):
+    return [
+        dict(id=i, region=REGIONS[i % len(REGIONS)], amount=i * 1.5,
+             created_at=ORDERS_START + timedelta(hours=13 * i),
+             customer="customer {}".format(i % 5))
+        for i in range(1, count + 1)]
+
+
+def populate_orders(engine, count=50):
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Order.__table__.delete())
+        if count:
+            connection.execute(
+                Order.__table__.insert(), construct_orders(count))
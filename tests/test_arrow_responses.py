@@ -0,0 +1,88 @@
+"""Tests for the arrow and parquet responses of queries."""
+
+import datetime
+import decimal
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy import Column, DateTime, Numeric, cast, literal_column
+
+from dboard.response_generators import construct_arrow_response_from_query
+from dboard.utils import generate_record_batches_from_result
+
+from .models import Order
+
+
+def read_table(app, q, response_format="arrow", batch_size=5):
+    with app.test_request_context("/orders"):
+        data = construct_arrow_response_from_query(
+            q, response_format=response_format,
+            batch_size=batch_size).get_data()
+    if response_format == "parquet":
+        return pq.read_table(io.BytesIO(data))
+    return pa.ipc.open_stream(data).read_all()
+
+
+@pytest.mark.parametrize("response_format", ["arrow", "parquet"])
+def test_null_first_batch_and_growing_decimals(
+        app, session, response_format):
+    # The regions of the first batches are all NULL, and the decimals
+    # get more digits in the later ones
+    q = session.query(
+        Order.id, Order.region,
+        cast(Order.amount * 1000 / 7, Numeric).label("share"),
+        literal_column("region").label("untyped")
+    ).order_by(Order.region, Order.id)
+    table = read_table(app, q, response_format)
+    assert table.num_rows == 50
+    assert table.schema.field("region").type == pa.string()
+    assert table.schema.field("share").type == pa.decimal128(38, 10)
+    assert table.schema.field("untyped").type == pa.string()
+    regions = table.column("region").to_pylist()
+    assert regions[:12] == [None] * 12
+    assert regions[12] == "east"
+    assert table.column("untyped").to_pylist() == regions
+    shares = dict(zip(
+        table.column("id").to_pylist(), table.column("share").to_pylist()))
+    assert shares[14] == decimal.Decimal(3000)
+    assert shares[1] == decimal.Decimal("214.2857142857")
+
+
+def test_empty_result_carries_the_schema(app, session):
+    q = session.query(Order.id, Order.created_at).filter(Order.id < 0)
+    table = read_table(app, q)
+    assert table.num_rows == 0
+    assert table.schema.names == ["id", "created_at"]
+    assert table.schema.field("created_at").type == pa.timestamp("us")
+
+
+class FakeResult(object):
+
+    def __init__(self, labels, rows):
+        self.labels = labels
+        self.rows = list(rows)
+
+    def keys(self):
+        return self.labels
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def test_tz_aware_timestamps_keep_their_time_zone():
+    ist = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+    moments = [
+        (datetime.datetime(2021, 1, 1, 5, 30, tzinfo=ist), ),
+        (None, ),
+        (datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc), )]
+    batches = list(generate_record_batches_from_result(
+        FakeResult(["at"], moments),
+        columns=[Column("at", DateTime(timezone=True))], batch_size=2))
+    table = pa.Table.from_batches(batches)
+    assert table.schema.field("at").type == pa.timestamp("us", tz="UTC")
+    assert table.column("at").to_pylist() == [
+        datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc), None,
+        datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)]
@@ -0,0 +1,137 @@
+"""Tests for the async views rendering query and DataFrame responses."""
+
+import json
+
+import pytest
+from flask import Flask
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+
+from dboard.dboard_flask.async_df_response_controller import (
+    AsyncDfResponseController)
+from dboard.dboard_flask.async_query_response_controller import (
+    AsyncQueryResponseController)
+from dboard.dboard_flask.data_sources import (
+    prepare_data_sources, sqla_db_info)
+from dboard.dboard_flask.engine_registry import EngineRegistry
+from dboard.response_generators import async_render_query_response
+
+from .models import Order
+
+
+def query_orders(session, query_engine, db_base, filter_params=None):
+    return session.query(Order.id, Order.amount).filter(
+        Order.id <= 20).order_by(Order.id)
+
+
+class OrdersController(AsyncQueryResponseController):
+
+    def get_datasource_name(self):
+        return "orders"
+
+    async def query(self, params=None):
+        # Awaits a statement of its own before building the query
+        await self.session.execute(select(Order.id).limit(1))
+        return query_orders(self.session, None, None)
+
+
+class QueryCanceled(Exception):
+    # What psycopg2 raises once the statement_timeout has passed
+    pgcode = "57014"
+
+
+class CancelledOrdersController(OrdersController):
+    statement_timeout = 0.2
+
+    def render_query(self, q):
+        raise OperationalError(
+            "SELECT id FROM orders", {}, QueryCanceled("canceling statement"))
+
+
+class OrdersDfController(AsyncDfResponseController):
+
+    async def get_df(self, start=None):
+        return await sqla_db_info("orders")["db_store"].async_sqltodf(
+            "SELECT id, amount FROM orders WHERE id <= 20 ORDER BY id")
+
+
+@pytest.fixture
+def async_app(db_dict):
+    app = Flask(__name__)
+    engine_registry = EngineRegistry()
+    app.config["DATA_SOURCES"] = {"orders": dict(
+        db_dict, async_db_type="sqlite+aiosqlite", automap_orm=True)}
+    prepare_data_sources(
+        app.config["DATA_SOURCES"], app, engine_registry=engine_registry)
+
+    @app.route("/orders")
+    async def orders():
+        return await async_render_query_response(
+            query_orders, app.config["DATA_SOURCES"]["orders"][
+                "async_query_builder"], None)
+
+    @app.route("/orders/controller")
+    async def orders_from_controller():
+        return await OrdersController().render_response()
+
+    @app.route("/orders/cancelled")
+    async def cancelled_orders():
+        return await CancelledOrdersController().render_response()
+
+    @app.route("/orders/df")
+    async def orders_df():
+        return await OrdersDfController().render_response()
+
+    yield app
+    engine_registry.dispose()
+    app.config["DATA_SOURCES"]["orders"]["async_engine"].sync_engine.dispose()
+
+
+def test_async_engines_do_not_pool_connections_by_default(engine):
+    engine_registry = EngineRegistry()
+    async_engine = engine_registry.create_async_engine(
+        "orders", "sqlite+aiosqlite:///{}".format(engine.url.database))
+    assert isinstance(async_engine.pool, NullPool)
+    async_engine.sync_engine.dispose()
+
+
+@pytest.mark.parametrize("url", [
+    "/orders", "/orders/controller", "/orders/df"])
+def test_views_serve_several_requests(async_app, url):
+    client = async_app.test_client()
+    # Each request runs on an event loop of its own
+    for page in (1, 2, 1):
+        response = client.get(url, query_string={
+            "page": page, "per_page": 7, "format": "json"})
+        assert response.status_code == 200
+        data = json.loads(response.get_data())["data"]
+        if url == "/orders/df":
+            assert len(data) == 20
+        else:
+            assert [row["id"] for row in data] == list(
+                range(7 * page - 6, 7 * page + 1))
+
+
+def get_server_timing_names(response):
+    return [
+        entry.split(";")[0].strip()
+        for entry in response.headers["Server-Timing"].split(",")]
+
+
+@pytest.mark.parametrize("url", ["/orders", "/orders/controller"])
+def test_stages_run_in_run_sync_are_timed(async_app, url):
+    # The rows are fetched and encoded in the greenlet of run_sync, which
+    # has to see the StageTimings of the request
+    response = async_app.test_client().get(
+        url, query_string={"page": 1, "per_page": 7})
+    names = get_server_timing_names(response)
+    for stage in ("query_constructor", "count", "fetch", "convert",
+                  "encode", "total", "rows", "bytes"):
+        assert stage in names
+    assert 'rows;desc="7"' in response.headers["Server-Timing"]
+
+
+def test_cancelled_statements_are_gateway_timeouts(async_app):
+    response = async_app.test_client().get("/orders/cancelled")
+    assert response.status_code == 504
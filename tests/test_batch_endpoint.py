@@ -0,0 +1,94 @@
+"""Tests for the batch endpoint of the registered query endpoints."""
+
+import json
+import threading
+
+import pytest
+from sqlalchemy import func
+
+from dboard import response_generators
+from dboard.response_generators import register_query_endpoints
+
+from .models import Order
+
+
+@pytest.fixture
+def batch_app(app, query_engine):
+    threads = []
+
+    def query_regions(session, query_engine, db_base, filter_params=None):
+        threads.append(threading.current_thread().name)
+        return session.query(
+            Order.region, func.count(Order.id).label("orders")
+        ).group_by(Order.region).order_by(Order.region)
+
+    def query_top_orders(session, query_engine, db_base, filter_params=None):
+        threads.append(threading.current_thread().name)
+        return session.query(Order.id, Order.amount).order_by(
+            Order.amount.desc())
+
+    def query_failing(session, query_engine, db_base, filter_params=None):
+        raise RuntimeError("Broken widget")
+
+    register_query_endpoints(app, {
+        "/regions": {
+            "query_constructor": query_regions, "query_engine": query_engine},
+        "/top-orders": {
+            "query_constructor": query_top_orders,
+            "query_engine": query_engine},
+        "/failing": {
+            "query_constructor": query_failing, "query_engine": query_engine},
+    }, batch_url="/batch", batch_max_workers=2)
+    app.batch_threads = threads
+    return app
+
+
+def fetch_json(client, url, **args):
+    response = client.get(url, query_string=args)
+    return response.status_code, json.loads(response.get_data())
+
+
+@pytest.mark.parametrize("stream", [0, 1])
+def test_batch_results_equal_the_single_responses(batch_app, stream):
+    client = batch_app.test_client()
+    status, payload = fetch_json(
+        client, "/batch", endpoints="regions,top_orders", page=1,
+        per_page=5, stream=stream)
+    assert status == 200
+    assert payload["status"] == "success"
+    assert sorted(payload["results"]) == ["regions", "top_orders"]
+    for name, url in [("regions", "/regions"), ("top_orders", "/top-orders")]:
+        assert payload["results"][name] == fetch_json(
+            client, url, page=1, per_page=5)[1]
+    assert len(payload["results"]["top_orders"]["data"]) == 5
+    assert [row["id"] for row in payload["results"]["top_orders"]["data"]] \
+        == [50, 49, 48, 47, 46]
+    assert all(
+        name.startswith("dboard-batch")
+        for name in batch_app.batch_threads[:2])
+
+
+def test_failing_and_unknown_widgets_do_not_fail_the_batch(batch_app):
+    client = batch_app.test_client()
+    status, payload = fetch_json(
+        client, "/batch", endpoints=["failing", "unknown", "regions"])
+    assert status == 200
+    assert list(payload["results"]) == ["failing", "unknown", "regions"]
+    assert payload["results"]["failing"]["error"]["code"] == 500
+    assert payload["results"]["unknown"]["error"]["code"] == 404
+    assert payload["results"]["regions"]["status"] == "success"
+    assert len(payload["results"]["regions"]["data"]) == 4
+
+
+def test_the_batch_threads_are_shut_down_at_exit(app, monkeypatch):
+    exit_hooks = []
+    monkeypatch.setattr(
+        response_generators.atexit, "register",
+        lambda func, **kwargs: exit_hooks.append((func, kwargs)))
+    register_query_endpoints(app, {}, batch_url="/batch")
+    (shutdown, kwargs), = exit_hooks
+    executor_service = shutdown.__self__
+    fetch_json(app.test_client(), "/batch", endpoints="unknown")
+    assert executor_service._thread_pool is not None
+    shutdown(**kwargs)
+    assert executor_service._thread_pool is None
@@ -0,0 +1,103 @@
+"""Tests for the content encoding negotiation of the responses."""
+
+import gzip
+import zlib
+
+import pytest
+
+from dboard.response_generators import register_query_endpoints
+from dboard.utils import get_available_content_encodings
+
+from .models import Order
+
+
+@pytest.fixture
+def compressed_app(app, query_engine):
+
+    def query_orders(session, query_engine, db_base, filter_params=None):
+        return session.query(
+            Order.id, Order.region, Order.amount).order_by(Order.id)
+
+    endpoint = {
+        "query_constructor": query_orders, "query_engine": query_engine,
+        "conditional": True, "compression": {"min_size": 512}}
+    register_query_endpoints(app, {
+        "/orders": endpoint,
+        "/cached-orders": dict(endpoint, result_cache={"ttl": 60}),
+    })
+    return app
+
+
+def decompress(response):
+    encoding = response.headers.get("Content-Encoding")
+    if encoding == "gzip":
+        return gzip.decompress(response.get_data())
+    if encoding == "deflate":
+        return zlib.decompress(response.get_data())
+    assert encoding is None
+    return response.get_data()
+
+
+@pytest.mark.parametrize("accept_encoding,encoding", [
+    ("gzip", "gzip"),
+    ("deflate, gzip;q=0.5", "deflate"),
+    ("gzip;q=0.5, deflate", "deflate"),
+    ("gzip;q=0, br", None),
+    ("identity", None),
+    (None, None),
+])
+@pytest.mark.parametrize("url", ["/orders", "/cached-orders"])
+@pytest.mark.parametrize("args", [{}, {"format": "csv"}, {"stream": 1}])
+def test_the_best_accepted_encoding_is_used(
+        compressed_app, url, args, accept_encoding, encoding):
+    client = compressed_app.test_client()
+    plain = client.get(url, query_string=args).get_data()
+    headers = {} if accept_encoding is None else {
+        "Accept-Encoding": accept_encoding}
+    # The second request of the cached endpoint is a cache hit
+    for _ in range(2):
+        response = client.get(url, query_string=args, headers=headers)
+        assert response.status_code == 200
+        assert response.headers.get("Content-Encoding") == encoding
+        assert "Accept-Encoding" in response.vary
+        assert decompress(response) == plain
+        if encoding is not None:
+            assert len(response.get_data()) < len(plain)
+
+
+def test_small_bodies_are_sent_as_they_are(compressed_app):
+    response = compressed_app.test_client().get(
+        "/orders", query_string={"page": 1, "per_page": 2},
+        headers={"Accept-Encoding": "gzip"})
+    assert len(response.get_data()) < 512
+    assert "Content-Encoding" not in response.headers
+
+
+def test_streamed_bodies_are_compressed_as_they_are_sent(compressed_app):
+    response = compressed_app.test_client().get(
+        "/orders", query_string={"stream": 1, "format": "csv"},
+        headers={"Accept-Encoding": "gzip"})
+    assert response.is_streamed
+    assert "Content-Length" not in response.headers
+    assert decompress(response).count(b"\r\n") == 50
+
+
+def test_compressed_responses_have_weak_etags(compressed_app):
+    client = compressed_app.test_client()
+    response = client.get("/orders", headers={"Accept-Encoding": "gzip"})
+    etag, weak = response.get_etag()
+    assert weak
+    response = client.get("/orders", headers={
+        "Accept-Encoding": "gzip",
+        "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_zstd_is_offered_only_when_installed():
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        assert get_available_content_encodings() == ["gzip", "deflate"]
+    else:
+        assert get_available_content_encodings() == [
+            "zstd", "gzip", "deflate"]
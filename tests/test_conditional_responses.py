@@ -0,0 +1,124 @@
+"""Tests for the ETags and 304s of the conditional responses."""
+
+import json
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import func, select
+
+from dboard.dboard_flask.df_response_controller import DfResponseController
+from dboard.response_generators import register_query_endpoints
+
+from .models import Order
+
+
+@pytest.fixture
+def conditional_app(app, query_engine):
+    constructed = []
+
+    def query_orders(session, query_engine, db_base, filter_params=None):
+        constructed.append(filter_params)
+        return session.query(Order.id, Order.amount).order_by(Order.id)
+
+    register_query_endpoints(app, {
+        "/orders": {
+            "query_constructor": query_orders, "query_engine": query_engine,
+            "conditional": True},
+        "/versioned-orders": {
+            "query_constructor": query_orders, "query_engine": query_engine,
+            "data_version": select(func.max(Order.created_at))},
+    })
+    app.constructed = constructed
+    return app
+
+
+@pytest.mark.parametrize("args", [{}, {"format": "csv"}])
+def test_matching_etags_get_a_304(conditional_app, args):
+    client = conditional_app.test_client()
+    response = client.get("/orders", query_string=args)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200 and response.get_data()
+
+    response = client.get(
+        "/orders", query_string=args, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.headers["ETag"] == etag
+
+    response = client.get(
+        "/orders", query_string=dict(args, page=2, per_page=5),
+        headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_streamed_responses_are_left_as_they_are(conditional_app):
+    response = conditional_app.test_client().get(
+        "/orders", query_string={"stream": 1})
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+
+
+def test_data_versions_skip_the_query(conditional_app, engine):
+    client = conditional_app.test_client()
+    response = client.get("/versioned-orders")
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+    assert response.last_modified.replace(tzinfo=None) == datetime(
+        2021, 1, 28, 2)
+    assert len(conditional_app.constructed) == 1
+
+    for headers in ({"If-None-Match": etag},
+                    {"If-Modified-Since": last_modified}):
+        response = client.get("/versioned-orders", headers=headers)
+        assert response.status_code == 304
+    assert len(conditional_app.constructed) == 1
+
+    # The ETag of a version depends on the args too
+    response = client.get(
+        "/versioned-orders", query_string={"format": "csv"},
+        headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+    with engine.begin() as connection:
+        connection.execute(Order.__table__.update().where(
+            Order.id == 1).values(created_at=datetime(2021, 3, 1)))
+    response = client.get(
+        "/versioned-orders", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(json.loads(response.get_data())["data"]) == 50
+
+
+class OrdersDfController(DfResponseController):
+    conditional = True
+    data_version = None
+
+    def get_data_version(self):
+        return self.data_version
+
+    def get_df(self, start=None):
+        self.fetched.append(start)
+        return self.orders_df
+
+
+@pytest.mark.parametrize("data_version", [None, datetime(2021, 1, 28)])
+def test_df_controllers_answer_matching_requests_with_a_304(
+        app, engine, data_version):
+    OrdersDfController.orders_df = pd.read_sql(
+        "SELECT id, amount FROM orders", engine)
+    OrdersDfController.data_version = data_version
+    OrdersDfController.fetched = []
+
+    def render(headers=None):
+        with app.test_request_context("/orders", headers=headers):
+            return OrdersDfController(params={}).render_response()
+
+    etag = render().headers["ETag"]
+    response = render({"If-None-Match": etag})
+    assert response.status_code == 304
+    # Without a data version the payload has to be built to be hashed
+    assert len(OrdersDfController.fetched) == (
+        2 if data_version is None else 1)
+    assert render({"If-None-Match": '"other"'}).status_code == 200
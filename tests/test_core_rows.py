@@ -0,0 +1,65 @@
+"""Tests that the rows read off the Core statements of queries (use_core)
+are keyed and ordered like the ORM ones."""
+
+import json
+
+import pytest
+
+from dboard.response_generators import (
+    construct_response_from_query, construct_csv_response_from_query)
+from dboard.utils import (
+    fetch_query_results_as_dicts, fetch_query_results_as_lists,
+    iterate_sqla_query_in_batches, get_queried_field_labels)
+
+from .models import Order
+
+
+@pytest.fixture(params=["entity", "columns"])
+def orders_query(request, session):
+    # customer_name is mapped to the customer column
+    if request.param == "entity":
+        return session.query(Order).order_by(Order.id)
+    return session.query(
+        Order.customer_name, Order.id, Order.amount).order_by(Order.id)
+
+
+def test_dicts_and_lists_match_the_orm_ones(orders_query):
+    assert "customer_name" in get_queried_field_labels(orders_query)
+    for fetch in (fetch_query_results_as_dicts, fetch_query_results_as_lists):
+        assert fetch(orders_query, use_core=True) == fetch(orders_query)
+
+
+@pytest.mark.parametrize("as_lists", [False, True])
+def test_batches_match_the_orm_ones(orders_query, as_lists):
+    assert list(iterate_sqla_query_in_batches(
+        orders_query, batch_size=7, use_core=True, as_lists=as_lists)) == \
+        list(iterate_sqla_query_in_batches(
+            orders_query, batch_size=7, as_lists=as_lists))
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_csv_matches_the_orm_one(app, orders_query, stream):
+    def render(use_core):
+        with app.test_request_context("/orders"):
+            return construct_csv_response_from_query(
+                orders_query, stream=stream, use_core=use_core).get_data()
+    assert render(True) == render(False)
+    assert b"customer_name" in render(True).split(b"\r\n")[0]
+
+
+def test_keyset_cursors_keep_the_attribute_keys(app, session):
+    q = session.query(Order.id, Order.customer_name)
+    args = {
+        "pagination": "keyset", "per_page": 7, "order_by": "customer_name"}
+    rows = []
+    for _ in range(10):
+        with app.test_request_context("/orders", query_string=args):
+            page = json.loads(construct_response_from_query(
+                q, use_core=True, count_strategy="none").get_data())
+        rows.extend(
+            (row["customer_name"], row["id"]) for row in page["data"])
+        if page["next_cursor"] is None:
+            break
+        args["cursor"] = page["next_cursor"]
+    assert rows == sorted(
+        ("customer {}".format(i % 5), i) for i in range(1, 51))
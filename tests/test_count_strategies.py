@@ -0,0 +1,74 @@
+"""Tests for the count strategies of json query responses."""
+
+import json
+
+import pytest
+from sqlalchemy import literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnClause
+
+from dboard.response_generators import construct_json_response_from_query
+from dboard.utils import get_query_cache_key
+
+from .models import Order
+
+
+def fetch_meta(app, q, url, count_strategy):
+    with app.test_request_context(url):
+        payload = json.loads(construct_json_response_from_query(
+            q, count_strategy=count_strategy).get_data())
+    payload.pop("data")
+    return payload
+
+
+@pytest.mark.parametrize(
+    "count_strategy", ["query", "window", "cached", "estimate"])
+def test_count_strategies_agree(app, session, count_strategy):
+    q = session.query(Order.id, Order.amount).filter(Order.id > 10)
+    meta = fetch_meta(app, q, "/orders?page=2&per_page=15", count_strategy)
+    assert meta["total_items"] == 40
+    assert meta["total_pages"] == 3
+
+
+def test_exact_counts_are_not_flagged_as_estimates(app, session):
+    # sqlite has no planner estimate, so the rows are counted
+    q = session.query(Order.id)
+    meta = fetch_meta(app, q, "/orders?page=1&per_page=10", "estimate")
+    assert meta["total_items"] == 50
+    assert "total_items_is_estimate" not in meta
+
+
+def test_window_count_of_a_distinct_query(app, session):
+    q = session.query(Order.customer_name).distinct()
+    meta = fetch_meta(app, q, "/orders?page=1&per_page=2", "window")
+    assert meta["total_items"] == 5
+
+
+def test_none_reports_whether_there_are_more_rows(app, session):
+    q = session.query(Order.id)
+    assert fetch_meta(app, q, "/orders?page=5&per_page=10", "none")[
+        "has_more"] is False
+    assert fetch_meta(app, q, "/orders?page=4&per_page=10", "none")[
+        "has_more"] is True
+
+
+class UpperRegion(ColumnClause):
+    inherit_cache = True
+
+
+@compiles(UpperRegion)
+def compile_upper_region(element, compiler, **kw):
+    return "region"
+
+
+@compiles(UpperRegion, "sqlite")
+def compile_upper_region_on_sqlite(element, compiler, **kw):
+    return "upper(region)"
+
+
+def test_cache_key_is_compiled_for_the_dialect_of_the_session(session):
+    # Both render as region with the default dialect
+    assert get_query_cache_key(
+        session.query(Order.id, UpperRegion("region"))
+    ) != get_query_cache_key(
+        session.query(Order.id, literal_column("region")))
@@ -0,0 +1,33 @@
+"""Tests for the csv responses of queries."""
+
+import pytest
+
+from dboard.response_generators import construct_csv_response_from_query
+
+from .models import Order
+
+
+def render_csv(app, q, url="/orders", **kwargs):
+    with app.test_request_context(url):
+        response = construct_csv_response_from_query(q, **kwargs)
+        return response.is_streamed, response.get_data()
+
+
+@pytest.mark.parametrize("url", ["/orders", "/orders?page=2&per_page=7"])
+@pytest.mark.parametrize("use_core", [False, True])
+def test_streamed_csv_equals_the_buffered_one(app, session, url, use_core):
+    q = session.query(Order.id, Order.region, Order.amount).order_by(Order.id)
+    streamed, streamed_data = render_csv(
+        app, q, url, stream=True, batch_size=4, use_core=use_core)
+    buffered, buffered_data = render_csv(app, q, url, use_core=use_core)
+    assert streamed and not buffered
+    assert streamed_data == buffered_data
+    assert streamed_data.startswith(b"id,region,amount\r\n")
+    assert streamed_data.count(b"\r\n") == (7 if "page" in url else 50)
+    assert not streamed_data.endswith(b"\r\n")
+
+
+def test_streamed_csv_of_an_empty_result_has_the_header_only(app, session):
+    q = session.query(Order.id, Order.amount).filter(Order.id < 0)
+    assert render_csv(app, q, stream=True)[1] == b"id,amount"
+    assert render_csv(app, q)[1] == b"id,amount"
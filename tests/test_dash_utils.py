@@ -0,0 +1,79 @@
+"""Tests for the DataTables built from time indexed DataFrames."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dboard.utils.dash_utils import (
+    convert_daily_df_to_dt, convert_monthly_df_to_dt)
+from dboard.utils.formatters import format_series, format_value
+
+
+TYPES_OF_FIELDS = {"currency": ["revenue"], "percentage": ["conversion"]}
+
+
+@pytest.fixture
+def monthly_df():
+    index = pd.date_range("2020-01-01", periods=30, freq="MS")
+    values = np.arange(30, dtype=float)
+    return pd.DataFrame({
+        "revenue": values * 1234.5,
+        "conversion": np.where(values % 7 == 0, np.nan, values / 3),
+        "order_count": np.arange(30),
+    }, index=index)
+
+
+def format_row(row, name_of_key, field_type_of_key):
+    # Cell by cell, as the DataTables were built before
+    return {
+        name_of_key(k): format_value(v, field_type_of_key(k))
+        for k, v in row.items()}
+
+
+def test_datetime_indexed_rows_match_the_cell_by_cell_ones(monthly_df):
+    field_types = {"revenue": "currency", "conversion": "percentage"}
+    dt = convert_monthly_df_to_dt(
+        monthly_df, dt_id="orders", types_of_fields=TYPES_OF_FIELDS)
+    filled = monthly_df.fillna(0)
+    assert dt.id == "orders"
+    assert [c["id"] for c in dt.columns] == [
+        "period", "revenue", "conversion", "order_count"]
+    assert dt.columns[3]["name"] == "Order count"
+    assert dt.data == [
+        dict(format_row(row, str, field_types.get),
+             period=idx.strftime("%b %Y"))
+        for idx, row in zip(filled.index, filled.to_dict("records"))]
+    assert dt.data[1]["revenue"] == "Rs. 1,234.50"
+    assert dt.data[0]["conversion"] == "0.00 %"
+
+
+def test_datetime_columned_rows_match_the_cell_by_cell_ones(monthly_df):
+    transposed = monthly_df.T
+    dt = convert_daily_df_to_dt(transposed, types_of_fields=TYPES_OF_FIELDS)
+    filled = transposed.fillna(0)
+    field_types = {"revenue": "currency", "conversion": "percentage"}
+    assert dt.id == "table"
+    assert [c["id"] for c in dt.columns] == ["metric"] + [
+        d.strftime("%d %b %Y") for d in monthly_df.index]
+    assert dt.data == [
+        dict(format_row(
+            row, lambda k: k.strftime("%d %b %Y"),
+            lambda k, metric=metric: field_types.get(metric)),
+            metric=metric.replace("_", " ").capitalize())
+        for metric, row in zip(filled.index, filled.to_dict("records"))]
+    assert dt.data[2]["metric"] == "Order count"
+
+
+@pytest.mark.parametrize("field_type", ["currency", "percentage"])
+def test_series_are_formatted_like_their_values(field_type):
+    # Halfway and almost halfway hundredths, signed zeros, values too
+    # large for two decimals and the ones that are not finite
+    values = [
+        0, -0.0, -0.004, 0.005, 0.125, 1.005, 2.675, -2.675, 999.995,
+        1234.5, -1234567.891, 5e13 + 0.125, 1e15 + 0.25, np.nan, np.inf,
+        -np.inf]
+    values += list(np.random.default_rng(0).normal(0, 1e6, 1000))
+    values += list(np.arange(-5000, 5000) / 1000)
+    series = pd.Series(values)
+    assert format_series(series, field_type).tolist() == [
+        format_value(value, field_type) for value in values]
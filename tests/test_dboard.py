@@ -6,7 +6,6 @@ import pytest
 
 from click.testing import CliRunner
 
-from dboard import dboard
 from dboard import cli
 
 
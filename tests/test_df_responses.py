@@ -0,0 +1,57 @@
+"""Tests for the json responses of DataFrames."""
+
+import json
+
+import pandas as pd
+import pytest
+
+from dboard.dboard_flask.df_response_controller import DfResponseController
+from dboard.response_generators import (
+    construct_json_response_from_df, structured)
+
+
+@pytest.fixture
+def orders_df(engine):
+    return pd.read_sql(
+        "SELECT id, region, amount, created_at FROM orders ORDER BY id",
+        engine, parse_dates=["created_at"])
+
+
+@pytest.mark.parametrize("orient", ["records", "split", "columns"])
+def test_payload_equals_the_reparsed_one(orders_df, orient):
+    meta = {"total": len(orders_df)}
+    response = construct_json_response_from_df(
+        orders_df, orient=orient, meta=meta)
+    assert response.mimetype == "application/json"
+    assert json.loads(response.get_data()) == structured(
+        json.loads(orders_df.to_json(orient=orient, date_format="iso")),
+        meta=meta, struct_key="data")
+
+
+def test_dates_are_iso_formatted_and_nans_null(orders_df):
+    payload = json.loads(
+        construct_json_response_from_df(orders_df.head(4)).get_data())
+    assert payload["status"] == "success"
+    assert payload["data"][0]["created_at"] == "2021-01-01T13:00:00.000"
+    assert payload["data"][2]["region"] is None
+
+
+class OrdersDfController(DfResponseController):
+    json_orient = "split"
+
+    def get_df(self, start=None):
+        return self.orders_df
+
+
+@pytest.mark.parametrize("url,orient", [
+    ("/orders", "split"),
+    ("/orders?orient=columns", "columns"),
+    ("/orders?orient=unknown", "split"),
+])
+def test_controllers_take_the_orient_from_the_request(
+        app, orders_df, url, orient):
+    OrdersDfController.orders_df = orders_df
+    with app.test_request_context(url):
+        response = OrdersDfController().render_response()
+    assert json.loads(response.get_data())["data"] == json.loads(
+        orders_df.to_json(orient=orient, date_format="iso"))
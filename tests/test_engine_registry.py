@@ -0,0 +1,51 @@
+"""Tests for the one pooled engine of each data source."""
+
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from dboard.dboard_flask.data_sources import prepare_data_sources
+from dboard.dboard_flask.engine_registry import EngineRegistry
+
+
+def test_every_access_path_shares_the_tuned_engine(app, db_dict):
+    engine_registry = EngineRegistry()
+    prepare_data_sources(
+        {"orders": db_dict}, app, engine_registry=engine_registry,
+        engine_kwargs={"*": {"poolclass": QueuePool, "pool_size": 2}})
+    engine = engine_registry.get_engine("orders")
+    try:
+        assert db_dict["engine"] is engine
+        assert db_dict["db_store"].engine is engine
+        assert db_dict["query_builder"].engine is engine
+        assert isinstance(engine.pool, QueuePool)
+        assert engine.pool.size() == 2
+        assert app.extensions["dboard"]["engine_registry"] is engine_registry
+
+        checkouts = engine_registry.pool_stats("orders")["checkouts"]
+        assert len(db_dict["db_store"].sqltodf("SELECT id FROM orders")) \
+            == 50
+        session = db_dict["query_builder"].session()
+        assert session.execute(text("SELECT count(*) FROM orders")) \
+            .scalar() == 50
+        db_dict["query_builder"].session.remove()
+        stats = engine_registry.pool_stats()["orders"]
+        assert stats["checkouts"] == checkouts + 2
+        assert stats["checkedout"] == 0
+        assert stats["max_checkout_wait"] >= stats["avg_checkout_wait"] >= 0
+    finally:
+        engine_registry.dispose()
+
+
+def test_prewarm_opens_the_connections_the_pool_keeps(engine):
+    engine_registry = EngineRegistry()
+    engine_registry.create_engine(
+        "orders", str(engine.url), poolclass=QueuePool, pool_size=3)
+    try:
+        engine_registry.prewarm()
+        stats = engine_registry.pool_stats("orders")
+        assert stats["checkedin"] == 3
+        assert stats["checkouts"] == 3
+        engine_registry.prewarm(connections=1)
+        assert engine_registry.pool_stats("orders")["checkedin"] == 3
+    finally:
+        engine_registry.dispose()
@@ -0,0 +1,81 @@
+"""Tests for the executor service and the DataFrames shared by its
+worker processes."""
+
+import subprocess
+import sys
+import time
+from concurrent.futures import TimeoutError
+from multiprocessing import shared_memory
+
+import pandas as pd
+import pytest
+
+from dboard.utils.function_utils import (
+    ExecutorService, SharedArrowFrame, share_df, load_shared_df,
+    process_function_runner)
+
+
+def construct_df(rows):
+    return pd.DataFrame({
+        "id": list(range(rows)), "region": ["north", None] * (rows // 2)})
+
+
+@pytest.fixture
+def executor_service():
+    executor_service = ExecutorService(max_threads=2, max_processes=2)
+    yield executor_service
+    executor_service.shutdown()
+
+
+def test_shared_memory_is_imported_on_first_use():
+    code = (
+        "import sys\n"
+        "import dboard.utils.function_utils\n"
+        "print('multiprocessing.shared_memory' in sys.modules)")
+    assert subprocess.check_output(
+        [sys.executable, "-c", code]).decode().strip() == "False"
+
+
+def test_shared_frames_are_unlinked_once_loaded():
+    df = construct_df(10)
+    shared_frame = process_function_runner(construct_df, args=[10])
+    assert isinstance(shared_frame, SharedArrowFrame)
+    assert load_shared_df(shared_frame).equals(df)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=shared_frame.shm_name)
+    assert load_shared_df(share_df(df.head(0))).empty
+
+
+def test_frames_from_worker_processes_outlive_them(executor_service):
+    results = executor_service.run(
+        [(construct_df, [4], {}), (construct_df, [6], {}), (len, ["ab"], {})],
+        use_processes=True)
+    assert results[0].equals(construct_df(4))
+    assert results[1].equals(construct_df(6))
+    assert results[2] == 2
+
+
+def test_named_runs_in_threads(executor_service):
+    assert executor_service.run_named({
+        "small": (construct_df, [2], {}), "count": (len, [[1, 2, 3]], {})
+    })["count"] == 3
+
+
+def test_the_timeout_applies_to_each_task():
+    executor_service = ExecutorService(max_threads=1)
+    try:
+        # Both together take longer than the timeout, neither alone does
+        assert executor_service.run(
+            [(time.sleep, [0.3], {}), (time.sleep, [0.3], {})],
+            timeout=0.5) == [None, None]
+
+        started = []
+        with pytest.raises(TimeoutError):
+            executor_service.run(
+                [(time.sleep, [0.5], {}), (started.append, [1], {})],
+                timeout=0.1)
+        time.sleep(0.6)
+        # The task queued behind the slow one was cancelled
+        assert started == []
+    finally:
+        executor_service.shutdown()
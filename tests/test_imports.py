@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""Tests that importing `dboard` leaves its heavy dependencies
+unloaded."""
+
+import subprocess
+import sys
+
+import pytest
+
+
+HEAVY_MODULES = ("pandas", "numpy", "dash_table", "marshmallow", "pyarrow")
+
+
+def loaded_heavy_modules(statement):
+    """Runs the statement in a fresh interpreter and returns the heavy
+    modules it ended up importing."""
+    code = (
+        "import sys\n{}\n"
+        "print(' '.join(m for m in {!r} if m in sys.modules))")
+    output = subprocess.check_output(
+        [sys.executable, "-c", code.format(statement, HEAVY_MODULES)])
+    return output.decode().split()
+
+
+@pytest.mark.parametrize("statement", [
+    "import dboard",
+    "import dboard.cli",
+    "import dboard.utils",
+    "import dboard.utils.dash_utils",
+    "import dboard.response_generators",
+    "import dboard.dboard_flask",
+    "from dboard import DboardFlask, render_query_response, TimeSeriesCache",
+])
+def test_import_does_not_load_heavy_modules(statement):
+    assert loaded_heavy_modules(statement) == []
+
+
+def test_pandas_is_loaded_on_first_use():
+    assert "pandas" in loaded_heavy_modules(
+        "from dboard.utils import groupby_result_to_pd_series\n"
+        "groupby_result_to_pd_series([('a', 1)])")
+
+
+def test_reexported_names_stay_importable():
+    assert "pandas" in loaded_heavy_modules(
+        "from dboard.utils import pd\n"
+        "from dboard import QueryResponseController, get_cache_key")
+
+
+def test_star_import_and_dir_see_the_reexported_names():
+    assert loaded_heavy_modules(
+        "from dboard import *\n"
+        "import dboard\n"
+        "assert 'render_query_response' in dir(dboard)\n"
+        "assert 'DboardFlask' in dir(dboard)\n"
+        "assert DboardFlask and render_query_response and get_cache_key"
+    ) == []
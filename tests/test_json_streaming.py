@@ -0,0 +1,45 @@
+"""Tests for the streamed json and ndjson responses of queries."""
+
+import json
+
+from dboard.response_generators import construct_response_from_query
+
+from .models import Order
+
+
+def render(app, q, url, **kwargs):
+    with app.test_request_context(url):
+        response = construct_response_from_query(q, **kwargs)
+        return response.is_streamed, response, response.get_data(
+            as_text=True)
+
+
+def test_streamed_json_equals_the_buffered_one(app, session):
+    q = session.query(Order.id, Order.region, Order.amount).order_by(Order.id)
+    url = "/orders?page=2&per_page=15"
+    streamed, _, streamed_text = render(app, q, url, stream=True)
+    buffered, _, buffered_text = render(app, q, url, stream=False)
+    assert streamed and not buffered
+    assert json.loads(streamed_text) == json.loads(buffered_text)
+    assert [row["id"] for row in json.loads(streamed_text)["data"]] == \
+        list(range(16, 31))
+
+
+def test_ndjson_sends_the_meta_then_a_row_per_line(app, session):
+    q = session.query(Order.id, Order.amount).order_by(Order.id)
+    _, response, text = render(app, q, "/orders?format=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in text.splitlines()]
+    assert lines[0]["status"] == "success"
+    assert lines[0]["total_items"] == 50
+    assert lines[1:] == [
+        {"id": i, "amount": i * 1.5} for i in range(1, 51)]
+
+
+def test_streamed_split_layout(app, session):
+    q = session.query(Order.id, Order.amount).order_by(Order.id)
+    _, _, text = render(app, q, "/orders?layout=split", stream=True)
+    payload = json.loads(text)
+    assert payload["layout"] == "split"
+    assert payload["columns"] == ["id", "amount"]
+    assert payload["data"][:2] == [[1, 1.5], [2, 3.0]]
@@ -0,0 +1,77 @@
+"""Tests for the keyset (cursor) pagination of query responses."""
+
+import json
+
+import pytest
+from sqlalchemy import event
+from werkzeug.exceptions import BadRequest
+
+from dboard.response_generators import (
+    construct_response_from_query, encode_keyset_cursor)
+
+from .models import Order
+
+
+def fetch_page(app, q, args):
+    with app.test_request_context("/orders", query_string=dict(
+            args, pagination="keyset")):
+        return json.loads(construct_response_from_query(q).get_data())
+
+
+@pytest.mark.parametrize(
+    "count_strategy", [None, "window", "cached", "none"])
+def test_cursors_walk_through_all_the_rows(app, session, count_strategy):
+    q = session.query(Order.id, Order.amount)
+    # The page arg means nothing to keyset pagination
+    args = {"per_page": 7, "order_by": "amount", "sort": "desc", "page": 2}
+    ids = []
+    totals = []
+    for _ in range(10):
+        with app.test_request_context("/orders", query_string=dict(
+                args, pagination="keyset")):
+            page = json.loads(construct_response_from_query(
+                q, count_strategy=count_strategy).get_data())
+        ids.extend(row["id"] for row in page["data"])
+        totals.append(page.get("total_items"))
+        assert "page" not in page and "total_pages" not in page
+        if page["next_cursor"] is None:
+            break
+        args["cursor"] = page["next_cursor"]
+    assert ids == list(range(50, 0, -1))
+    # The total is that of all the pages, not of the ones left
+    assert totals == [None if count_strategy == "none" else 50] * 8
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!", "bm90IGpzb24", encode_keyset_cursor([1, 2, 3]),
+    encode_keyset_cursor({"id": 1})])
+def test_malformed_cursors_are_bad_requests(app, session, cursor):
+    q = session.query(Order.id, Order.amount)
+    with pytest.raises(BadRequest):
+        fetch_page(app, q, {"order_by": "amount", "cursor": cursor})
+
+
+@pytest.mark.parametrize("args", [{"stream": 1}, {"format": "ndjson"}])
+def test_streamed_pages_are_bad_requests(app, session, args):
+    # Their meta is sent before the row next_cursor comes from is read
+    q = session.query(Order.id, Order.amount)
+    with pytest.raises(BadRequest, match="stream"):
+        fetch_page(app, q, dict(args, order_by="amount"))
+
+
+def test_nullable_order_by_is_a_bad_request(app, session):
+    q = session.query(Order.id, Order.region)
+    with pytest.raises(BadRequest):
+        fetch_page(app, q, {"order_by": "region"})
+
+
+def test_missing_primary_key_fails_before_the_query_runs(
+        app, engine, session):
+    statements = []
+    event.listen(
+        engine, "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement))
+    q = session.query(Order.amount)
+    with pytest.raises(ValueError, match="id"):
+        fetch_page(app, q, {"order_by": "amount"})
+    assert not [s for s in statements if "FROM orders" in s]
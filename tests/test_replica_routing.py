@@ -0,0 +1,128 @@
+"""Tests for the reads routed to the replicas of a data source."""
+
+import json
+
+import pytest
+from sqlalchemy import create_engine
+
+from dboard.dboard_flask import (
+    query_response_controller, attach_slow_query_log)
+from dboard.dboard_flask.data_sources import (
+    SqlaQueryBuilder, prepare_data_sources)
+from dboard.dboard_flask.engine_registry import EngineRegistry
+from dboard.dboard_flask.query_response_controller import (
+    QueryResponseController)
+from dboard.response_generators import render_query_response
+from dboard.utils import ReplicaRouter
+
+from .models import Order, populate_orders
+
+
+@pytest.fixture
+def replica_engine(tmp_path):
+    # Lagging behind the primary, which has 50 orders
+    replica_engine = create_engine(
+        "sqlite:///{}".format(tmp_path / "replica.db"))
+    populate_orders(replica_engine, count=10)
+    yield replica_engine
+    replica_engine.dispose()
+
+
+@pytest.fixture
+def routed_query_engine(engine, replica_engine):
+    # sqlite tells no lag, so the replica only qualifies without a limit
+    query_engine = SqlaQueryBuilder(engine, replica_router=ReplicaRouter(
+        engine, [("replica", replica_engine)]))
+    yield query_engine
+    query_engine.session.remove()
+
+
+@pytest.mark.parametrize("lag_query,max_lag,chosen", [
+    (None, None, "replica"), (None, 5, "primary"), (None, 0, "primary"),
+    ("SELECT 2", 5, "replica"), ("SELECT 2", 1, "primary"),
+])
+def test_replicas_qualify_only_when_known_to_lag_within_the_limit(
+        engine, replica_engine, lag_query, max_lag, chosen):
+    router = ReplicaRouter(
+        engine, [("replica", replica_engine)], lag_query=lag_query)
+    assert router.choose_engine(max_lag=max_lag) is {
+        "primary": engine, "replica": replica_engine}[chosen]
+
+
+def query_orders(session, query_engine, db_base, filter_params=None):
+    return session.query(Order.id, Order.amount).order_by(Order.id)
+
+
+def count_rows(response):
+    body = response.get_data(as_text=True)
+    response.close()
+    if response.mimetype in ("text/csv", "application/x-ndjson"):
+        # After the header, or the line of the meta
+        return len(body.splitlines()) - 1
+    return len(json.loads(body)["data"])
+
+
+STREAMED_URLS = [
+    "/orders?format=csv&stream=1",
+    "/orders?stream=1",
+    "/orders?format=ndjson",
+]
+
+
+@pytest.mark.parametrize("url", STREAMED_URLS + ["/orders"])
+@pytest.mark.parametrize("max_replication_lag,rows", [(0, 50), (None, 10)])
+def test_streamed_responses_read_from_the_engine_of_the_limit(
+        app, routed_query_engine, url, max_replication_lag, rows):
+    with app.test_request_context(url):
+        response = render_query_response(
+            query_orders, routed_query_engine, None,
+            max_replication_lag=max_replication_lag)
+    assert response.is_streamed == (url in STREAMED_URLS)
+    # The rows of streamed responses are read only now
+    assert count_rows(response) == rows
+    assert routed_query_engine.session().read_engine is None
+
+
+class OrdersController(QueryResponseController):
+    max_replication_lag = 0
+
+    def get_datasource_name(self):
+        return "orders"
+
+    def query(self, params=None):
+        return query_orders(self.query_engine.session(), None, None)
+
+
+def test_controllers_stream_from_the_engine_of_the_limit(
+        app, routed_query_engine, monkeypatch):
+    monkeypatch.setattr(
+        query_response_controller, "sqla_query_builder",
+        lambda name: routed_query_engine)
+    monkeypatch.setattr(
+        query_response_controller, "sqla_base", lambda name: None)
+    monkeypatch.setattr(
+        query_response_controller, "get_db_store", lambda name: None)
+    with app.test_request_context("/orders?format=csv&stream=1"):
+        response = OrdersController().render_response()
+    assert response.is_streamed
+    assert count_rows(response) == 50
+
+
+def test_reads_from_the_replicas_are_logged_when_slow(
+        app, db_dict, replica_engine):
+    engine_registry = EngineRegistry()
+    data_sources = {"orders": dict(
+        db_dict, replicas=[{"db_name": replica_engine.url.database}],
+        slow_query_threshold=0)}
+    prepare_data_sources(data_sources, app, engine_registry=engine_registry)
+    slow_query_log = attach_slow_query_log(app, data_sources)
+    query_engine = data_sources["orders"]["query_builder"]
+    try:
+        assert len(query_orders(
+            query_engine.session(), None, None).all()) == 10
+    finally:
+        query_engine.session.remove()
+        engine_registry.dispose()
+    assert any(
+        "FROM orders" in entry["statement"]
+        for entry in slow_query_log.get_entries(db_name="orders"))
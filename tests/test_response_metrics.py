@@ -0,0 +1,32 @@
+"""Tests for the stage timings and counts recorded for the responses."""
+
+import pytest
+
+from dboard.response_generators import (
+    render_query_response, construct_instrumented_response)
+from dboard.utils import MetricsRegistry
+
+from .models import Order
+
+
+def query_orders(session, query_engine, db_base, filter_params=None):
+    return session.query(Order.id, Order.amount).order_by(Order.id)
+
+
+@pytest.mark.parametrize("use_core", [False, True])
+@pytest.mark.parametrize("url", [
+    "/orders", "/orders?stream=1", "/orders?format=csv&stream=1",
+    "/orders?format=ndjson", "/orders?format=arrow"])
+def test_the_rows_and_bytes_sent_are_counted(
+        app, query_engine, url, use_core):
+    metrics_registry = MetricsRegistry()
+    with app.test_request_context(url):
+        response = construct_instrumented_response(
+            lambda: render_query_response(
+                query_orders, query_engine, None, use_core=use_core),
+            endpoint="orders", metrics_registry=metrics_registry)
+    body = response.get_data()
+    response.close()
+    assert metrics_registry.count_totals[("orders", "rows")] == 50
+    assert metrics_registry.count_totals[("orders", "bytes")] == len(body)
+    assert metrics_registry.histograms[("orders", "total")].count == 1
@@ -0,0 +1,104 @@
+"""Tests for the result caches of the responses."""
+
+import json
+
+from flask import Response
+
+from dboard.response_generators import (
+    render_query_response, construct_cached_response, get_controller_name,
+    REGISTERED_RESULT_CACHES)
+from dboard.utils import ResultCache, MetricsRegistry
+
+from .models import Order
+
+
+def query_orders(session, query_engine, db_base, filter_params=None):
+    return session.query(Order.id, Order.amount).order_by(Order.id)
+
+
+def render_orders(app, query_engine, result_cache, url="/orders"):
+    with app.test_request_context(url):
+        response = render_query_response(
+            query_orders, query_engine, None, result_cache=result_cache)
+        return response.status_code, response.get_data()
+
+
+def test_hits_are_counted_and_answer_the_same(app, query_engine):
+    result_cache = ResultCache()
+    miss = render_orders(app, query_engine, result_cache)
+    hit = render_orders(app, query_engine, result_cache)
+    other = render_orders(app, query_engine, result_cache, "/orders?page=2")
+    assert hit == miss
+    assert other != miss
+    assert len(json.loads(miss[1])["data"]) == 50
+    assert result_cache.stats() == {
+        "hits": 1, "misses": 2, "hit_ratio": 1 / 3}
+
+
+def test_hits_keep_the_headers(app):
+    result_cache = ResultCache()
+    constructed = []
+
+    def response_constructor():
+        constructed.append(True)
+        response = Response(b"id,amount", mimetype="text/csv")
+        response.headers["Content-Disposition"] = \
+            "attachment; filename=orders.csv"
+        response.headers["X-Total-Count"] = "50"
+        return response
+
+    with app.test_request_context("/orders"):
+        for _ in range(2):
+            response = construct_cached_response(
+                result_cache, "orders", response_constructor)
+            assert response.headers["Content-Disposition"] == \
+                "attachment; filename=orders.csv"
+            assert response.headers["X-Total-Count"] == "50"
+            assert response.headers["Content-Type"] == \
+                "text/csv; charset=utf-8"
+            assert response.headers["Content-Length"] == "9"
+    assert constructed == [True]
+
+
+def test_hits_and_misses_are_rendered_in_the_metrics():
+    result_cache = ResultCache()
+    result_cache.get("missing")
+    result_cache.set("present", {"data": b""})
+    result_cache.get("present")
+    result_cache.get("present")
+    text = MetricsRegistry().render_prometheus_text(
+        result_caches={"orders": result_cache})
+    assert 'dboard_result_cache_hits_total{endpoint="orders"} 2' in text
+    assert 'dboard_result_cache_misses_total{endpoint="orders"} 1' in text
+
+
+def test_controller_caches_are_registered_by_their_qualified_name(
+        app, query_engine, monkeypatch):
+    from dboard.dboard_flask import query_response_controller
+    from dboard.dboard_flask.query_response_controller import (
+        QueryResponseController)
+    monkeypatch.setattr(
+        query_response_controller, "sqla_query_builder",
+        lambda name: query_engine)
+    monkeypatch.setattr(
+        query_response_controller, "sqla_base", lambda name: None)
+    monkeypatch.setattr(
+        query_response_controller, "get_db_store", lambda name: None)
+
+    class OrdersController(QueryResponseController):
+        result_cache = ResultCache()
+
+        def get_datasource_name(self):
+            return "orders"
+
+        def query(self, params=None):
+            return query_orders(self.query_engine.session(), None, None)
+
+    with app.test_request_context("/orders"):
+        name = get_controller_name(OrdersController())
+        for _ in range(2):
+            assert OrdersController().render_response().status_code == 200
+    assert name == "{}.{}".format(__name__, OrdersController.__qualname__)
+    assert REGISTERED_RESULT_CACHES.pop(name) is \
+        OrdersController.result_cache
+    assert OrdersController.result_cache.stats()["hits"] == 1
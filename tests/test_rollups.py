@@ -0,0 +1,122 @@
+"""Tests for the rollups pre-aggregating the orders."""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+
+from dboard.utils import Rollup
+
+from .models import Order, construct_orders
+
+
+def construct_rollup(engine, **kwargs):
+    return Rollup(
+        "orders", Order, "created_at", {
+            "revenue": ("sum", "amount"),
+            "orders": ("count", "id"),
+            "largest_order": ("max", "amount"),
+        }, dimensions=["region"], engine=engine, **kwargs)
+
+
+def aggregate_orders(orders, label_format="%Y-%m-%d"):
+    buckets = defaultdict(lambda: [0, 0, None])
+    for order in orders:
+        bucket = buckets[
+            (order["created_at"].strftime(label_format), order["region"])]
+        bucket[0] += order["amount"]
+        bucket[1] += 1
+        bucket[2] = max(bucket[2] or 0, order["amount"])
+    return {key: tuple(value) for key, value in buckets.items()}
+
+
+def fetch_buckets(rollup, session, filter_params=None, grain=None):
+    return {
+        (row.day, row.region): (
+            row.revenue, row.orders, row.largest_order)
+        for row in rollup.query(
+            session, filter_params=filter_params, grain=grain).all()}
+
+
+@pytest.fixture
+def rollup(engine):
+    rollup = construct_rollup(engine)
+    rollup.refresh()
+    return rollup
+
+
+def test_refresh_aggregates_the_buckets_with_null_dimensions(
+        rollup, session):
+    assert rollup.is_built()
+    buckets = fetch_buckets(rollup, session)
+    assert buckets == aggregate_orders(construct_orders(50))
+    assert any(region is None for _, region in buckets)
+    assert rollup.watermark == datetime(2021, 1, 1) + timedelta(hours=650)
+
+
+def test_refresh_aggregates_only_the_months_since_the_watermark(
+        engine, rollup, session):
+    orders = construct_orders(50)
+    new_orders = [
+        dict(order, id=order["id"] + 100,
+             created_at=order["created_at"] + timedelta(days=40))
+        for order in orders[:10]]
+    with engine.begin() as connection:
+        connection.execute(Order.__table__.insert(), new_orders)
+    # January, of the watermark, and February
+    assert rollup.refresh() == 2
+    assert rollup.watermark == new_orders[-1]["created_at"]
+    assert fetch_buckets(rollup, session) == aggregate_orders(
+        orders + new_orders)
+
+    with engine.begin() as connection:
+        connection.execute(Order.__table__.delete().where(Order.id == 1))
+    # Only February, so the deleted January order is still counted
+    assert rollup.refresh() == 1
+    assert fetch_buckets(rollup, session) == aggregate_orders(
+        orders + new_orders)
+    assert rollup.refresh(full=True) == 2
+    assert fetch_buckets(rollup, session) == aggregate_orders(
+        orders[1:] + new_orders)
+
+    # Rollups read the watermarks stored in the database
+    assert construct_rollup(engine).is_built()
+    assert not Rollup(
+        "other", Order, "created_at", {"orders": ("count", "id")},
+        engine=engine).is_built()
+
+
+def test_query_combines_the_buckets_into_coarser_grains(rollup, session):
+    assert fetch_buckets(rollup, session, grain="month") == aggregate_orders(
+        construct_orders(50), "%Y-%m")
+    with pytest.raises(ValueError):
+        construct_rollup(rollup.engine, grain="month").query(
+            session, grain="day")
+
+
+def test_query_filters_on_the_time_range_and_dimensions(rollup, session):
+    buckets = fetch_buckets(rollup, session, {
+        "start": "2021-01-05", "end": "2021-01-10", "region": "north"})
+    assert buckets == {
+        key: value
+        for key, value in aggregate_orders(construct_orders(50)).items()
+        if "2021-01-05" <= key[0] < "2021-01-10" and key[1] == "north"}
+    assert buckets
+    buckets = fetch_buckets(rollup, session, {"region": ["east", "south"]})
+    assert {region for _, region in buckets} == {"east", "south"}
+    assert sum(orders for _, orders, _ in buckets.values()) == 26
+
+
+@pytest.mark.parametrize("filter_params,grain,answerable", [
+    (None, None, True),
+    ({"region": "north"}, None, True),
+    ('{"start": "2021-01-05", "end": null}', None, True),
+    ({"start": "2021-01-05T06:00:00"}, None, False),
+    ({"start": "2021-01-05"}, "month", False),
+    ({"start": "2021-02-01", "region": ["north"]}, "month", True),
+    ({"customer": "customer 1"}, None, False),
+    ({"start": "yesterday"}, None, False),
+])
+def test_can_answer(engine, filter_params, grain, answerable):
+    assert construct_rollup(engine).can_answer(
+        filter_params, grain=grain) is answerable
@@ -0,0 +1,49 @@
+"""Tests for the schema fingerprints guarding the metadata cache."""
+
+from sqlalchemy import text
+
+from dboard.dboard_flask.data_sources import (
+    compute_schema_fingerprint, reflect_metadata)
+
+
+def execute(engine, statement):
+    with engine.begin() as conn:
+        conn.execute(text(statement))
+
+
+def test_fingerprint_changes_with_the_indexes(engine):
+    before = compute_schema_fingerprint(engine)
+    assert compute_schema_fingerprint(engine) == before
+    execute(engine, "CREATE INDEX ix_orders_region ON orders (region)")
+    with_index = compute_schema_fingerprint(engine)
+    assert with_index != before
+    execute(engine, "DROP INDEX ix_orders_region")
+    execute(engine, "CREATE INDEX ix_orders_region ON orders (amount)")
+    assert compute_schema_fingerprint(engine) not in (before, with_index)
+
+
+def test_fingerprint_changes_with_the_foreign_keys(engine):
+    execute(engine, "CREATE TABLE refunds (id INTEGER PRIMARY KEY, "
+                    "order_id INTEGER)")
+    before = compute_schema_fingerprint(engine)
+    execute(engine, "DROP TABLE refunds")
+    execute(engine, "CREATE TABLE refunds (id INTEGER PRIMARY KEY, "
+                    "order_id INTEGER REFERENCES orders (id))")
+    assert compute_schema_fingerprint(engine) != before
+
+
+def test_fingerprint_of_a_list_of_queries(engine):
+    assert compute_schema_fingerprint(
+        engine, fingerprint_query="SELECT name FROM sqlite_master"
+    ) == compute_schema_fingerprint(
+        engine, fingerprint_query=["SELECT name FROM sqlite_master"])
+
+
+def test_cached_metadata_is_reflected_again_on_an_index_change(
+        engine, tmp_path):
+    metadata = reflect_metadata(engine, db_name="orders", cache_dir=tmp_path)
+    assert not metadata.tables["orders"].indexes
+    execute(engine, "CREATE INDEX ix_orders_region ON orders (region)")
+    metadata = reflect_metadata(engine, db_name="orders", cache_dir=tmp_path)
+    assert [index.name for index in metadata.tables["orders"].indexes] == [
+        "ix_orders_region"]
@@ -0,0 +1,60 @@
+"""Tests for the slow query log and the EXPLAINs it runs."""
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from dboard.utils import SlowQueryLog, query_source, explain_raw_statement
+
+
+@pytest.fixture
+def slow_query_log(engine):
+    slow_query_log = SlowQueryLog(threshold=0)
+    slow_query_log.attach(engine, db_name="orders")
+    return slow_query_log
+
+
+def test_slow_statements_are_recorded_with_their_plan(engine, slow_query_log):
+    with query_source("orders", {"region": "north"}):
+        with engine.connect() as conn:
+            conn.execute(
+                text("SELECT id FROM orders WHERE region = :region"),
+                {"region": "north"})
+    entry = slow_query_log.get_entries(endpoint="orders")[0]
+    assert entry["db_name"] == "orders"
+    assert entry["filter_params"] == {"region": "north"}
+    assert entry["parameters"] == ["north"]
+    assert entry["error"] is None and entry["plan_error"] is None
+    assert "orders" in str(entry["plan"])
+
+
+def test_failed_statements_are_not_explained(engine, slow_query_log):
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT no_such_column FROM orders"))
+    entry = slow_query_log.get_entries()[0]
+    assert "no_such_column" in entry["error"]
+    assert entry["plan"] is None and entry["plan_error"] is None
+
+    entry = slow_query_log.record(
+        conn, "orders", "SELECT 1", (), 2.0, error="Cancelled")
+    assert entry["plan"] is None and entry["plan_error"] is None
+
+
+def test_failed_explains_leave_the_transaction_usable(engine):
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        conn.execute(text("DELETE FROM orders WHERE id > 10"))
+        with pytest.raises(Exception):
+            explain_raw_statement(
+                conn, "SELECT no_such_column FROM orders", (),
+                "EXPLAIN QUERY PLAN", savepoint=True)
+        assert explain_raw_statement(
+            conn, "SELECT id FROM orders WHERE id = ?", (3, ),
+            "EXPLAIN QUERY PLAN", savepoint=True)
+        assert conn.execute(text("SELECT count(*) FROM orders")).scalar() \
+            == 10
+        transaction.commit()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM orders")).scalar() \
+            == 10
@@ -0,0 +1,108 @@
+"""Tests for the statement timeouts and the sessions of the responses
+whose statements fail."""
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import GatewayTimeout
+
+from dboard.dboard_flask import query_response_controller
+from dboard.dboard_flask.query_response_controller import (
+    QueryResponseController)
+from dboard.response_generators import render_query_response
+from dboard.utils.statement_timeout_utils import get_kill_pool
+
+from .models import Order
+
+
+# Takes seconds on sqlite, unless it is interrupted
+SLOW_CONDITION = text(
+    "(WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c "
+    "WHERE x < 100000000) SELECT max(x) FROM c) > 0")
+
+
+class OrdersController(QueryResponseController):
+    statement_timeout = 0.2
+    query_kind = "fast"
+
+    def get_datasource_name(self):
+        return "orders"
+
+    def query(self, params=None):
+        q = self.query_engine.session().query(Order.id, Order.amount)
+        if self.query_kind == "slow":
+            return q.filter(SLOW_CONDITION)
+        if self.query_kind == "broken":
+            return q.filter(text("no_such_column > 0"))
+        return q.order_by(Order.id)
+
+
+@pytest.fixture
+def controller_app(app, query_engine, monkeypatch):
+    monkeypatch.setattr(
+        query_response_controller, "sqla_query_builder",
+        lambda name: query_engine)
+    monkeypatch.setattr(
+        query_response_controller, "sqla_base", lambda name: None)
+    monkeypatch.setattr(
+        query_response_controller, "get_db_store", lambda name: None)
+    return app
+
+
+def render(app, query_kind, url="/orders"):
+    with app.test_request_context(url):
+        controller = OrdersController()
+        controller.query_kind = query_kind
+        return controller.render_response()
+
+
+@pytest.mark.parametrize("query_kind,error", [
+    ("slow", GatewayTimeout), ("broken", OperationalError)])
+def test_failed_statements_release_the_session(
+        controller_app, session, query_kind, error):
+    session.execute(text("SELECT 1"))
+    assert session.in_transaction()
+    with pytest.raises(error):
+        render(controller_app, query_kind)
+    assert not session.in_transaction()
+    assert render(controller_app, "fast").status_code == 200
+
+
+def test_streamed_responses_release_the_session_once_closed(
+        controller_app, session):
+    response = render(controller_app, "fast", "/orders?format=csv&stream=1")
+    assert response.is_streamed
+    assert response.get_data().count(b"\r\n") == 50
+    assert session.in_transaction()
+    response.close()
+    assert not session.in_transaction()
+
+
+def test_render_query_response_times_out(app, query_engine, session):
+    def query_slow_orders(session, query_engine, db_base,
+                          filter_params=None):
+        return session.query(Order.id).filter(SLOW_CONDITION)
+
+    with app.test_request_context("/orders"):
+        with pytest.raises(GatewayTimeout):
+            render_query_response(
+                query_slow_orders, query_engine, None, statement_timeout=0.2)
+    assert not session.in_transaction()
+
+
+def test_kill_connections_come_from_a_pool_of_their_own(engine):
+    exhausted = create_engine(
+        engine.url, poolclass=QueuePool, pool_size=1, max_overflow=0,
+        pool_timeout=0.1)
+    held = exhausted.connect()
+    try:
+        kill_pool = get_kill_pool(exhausted)
+        assert kill_pool is get_kill_pool(exhausted)
+        assert kill_pool is not exhausted.pool
+        killer = kill_pool.connect()
+        killer.cursor().execute("SELECT 1")
+        killer.close()
+    finally:
+        held.close()
+        exhausted.dispose()
@@ -0,0 +1,47 @@
+"""Tests for the template macros of dboard."""
+
+import os
+
+import jinja2
+import pytest
+from flask import Flask, render_template_string
+
+import dboard.dboard_flask
+from dboard.dboard_flask.template_filters import register_template_filters
+
+
+TEMPLATES_DIR = os.path.join(
+    os.path.dirname(dboard.dboard_flask.__file__), "templates")
+
+
+@pytest.fixture
+def templates_app():
+    app = Flask(__name__)
+    app.jinja_loader = jinja2.FileSystemLoader(TEMPLATES_DIR)
+    register_template_filters(app)
+    return app
+
+
+def render_tabulator(app, layout):
+    with app.app_context():
+        return render_template_string(
+            '{% import "dboard/macros/widgets.html" as widgets %}'
+            '{{ widgets.tabulator("orders", "/orders", layout=layout) }}',
+            layout=layout)
+
+
+def test_layout_is_a_json_string(templates_app):
+    assert 'ajaxParams: {"layout": "split"},' in render_tabulator(
+        templates_app, "split")
+
+
+def test_layout_cannot_break_out_of_the_script(templates_app):
+    script = render_tabulator(
+        templates_app, 'split"}, x: alert(1), y: {"</script>')
+    assert 'ajaxParams: {"layout": "split\\"}, x: alert(1), y: ' \
+        '{\\"\\u003c/script\\u003e"},' in script
+    assert "</script>" not in script
+
+
+def test_layout_params_are_left_out_without_a_layout(templates_app):
+    assert "ajaxParams" not in render_tabulator(templates_app, None)
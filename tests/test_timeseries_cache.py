@@ -0,0 +1,120 @@
+"""Tests for the time-series cache of the DataFrame responses."""
+
+import json
+
+import pandas as pd
+import pytest
+
+from dboard.dboard_flask.df_response_controller import DfResponseController
+from dboard.utils import TimeSeriesCache
+
+# The periods before 2021-01-19 are closed
+NOW = pd.Timestamp("2021-01-20 10:00")
+
+
+class OrdersFetcher(object):
+    """Fetches the amounts of the orders, recording the starts."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.starts = []
+
+    def __call__(self, start=None):
+        self.starts.append(start)
+        sql = "SELECT created_at, amount FROM orders"
+        params = ()
+        if start is not None:
+            sql += " WHERE created_at >= ?"
+            params = (start.to_pydatetime(), )
+        return pd.read_sql(
+            sql + " ORDER BY created_at", self.engine, params=params,
+            parse_dates=["created_at"], index_col="created_at")
+
+
+@pytest.fixture
+def fetch_orders(engine):
+    return OrdersFetcher(engine)
+
+
+def update_amount(engine, order_id, amount):
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "UPDATE orders SET amount = ? WHERE id = ?", (amount, order_id))
+
+
+def test_only_the_open_periods_are_fetched_again(engine, fetch_orders):
+    cache = TimeSeriesCache(freq="D", lookback=1)
+    full_df = fetch_orders()
+    first = cache.get_df(["orders"], fetch_orders, now=NOW)
+    second = cache.get_df(["orders"], fetch_orders, now=NOW)
+    assert fetch_orders.starts == [None, None, pd.Timestamp("2021-01-19")]
+    assert first.equals(full_df) and second.equals(full_df)
+
+    # Order 2 is in a closed period, order 40 in an open one
+    update_amount(engine, 2, 1000.0)
+    update_amount(engine, 40, 2000.0)
+    df = cache.get_df(["orders"], fetch_orders, now=NOW)
+    assert 1000.0 not in df["amount"].values
+    assert 2000.0 in df["amount"].values
+    assert df.index.equals(full_df.index)
+
+
+def test_invalidations_drop_the_cached_rows_since(engine, fetch_orders):
+    cache = TimeSeriesCache(freq="D", lookback=1)
+    for key_parts in (["orders", {"a": 1, "b": 2}], ["other"]):
+        cache.get_df(key_parts, fetch_orders, now=NOW)
+    update_amount(engine, 2, 1000.0)
+
+    # The order of the keys of the filter params does not matter
+    cache.invalidate(["orders", {"b": 2, "a": 1}], since="2021-01-02")
+    df = cache.get_df(["orders", {"a": 1, "b": 2}], fetch_orders, now=NOW)
+    assert fetch_orders.starts[-1] == pd.Timestamp("2021-01-02")
+    assert 1000.0 in df["amount"].values
+    assert df.index.equals(fetch_orders().index)
+
+    cache.invalidate(since="2021-01-01")
+    df = cache.get_df(["other"], fetch_orders, now=NOW)
+    assert fetch_orders.starts[-1] == pd.Timestamp("2021-01-01")
+    assert 1000.0 in df["amount"].values
+
+    cache.invalidate()
+    cache.get_df(["other"], fetch_orders, now=NOW)
+    assert fetch_orders.starts[-1] is None
+
+
+def test_a_new_version_discards_the_cached_periods(fetch_orders):
+    cache = TimeSeriesCache(freq="D", lookback=1)
+    cache.get_df(["orders"], fetch_orders, now=NOW, version=1)
+    cache.get_df(["orders"], fetch_orders, now=NOW, version=1)
+    cache.get_df(["orders"], fetch_orders, now=NOW, version=2)
+    assert fetch_orders.starts == [None, pd.Timestamp("2021-01-19"), None]
+
+
+def test_periods_are_counted_in_the_time_zone():
+    cache = TimeSeriesCache(freq="M", lookback=1, tz="Asia/Kolkata")
+    assert cache.get_refresh_start(
+        pd.Timestamp("2021-03-01 02:00", tz="Asia/Kolkata")) == \
+        pd.Timestamp("2021-02-01", tz="Asia/Kolkata")
+
+
+class OrdersDfController(DfResponseController):
+
+    def get_df(self, start=None):
+        return self.fetch_orders(start)
+
+
+def test_controllers_fetch_the_rows_after_the_cached_periods(
+        app, fetch_orders):
+    OrdersDfController.fetch_orders = staticmethod(fetch_orders)
+    OrdersDfController.timeseries_cache = TimeSeriesCache(
+        freq="D", lookback=1)
+    payloads = []
+    for region in ("north", "south", "north"):
+        with app.test_request_context("/orders"):
+            payloads.append(json.loads(OrdersDfController(
+                params={"region": region}).render_response().get_data()))
+    assert len(payloads[0]["data"]) == 50
+    assert payloads[0] == payloads[1] == payloads[2]
+    # All the orders are long closed
+    assert fetch_orders.starts[0] is None and fetch_orders.starts[1] is None
+    assert fetch_orders.starts[2] > pd.Timestamp("2021-02-01")